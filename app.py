@@ -6,30 +6,528 @@ Application de gestion d'inventaire complète - Toutes fonctionnalités
 
 import os
 import sqlite3
-from flask import Flask, render_template, request, redirect, url_for, jsonify, send_file, make_response
-from datetime import datetime
+import re
+import json
+import base64
+import zlib
+import threading
+import sys
+import time
+import asyncio
+import random
+import logging
+import hashlib
+import cProfile
+import signal
+from flask import Flask, render_template, request, redirect, url_for, jsonify, send_file, make_response, g, Response, stream_with_context
+from datetime import datetime, timedelta, timezone
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from functools import lru_cache
+from itertools import chain
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlencode
+from contextvars import ContextVar
+from markupsafe import Markup, escape
+from werkzeug.http import is_resource_modified
 import io
 import csv
+import math
+import click
+from statistics import NormalDist
+
+try:
+    import numpy  # facultatif : calcul vectorisé des seuils de réapprovisionnement
+except ImportError:
+    numpy = None
 
 app = Flask(__name__)
 
+# Sur Render, utiliser un chemin persistant (résolu une seule fois au démarrage)
+if os.environ.get('BOUTIQUE_DB_PATH'):
+    DB_PATH = os.environ['BOUTIQUE_DB_PATH']
+elif os.environ.get('RENDER'):
+    DB_PATH = '/opt/render/project/src/boutique_mobile.db'
+else:
+    DB_PATH = 'boutique_mobile.db'
+
+# Pragmas appliqués une seule fois, à l'ouverture de chaque connexion
+DB_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('mmap_size', 268435456),   # 256 Mo
+    ('cache_size', -32000),     # ~32 Mo de cache de pages
+    ('temp_store', 'MEMORY'),
+)
+
+class MesureSql:
+    """Compteurs SQL de la requête HTTP en cours (voir /metrics)"""
+    __slots__ = ('requetes', 'duree', 'lignes')
+
+    def __init__(self):
+        self.requetes = 0
+        self.duree = 0.0
+        self.lignes = 0
+
+# Mesure de la requête courante, propre à chaque thread / greenlet ; None hors requête HTTP
+mesure_sql = ContextVar('mesure_sql', default=None)
+
+class CurseurBoutique(sqlite3.Cursor):
+    """Curseur qui impute le temps SQL et les lignes lues à la requête HTTP courante"""
+
+    def execute(self, sql, parametres=()):
+        mesure = mesure_sql.get()
+        if mesure is None:
+            return super().execute(sql, parametres)
+        debut = time.perf_counter()
+        try:
+            return super().execute(sql, parametres)
+        finally:
+            mesure.requetes += 1
+            mesure.duree += time.perf_counter() - debut
+
+    def executemany(self, sql, lignes):
+        mesure = mesure_sql.get()
+        if mesure is None:
+            return super().executemany(sql, lignes)
+        debut = time.perf_counter()
+        try:
+            return super().executemany(sql, lignes)
+        finally:
+            mesure.requetes += 1
+            mesure.duree += time.perf_counter() - debut
+
+    def fetchone(self):
+        mesure = mesure_sql.get()
+        if mesure is None:
+            return super().fetchone()
+        debut = time.perf_counter()
+        ligne = super().fetchone()
+        mesure.duree += time.perf_counter() - debut
+        mesure.lignes += ligne is not None
+        return ligne
+
+    def fetchmany(self, size=None):
+        mesure = mesure_sql.get()
+        if mesure is None:
+            return super().fetchmany(size or self.arraysize)
+        debut = time.perf_counter()
+        lignes = super().fetchmany(size or self.arraysize)
+        mesure.duree += time.perf_counter() - debut
+        mesure.lignes += len(lignes)
+        return lignes
+
+    def fetchall(self):
+        mesure = mesure_sql.get()
+        if mesure is None:
+            return super().fetchall()
+        debut = time.perf_counter()
+        lignes = super().fetchall()
+        mesure.duree += time.perf_counter() - debut
+        mesure.lignes += len(lignes)
+        return lignes
+
+    def __next__(self):
+        mesure = mesure_sql.get()
+        if mesure is None:
+            return super().__next__()
+        debut = time.perf_counter()
+        ligne = super().__next__()
+        mesure.duree += time.perf_counter() - debut
+        mesure.lignes += 1
+        return ligne
+
+class ConnexionBoutique(sqlite3.Connection):
+    """Connexion SQLite qui mémorise, pour chaque cache, le dernier PRAGMA data_version vu
+    
+    Les curseurs (y compris ceux de conn.execute) sont des CurseurBoutique, mesurés pour /metrics.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.versions_vues = {}
+
+    def cursor(self, factory=CurseurBoutique):
+        return super().cursor(factory)
+
+    # conn.execute() natif crée un sqlite3.Cursor simple : passer par CurseurBoutique
+    def execute(self, sql, parametres=()):
+        return self.cursor().execute(sql, parametres)
+
+    def executemany(self, sql, lignes):
+        return self.cursor().executemany(sql, lignes)
+
+class ConnectionPool:
+    """Pool de connexions SQLite propre à chaque processus worker"""
+
+    def __init__(self, db_path, max_idle=8):
+        self.db_path = db_path
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False, factory=ConnexionBoutique)
+        conn.row_factory = sqlite3.Row
+        for pragma, valeur in DB_PRAGMAS:
+            conn.execute(f'PRAGMA {pragma} = {valeur}')
+        return conn
+
+    def acquire(self):
+        """Emprunter une connexion (réutilisée si possible)"""
+        with self._lock:
+            # Après un fork (gunicorn), ne jamais réutiliser les connexions du parent
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._idle = []
+                self.hits = self.misses = 0
+            if self._idle:
+                self.hits += 1
+                return self._idle.pop()
+            self.misses += 1
+        return self._connect()
+
+    def release(self, conn):
+        """Rendre une connexion au pool (transaction en cours annulée)"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            return
+        with self._lock:
+            if self._pid == os.getpid() and len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'pid': self._pid,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+                'idle': len(self._idle),
+                'max_idle': self.max_idle
+            }
+
+db_pool = ConnectionPool(DB_PATH)
+
 def get_db_connection():
-    """Connexion SQLite avec persistance Render"""
-    # Sur Render, utiliser un chemin persistant
-    if os.environ.get('RENDER'):
-        db_path = '/opt/render/project/src/boutique_mobile.db'
-    else:
-        db_path = 'boutique_mobile.db'
+    """Connexion SQLite de la requête courante (une par thread, rendue au pool en fin de requête)"""
+    if 'db' not in g:
+        g.db = db_pool.acquire()
+    return g.db
+
+@app.teardown_appcontext
+def release_db_connection(exception=None):
+    """Rend la connexion de la requête au pool"""
+    conn = g.pop('db', None)
+    if conn is not None:
+        db_pool.release(conn)
+
+# Instrumentation des requêtes : histogrammes de latence par route, temps SQL (voir /metrics)
+BORNES_LATENCE = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+class MetriquesRequetes:
+    """Compteurs par (route, méthode), propres à chaque worker
     
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    return conn
+    Chaque worker expose ses propres séries (label pid) : à agréger avec sum by (route).
+    """
 
-def init_database():
-    """Initialise la base de données SQLite"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    def __init__(self, bornes=BORNES_LATENCE):
+        self.bornes = bornes
+        self._lock = threading.Lock()
+        self._series = {}
+        self._statuts = {}
+
+    def enregistrer(self, route, methode, statut, duree, mesure, octets):
+        with self._lock:
+            serie = self._series.get((route, methode))
+            if serie is None:
+                serie = self._series[(route, methode)] = {
+                    'buckets': [0] * (len(self.bornes) + 1),
+                    'nombre': 0, 'duree': 0.0,
+                    'sql_requetes': 0, 'sql_duree': 0.0, 'sql_lignes': 0, 'octets': 0
+                }
+            serie['buckets'][bisect_left(self.bornes, duree)] += 1
+            serie['nombre'] += 1
+            serie['duree'] += duree
+            serie['sql_requetes'] += mesure.requetes
+            serie['sql_duree'] += mesure.duree
+            serie['sql_lignes'] += mesure.lignes
+            serie['octets'] += octets
+            cle = (route, methode, statut)
+            self._statuts[cle] = self._statuts.get(cle, 0) + 1
+
+    def quantile(self, buckets, nombre, q):
+        """Estimation par interpolation linéaire dans les buckets (comme histogram_quantile)"""
+        rang = q * nombre
+        cumul = 0
+        for i, compte in enumerate(buckets):
+            if cumul + compte >= rang and compte:
+                if i == len(self.bornes):
+                    return self.bornes[-1]
+                bas = self.bornes[i - 1] if i else 0.0
+                return bas + (self.bornes[i] - bas) * (rang - cumul) / compte
+            cumul += compte
+        return 0.0
+
+    def exposition(self):
+        """Séries au format texte Prometheus (version 0.0.4)"""
+        with self._lock:
+            series = {cle: dict(serie, buckets=list(serie['buckets'])) for cle, serie in self._series.items()}
+            statuts = dict(self._statuts)
+        pid = os.getpid()
+        lignes = []
+
+        def etiquettes(route, methode, **autres):
+            valeurs = {'pid': pid, 'route': route, 'methode': methode, **autres}
+            return ','.join(f'{nom}="{valeur}"' for nom, valeur in valeurs.items())
+
+        lignes += ['# HELP boutique_http_requetes_total Requêtes HTTP traitées',
+                   '# TYPE boutique_http_requetes_total counter']
+        for (route, methode, statut), nombre in sorted(statuts.items()):
+            lignes.append(f'boutique_http_requetes_total{{{etiquettes(route, methode, statut=statut)}}} {nombre}')
+
+        lignes += ['# HELP boutique_http_duree_secondes Durée des requêtes HTTP',
+                   '# TYPE boutique_http_duree_secondes histogram']
+        for (route, methode), serie in sorted(series.items()):
+            cumul = 0
+            for borne, compte in zip(self.bornes + ('+Inf',), serie['buckets']):
+                cumul += compte
+                lignes.append(f'boutique_http_duree_secondes_bucket{{{etiquettes(route, methode, le=borne)}}} {cumul}')
+            lignes.append(f'boutique_http_duree_secondes_sum{{{etiquettes(route, methode)}}} {serie["duree"]:.6f}')
+            lignes.append(f'boutique_http_duree_secondes_count{{{etiquettes(route, methode)}}} {serie["nombre"]}')
+
+        lignes += ['# HELP boutique_http_duree_quantile_secondes p50/p95/p99 estimés depuis l\'histogramme',
+                   '# TYPE boutique_http_duree_quantile_secondes gauge']
+        for (route, methode), serie in sorted(series.items()):
+            for q in (0.5, 0.95, 0.99):
+                valeur = self.quantile(serie['buckets'], serie['nombre'], q)
+                lignes.append(f'boutique_http_duree_quantile_secondes{{{etiquettes(route, methode, quantile=q)}}} {valeur:.6f}')
+
+        compteurs = (
+            ('boutique_sql_requetes_total', 'sql_requetes', 'Requêtes SQL exécutées', '{}'),
+            ('boutique_sql_duree_secondes_total', 'sql_duree', 'Temps passé dans SQLite (exécution et lecture)', '{:.6f}'),
+            ('boutique_sql_lignes_total', 'sql_lignes', 'Lignes lues depuis SQLite', '{}'),
+            ('boutique_http_reponse_octets_total', 'octets', 'Octets de corps de réponse', '{}'),
+        )
+        for nom, champ, aide, format_valeur in compteurs:
+            lignes += [f'# HELP {nom} {aide}', f'# TYPE {nom} counter']
+            for (route, methode), serie in sorted(series.items()):
+                lignes.append(f'{nom}{{{etiquettes(route, methode)}}} {format_valeur.format(serie[champ])}')
+        return lignes
+
+metriques_requetes = MetriquesRequetes()
+
+# Profilage cProfile à la demande : dossier de sortie (désactivé si vide), puis en-tête X-Profile: 1
+DOSSIER_PROFILS = os.environ.get('BOUTIQUE_PROFILAGE', '')
+
+@app.before_request
+def demarrer_mesure():
+    g.debut_requete = time.perf_counter()
+    g.mesure_sql = MesureSql()
+    mesure_sql.set(g.mesure_sql)
+    if DOSSIER_PROFILS and request.headers.get('X-Profile') == '1':
+        g.profileur = cProfile.Profile()
+        g.profileur.enable()
+
+@app.after_request
+def terminer_mesure(response):
+    if 'debut_requete' not in g:
+        return response
+    profileur = g.pop('profileur', None)
+    if profileur is not None:
+        profileur.disable()
+        nom = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{request.endpoint or 'inconnue'}.prof"
+        os.makedirs(DOSSIER_PROFILS, exist_ok=True)
+        profileur.dump_stats(os.path.join(DOSSIER_PROFILS, nom))
+        response.headers['X-Profile-Dump'] = nom
+    
+    route = request.url_rule.rule if request.url_rule else 'non_trouvee'
+    debut, mesure = g.debut_requete, g.mesure_sql
+    methode, statut = request.method, response.status_code
+    
+    def enregistrer(octets):
+        metriques_requetes.enregistrer(route, methode, statut, time.perf_counter() - debut, mesure, octets)
+        mesure_sql.set(None)
+    
+    if not response.is_streamed:
+        enregistrer(response.calculate_content_length() or 0)
+        return response
     
+    # Réponse en flux (exports) : mesurée à la fin de l'envoi, SQL du générateur compris
+    octets = [0]
+    def compter(morceaux):
+        for morceau in morceaux:
+            octets[0] += len(morceau)
+            yield morceau
+    response.response = compter(response.response)
+    response.call_on_close(lambda: enregistrer(octets[0]))
+    return response
+
+@app.route('/metrics')
+def metrics():
+    """Métriques du worker au format texte Prometheus"""
+    lignes = metriques_requetes.exposition()
+    pid = os.getpid()
+    jauges = [
+        ('boutique_pool_connexions_inactives', 'Connexions SQLite inactives dans le pool', db_pool.stats()['idle']),
+        ('boutique_sse_abonnes', 'Flux /api/changes/stream ouverts', diffuseur_changements.abonnes),
+    ]
+    for nom, aide, valeur in jauges:
+        lignes += [f'# HELP {nom} {aide}', f'# TYPE {nom} gauge', f'{nom}{{pid="{pid}"}} {valeur}']
+    
+    lignes += ['# HELP boutique_cache_acces_total Accès aux caches du worker',
+               '# TYPE boutique_cache_acces_total counter']
+    for nom, cache in (('codes_barres', cache_codes), ('categories', cache_categories)):
+        stats = cache.stats()
+        for resultat in ('hits', 'misses'):
+            lignes.append(f'boutique_cache_acces_total{{pid="{pid}",cache="{nom}",resultat="{resultat}"}} {stats[resultat]}')
+    
+    return Response('\n'.join(lignes) + '\n', mimetype='text/plain; version=0.0.4')
+
+class CacheGeneration(ABC):
+    """Base des caches propres à chaque worker, invalidés par un compteur de la table generations
+    
+    Invalidation :
+    - écritures de ce worker : invalider() depuis les routes qui modifient la table ;
+    - autres connexions et autres workers : le PRAGMA data_version de la connexion change
+      à chaque commit étranger, et le compteur generations.<nom> (triggers) dit si la
+      table du cache est concernée.
+    """
+
+    def __init__(self, nom):
+        self.nom = nom
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._generation = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @abstractmethod
+    def _vider(self):
+        """Oublie toutes les entrées du cache (appelé sous self._lock)"""
+
+    def _synchroniser(self, conn):
+        """Vide le cache si la table a été modifiée par une autre connexion ; retourne la génération courante"""
+        if self._pid != os.getpid():
+            # Après un fork (gunicorn), repartir d'un cache vide
+            with self._lock:
+                self._pid = os.getpid()
+                self._vider()
+                self._generation = None
+                self.hits = self.misses = self.invalidations = 0
+        version = conn.execute('PRAGMA data_version').fetchone()[0]
+        if version == conn.versions_vues.get(self.nom) and self._generation is not None:
+            return self._generation
+        conn.versions_vues[self.nom] = version
+        generation = conn.execute('SELECT valeur FROM generations WHERE nom = ?', (self.nom,)).fetchone()[0]
+        with self._lock:
+            if generation != self._generation:
+                if self._generation is not None:
+                    self.invalidations += 1
+                self._vider()
+                self._generation = generation
+            return generation
+
+    def invalider(self):
+        """À appeler après toute écriture de ce worker sur la table du cache"""
+        with self._lock:
+            self._vider()
+            # Relire la génération (qui inclut notre écriture) avant de recommencer à mémoriser
+            self._generation = None
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'pid': self._pid,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+                'invalidations': self.invalidations,
+                'generation': self._generation
+            }
+
+class CacheCodesBarres(CacheGeneration):
+    """Cache LRU borné code-barres -> produit"""
+
+    def __init__(self, taille_max=4096, ttl=60.0):
+        super().__init__('produits')
+        self.taille_max = taille_max
+        self.ttl = ttl
+        self._entrees = OrderedDict()  # code -> (expiration, produit)
+
+    def _vider(self):
+        self._entrees.clear()
+
+    def produit(self, conn, code):
+        """Produit (dict) portant exactement ce code-barres, ou None"""
+        generation = self._synchroniser(conn)
+        maintenant = time.monotonic()
+        with self._lock:
+            entree = self._entrees.get(code)
+            if entree is not None and entree[0] > maintenant:
+                self._entrees.move_to_end(code)
+                self.hits += 1
+                return dict(entree[1])
+            self.misses += 1
+        ligne = conn.execute('SELECT * FROM produits WHERE code_barres = ?', (code,)).fetchone()
+        if ligne is None:
+            return None
+        with self._lock:
+            # Invalidé pendant la lecture : la ligne est peut-être déjà périmée
+            if generation == self._generation:
+                self._entrees[code] = (time.monotonic() + self.ttl, dict(ligne))
+                while len(self._entrees) > self.taille_max:
+                    self._entrees.popitem(last=False)
+        return dict(ligne)
+
+    def stats(self):
+        stats = super().stats()
+        with self._lock:
+            stats.update(entrees=len(self._entrees), taille_max=self.taille_max, ttl=self.ttl)
+        return stats
+
+class CacheCategories(CacheGeneration):
+    """Liste des catégories triée par nom (elles ne changent que quelques fois par mois)"""
+
+    def __init__(self):
+        super().__init__('categories')
+        self._categories = None
+
+    def _vider(self):
+        self._categories = None
+
+    def categories(self, conn):
+        """Liste de dicts, partagée entre les requêtes : à ne pas modifier"""
+        generation = self._synchroniser(conn)
+        with self._lock:
+            if self._categories is not None:
+                self.hits += 1
+                return self._categories
+            self.misses += 1
+        categories = [dict(cat) for cat in conn.execute('SELECT * FROM categories ORDER BY nom')]
+        with self._lock:
+            if generation == self._generation:
+                self._categories = categories
+        return categories
+
+cache_codes = CacheCodesBarres()
+cache_categories = CacheCategories()
+
+def _migration_schema_initial(cursor):
+    """Tables catégories/produits et données par défaut"""
     # Table catégories
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS categories (
@@ -104,22 +602,519 @@ def init_database():
                 )
             except:
                 pass
+
+def _migration_index_produits(cursor):
+    """Index des filtres, tris et vues de stock de la liste des produits"""
+    # Tri par nom (accueil, liste, gestion du stock, export)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_produits_nom ON produits (nom)')
+    # Filtre par catégorie trié par nom, GROUP BY categorie des statistiques
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_produits_categorie_nom ON produits (categorie, nom)')
+    # Filtres/tri sur le stock ; couvrant pour SUM(stock * prix)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_produits_stock_prix ON produits (stock, prix)')
+    # Filtres min/max et tri sur le prix
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_produits_prix ON produits (prix)')
+    # Index partiels des vues /ruptures et /stock-faible (quelques lignes seulement)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_produits_ruptures ON produits (nom) WHERE stock = 0')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_produits_stock_faible ON produits (stock) WHERE stock <= 5')
+    # Statistiques pour que le planificateur choisisse le bon index
+    cursor.execute('ANALYZE produits')
+
+def _migration_recherche_fts(cursor):
+    """Index plein texte FTS5 (nom + fragments de code-barres) synchronisé par triggers"""
+    # Ligne présente seulement dans la transaction d'un import en masse (retirée avant COMMIT) :
+    # les triggers d'indexation s'effacent, l'import indexe son lot d'un bloc ; invisible des
+    # autres connexions, dont les écritures restent indexées ligne à ligne
+    cursor.execute('CREATE TABLE IF NOT EXISTS ecriture_en_masse (actif INTEGER NOT NULL)')
+    try:
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS produits_fts USING fts5(
+                nom, content='produits', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2', prefix='2 3 4'
+            )
+        ''')
+    except sqlite3.OperationalError as e:
+        # SQLite compilé sans FTS5 : la recherche reste en LIKE
+        print(f"⚠️ FTS5 indisponible, recherche par LIKE conservée: {e}")
+        return
     
-    conn.commit()
-    conn.close()
+    # Index séparé pour les codes-barres : préfixes plus longs, pas de suppression des accents
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS produits_codes_fts USING fts5(
+            code_barres, content='produits', content_rowid='id',
+            tokenize='unicode61', prefix='3 4 6 8'
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS produits_fts_insert AFTER INSERT ON produits
+        WHEN NOT EXISTS (SELECT 1 FROM ecriture_en_masse) BEGIN
+            INSERT INTO produits_fts (rowid, nom) VALUES (new.id, new.nom);
+            INSERT INTO produits_codes_fts (rowid, code_barres) VALUES (new.id, new.code_barres);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS produits_fts_delete AFTER DELETE ON produits BEGIN
+            INSERT INTO produits_fts (produits_fts, rowid, nom) VALUES ('delete', old.id, old.nom);
+            INSERT INTO produits_codes_fts (produits_codes_fts, rowid, code_barres)
+                VALUES ('delete', old.id, old.code_barres);
+        END
+    ''')
+    # Seules les modifications effectives du nom ou du code touchent l'index (pas les mouvements
+    # de stock, ni un upsert qui réécrit le même nom)
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS produits_fts_update AFTER UPDATE OF nom, code_barres ON produits
+        WHEN (old.nom IS NOT new.nom OR old.code_barres IS NOT new.code_barres)
+          AND NOT EXISTS (SELECT 1 FROM ecriture_en_masse) BEGIN
+            INSERT INTO produits_fts (produits_fts, rowid, nom) VALUES ('delete', old.id, old.nom);
+            INSERT INTO produits_codes_fts (produits_codes_fts, rowid, code_barres)
+                VALUES ('delete', old.id, old.code_barres);
+            INSERT INTO produits_fts (rowid, nom) VALUES (new.id, new.nom);
+            INSERT INTO produits_codes_fts (rowid, code_barres) VALUES (new.id, new.code_barres);
+        END
+    ''')
+    
+    # Indexation du catalogue existant
+    cursor.execute("INSERT INTO produits_fts (produits_fts) VALUES ('rebuild')")
+    cursor.execute("INSERT INTO produits_codes_fts (produits_codes_fts) VALUES ('rebuild')")
+
+def _migration_index_pagination(cursor):
+    """Index (colonne, id) pour la pagination par clé sur chaque colonne de tri"""
+    # nom et prix sont déjà couverts (l'id termine implicitement chaque index)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_produits_stock ON produits (stock)')
+    # Colonnes pouvant être NULL : tri et curseur sur IFNULL(colonne, ''), NULL en tête
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_produits_categorie_tri ON produits (IFNULL(categorie, ''))")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_produits_date_tri ON produits (IFNULL(date_creation, ''))")
+    # Tri par catégorie d'une catégorie filtrée (colonne alors non NULL)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_produits_categorie ON produits (categorie)')
+    cursor.execute('ANALYZE produits')
+
+def _migration_parametres(cursor):
+    """Paramètres modifiables à chaud, partagés par tous les workers"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS parametres (
+            cle TEXT PRIMARY KEY,
+            valeur TEXT NOT NULL
+        )
+    ''')
+
+def _migration_generation_produits(cursor):
+    """Compteur de génération du catalogue, incrémenté par trigger à chaque écriture sur produits"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS generations (
+            nom TEXT PRIMARY KEY,
+            valeur INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO generations (nom, valeur) VALUES ('produits', 0)")
+    for evenement in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS produits_generation_{evenement.lower()} AFTER {evenement} ON produits BEGIN
+                UPDATE generations SET valeur = valeur + 1 WHERE nom = 'produits';
+            END
+        ''')
+
+# Produit à stock faible : en stock, mais pas au-dessus de son seuil de réapprovisionnement
+CONDITION_STOCK_FAIBLE = 'stock > 0 AND stock <= seuil_reappro'
+
+# Agrégats par catégorie maintenus par triggers : les statistiques se lisent sans parcourir produits
+SQL_STATS_RECALCUL = '''
+    SELECT IFNULL(categorie, '') AS categorie,
+           COUNT(*) AS nb,
+           SUM(stock = 0) AS ruptures,
+           SUM({stock_faible}) AS stock_faible,
+           SUM(stock) AS stock_total,
+           SUM(stock * prix) AS valeur
+    FROM produits
+    GROUP BY IFNULL(categorie, '')
+'''
+
+def _migration_stats_materialisees(cursor):
+    """Table stats_categories et triggers qui la tiennent à jour"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stats_categories (
+            categorie TEXT PRIMARY KEY,  -- '' pour les produits sans catégorie
+            nb INTEGER NOT NULL DEFAULT 0,
+            ruptures INTEGER NOT NULL DEFAULT 0,
+            stock_faible INTEGER NOT NULL DEFAULT 0,
+            stock_total INTEGER NOT NULL DEFAULT 0,
+            valeur REAL NOT NULL DEFAULT 0
+        )
+    ''')
+    ajout = '''
+        INSERT INTO stats_categories (categorie, nb, ruptures, stock_faible, stock_total, valeur)
+        VALUES (IFNULL(new.categorie, ''), 1, new.stock = 0, new.stock > 0 AND new.stock <= 5,
+                new.stock, new.stock * new.prix)
+        ON CONFLICT (categorie) DO UPDATE SET
+            nb = nb + 1,
+            ruptures = ruptures + excluded.ruptures,
+            stock_faible = stock_faible + excluded.stock_faible,
+            stock_total = stock_total + excluded.stock_total,
+            valeur = valeur + excluded.valeur;
+    '''
+    retrait = '''
+        UPDATE stats_categories SET
+            nb = nb - 1,
+            ruptures = ruptures - (old.stock = 0),
+            stock_faible = stock_faible - (old.stock > 0 AND old.stock <= 5),
+            stock_total = stock_total - old.stock,
+            valeur = valeur - old.stock * old.prix
+        WHERE categorie = IFNULL(old.categorie, '');
+    '''
+    cursor.execute(f'CREATE TRIGGER IF NOT EXISTS produits_stats_insert AFTER INSERT ON produits BEGIN {ajout} END')
+    cursor.execute(f'CREATE TRIGGER IF NOT EXISTS produits_stats_delete AFTER DELETE ON produits BEGIN {retrait} END')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS produits_stats_update AFTER UPDATE OF stock, prix, categorie ON produits
+        WHEN old.stock IS NOT new.stock OR old.prix IS NOT new.prix OR old.categorie IS NOT new.categorie
+        BEGIN {retrait} {ajout} END
+    ''')
+    cursor.execute('DELETE FROM stats_categories')
+    cursor.execute(f'''
+        INSERT INTO stats_categories (categorie, nb, ruptures, stock_faible, stock_total, valeur)
+        {SQL_STATS_RECALCUL.format(stock_faible='stock > 0 AND stock <= 5')}
+    ''')
+
+def _migration_generation_categories(cursor):
+    """Compteur de génération des catégories (cache des catégories)"""
+    cursor.execute("INSERT OR IGNORE INTO generations (nom, valeur) VALUES ('categories', 0)")
+    for evenement in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS categories_generation_{evenement.lower()} AFTER {evenement} ON categories BEGIN
+                UPDATE generations SET valeur = valeur + 1 WHERE nom = 'categories';
+            END
+        ''')
+
+def _migration_generations_horodatees(cursor):
+    """Date de dernière modification de chaque compteur de génération (Last-Modified des API)"""
+    # Identifiant de la base : une base recréée ne doit pas réutiliser les ETag de l'ancienne
+    cursor.execute("INSERT OR IGNORE INTO parametres (cle, valeur) VALUES ('identifiant_base', lower(hex(randomblob(6))))")
+    cursor.execute("ALTER TABLE generations ADD COLUMN modifie_le INTEGER NOT NULL DEFAULT 0")
+    cursor.execute("UPDATE generations SET modifie_le = CAST(strftime('%s', 'now') AS INTEGER)")
+    for table in ('produits', 'categories'):
+        for evenement in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {table}_generation_{evenement.lower()}')
+            cursor.execute(f'''
+                CREATE TRIGGER {table}_generation_{evenement.lower()} AFTER {evenement} ON {table} BEGIN
+                    UPDATE generations SET valeur = valeur + 1, modifie_le = CAST(strftime('%s', 'now') AS INTEGER)
+                    WHERE nom = '{table}';
+                END
+            ''')
+
+def _migration_journal_changements(cursor):
+    """Journal des changements du catalogue (flux /api/changes), alimenté par triggers"""
+    # Flux de synchronisation, distinct du registre_stock (migration 12) : toute écriture sur produits
+    # (nom, prix, création, suppression, stock), quelle qu'en soit l'origine, sous un curseur unique
+    # (rev), et compacté ; le registre ne garde que les écarts de stock, avec motif et route
+    # AUTOINCREMENT : une révision n'est jamais réutilisée, même après compaction
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS mouvements_stock (
+            rev INTEGER PRIMARY KEY AUTOINCREMENT,
+            produit_id INTEGER NOT NULL,
+            operation TEXT NOT NULL,  -- creation, modification, stock, suppression
+            stock_avant INTEGER,
+            stock_apres INTEGER,
+            date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_mouvements_stock_date ON mouvements_stock (date)')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS produits_journal_insert AFTER INSERT ON produits BEGIN
+            INSERT INTO mouvements_stock (produit_id, operation, stock_apres) VALUES (new.id, 'creation', new.stock);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS produits_journal_delete AFTER DELETE ON produits BEGIN
+            INSERT INTO mouvements_stock (produit_id, operation, stock_avant) VALUES (old.id, 'suppression', old.stock);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS produits_journal_update AFTER UPDATE ON produits
+        WHEN old.nom IS NOT new.nom OR old.code_barres IS NOT new.code_barres OR old.prix IS NOT new.prix
+          OR old.stock IS NOT new.stock OR old.categorie IS NOT new.categorie BEGIN
+            INSERT INTO mouvements_stock (produit_id, operation, stock_avant, stock_apres)
+            VALUES (new.id,
+                    CASE WHEN old.nom IS new.nom AND old.code_barres IS new.code_barres AND old.prix IS new.prix
+                              AND old.categorie IS new.categorie THEN 'stock' ELSE 'modification' END,
+                    old.stock, new.stock);
+        END
+    ''')
+
+def _migration_cles_idempotence(cursor):
+    """Clés d'idempotence des mouvements rejoués par le scanner hors ligne"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cles_idempotence (
+            cle TEXT PRIMARY KEY,
+            resultat TEXT NOT NULL,  -- réponse JSON renvoyée telle quelle aux rejeux
+            date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_cles_idempotence_date ON cles_idempotence (date)')
+
+def _migration_registre_stock(cursor):
+    """Registre append-only des mouvements de stock et instantanés périodiques"""
+    # Un mouvement est aussi inscrit au journal mouvements_stock (trigger) : le journal n'a ni motif ni
+    # route d'origine (inconnus d'un trigger) et se compacte, le registre se garde entier (stock à une
+    # date, cumuls des ventes) ; un curseur partagé coûterait sa propre écriture de séquence
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS registre_stock (
+            id INTEGER PRIMARY KEY,
+            produit_id INTEGER NOT NULL,
+            delta INTEGER NOT NULL,
+            stock_apres INTEGER NOT NULL,
+            motif TEXT NOT NULL,   -- entree, sortie, inventaire, casse, vol, retour, creation...
+            source TEXT NOT NULL,  -- route (ou commande) à l'origine du mouvement
+            date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # Historique d'un produit et borne de date d'une reconstruction
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_registre_stock_produit ON registre_stock (produit_id, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_registre_stock_date ON registre_stock (date)')
+    # Ni modification ni suppression : seul l'ajout est permis
+    for operation in ('UPDATE', 'DELETE'):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS registre_stock_{operation.lower()}
+            BEFORE {operation} ON registre_stock BEGIN
+                SELECT RAISE(ABORT, 'registre_stock est en ajout seul');
+            END
+        ''')
+    
+    # Instantané : stock de chaque produit une fois appliqués les mouvements jusqu'à "jusqua"
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS instantanes_stock (
+            id INTEGER PRIMARY KEY,
+            jusqua INTEGER NOT NULL,
+            date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS instantanes_stock_lignes (
+            instantane_id INTEGER NOT NULL,
+            produit_id INTEGER NOT NULL,
+            stock INTEGER NOT NULL,
+            PRIMARY KEY (instantane_id, produit_id)
+        ) WITHOUT ROWID
+    ''')
+    # Point de départ de l'historique : stocks actuels
+    cursor.execute("INSERT INTO instantanes_stock (jusqua) VALUES (0)")
+    cursor.execute('''INSERT INTO instantanes_stock_lignes (instantane_id, produit_id, stock)
+                      SELECT ?, id, stock FROM produits''', (cursor.lastrowid,))
+
+# Migrations versionnées : (version, description, fonction)
+# La version appliquée est enregistrée dans PRAGMA user_version
+# Ventes : sorties du registre cumulées par heure, jour et mois (produit) et par heure et jour (catégorie)
+CATEGORIE_VENTE = "IFNULL((SELECT categorie FROM produits WHERE id = {produit}), '')"
+ROLLUPS_VENTES = (
+    # (table, clé, période, expression de la période)
+    ('ventes_produits_heure', 'produit_id', 'heure', "strftime('%Y-%m-%d %H:00:00', {date})"),
+    ('ventes_produits_jour', 'produit_id', 'jour', 'date({date})'),
+    ('ventes_produits_mois', 'produit_id', 'mois', "strftime('%Y-%m', {date})"),
+    ('ventes_categories_heure', 'categorie', 'heure', "strftime('%Y-%m-%d %H:00:00', {date})"),
+    ('ventes_categories_jour', 'categorie', 'jour', 'date({date})'),
+)
+
+def _migration_ventes_cumulees(cursor):
+    """Cumuls des ventes tenus à jour par trigger sur le registre (aucun parcours des mouvements)"""
+    for table, cle, periode, _ in ROLLUPS_VENTES:
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                {cle} {'INTEGER' if cle == 'produit_id' else 'TEXT'} NOT NULL,
+                {periode} TEXT NOT NULL,
+                quantite INTEGER NOT NULL,
+                PRIMARY KEY ({cle}, {periode})
+            ) WITHOUT ROWID
+        ''')
+        if cle == 'produit_id':
+            # Classement de chaque période (meilleures ventes), couvrant : contient aussi produit_id
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_classement ON {table} ({periode}, quantite)')
+
+    cumuls = ''
+    for table, cle, periode, expression in ROLLUPS_VENTES:
+        valeur_cle = 'new.produit_id' if cle == 'produit_id' else CATEGORIE_VENTE.format(produit='new.produit_id')
+        cumuls += f'''
+            INSERT INTO {table} ({cle}, {periode}, quantite)
+            VALUES ({valeur_cle}, {expression.format(date='new.date')}, -new.delta)
+            ON CONFLICT ({cle}, {periode}) DO UPDATE SET quantite = quantite + excluded.quantite;
+        '''
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS registre_stock_ventes AFTER INSERT ON registre_stock
+        WHEN new.motif = 'sortie' AND new.delta < 0 BEGIN {cumuls} END
+    ''')
+    recalculer_ventes(cursor)
+
+def recalculer_ventes(cursor):
+    """Reconstruit les cumuls des ventes depuis le registre (dans la transaction de l'appelant)
+
+    La catégorie retenue est la catégorie actuelle du produit, celle du jour de la vente
+    n'étant pas conservée au registre.
+    """
+    for table, cle, periode, expression in ROLLUPS_VENTES:
+        valeur_cle = 'produit_id' if cle == 'produit_id' else CATEGORIE_VENTE.format(produit='produit_id')
+        cursor.execute(f'DELETE FROM {table}')
+        cursor.execute(f'''
+            INSERT INTO {table} ({cle}, {periode}, quantite)
+            SELECT {valeur_cle}, {expression.format(date='date')}, -SUM(delta)
+            FROM registre_stock WHERE motif = 'sortie' AND delta < 0
+            GROUP BY 1, 2
+        ''')
+
+def _migration_seuils_reappro(cursor):
+    """Seuil de réapprovisionnement par produit (5 par défaut), au lieu du stock faible fixe <= 5"""
+    # Un seuil calculé vaut au moins une unité (produit sans historique : seuil par défaut conservé)
+    cursor.execute('ALTER TABLE produits ADD COLUMN seuil_reappro INTEGER NOT NULL DEFAULT 5 CHECK (seuil_reappro >= 1)')
+    # Demande journalière lissée du dernier calcul des seuils (flask recalculer-seuils)
+    cursor.execute('ALTER TABLE produits ADD COLUMN demande_jour REAL NOT NULL DEFAULT 0')
+    cursor.execute('DROP INDEX IF EXISTS idx_produits_stock_faible')
+    cursor.execute(f'CREATE INDEX idx_produits_stock_faible ON produits (stock) WHERE {CONDITION_STOCK_FAIBLE}')
+    ajout = '''
+        INSERT INTO stats_categories (categorie, nb, ruptures, stock_faible, stock_total, valeur)
+        VALUES (IFNULL(new.categorie, ''), 1, new.stock = 0, new.stock > 0 AND new.stock <= new.seuil_reappro,
+                new.stock, new.stock * new.prix)
+        ON CONFLICT (categorie) DO UPDATE SET
+            nb = nb + 1,
+            ruptures = ruptures + excluded.ruptures,
+            stock_faible = stock_faible + excluded.stock_faible,
+            stock_total = stock_total + excluded.stock_total,
+            valeur = valeur + excluded.valeur;
+    '''
+    retrait = '''
+        UPDATE stats_categories SET
+            nb = nb - 1,
+            ruptures = ruptures - (old.stock = 0),
+            stock_faible = stock_faible - (old.stock > 0 AND old.stock <= old.seuil_reappro),
+            stock_total = stock_total - old.stock,
+            valeur = valeur - old.stock * old.prix
+        WHERE categorie = IFNULL(old.categorie, '');
+    '''
+    for evenement in ('insert', 'update', 'delete'):
+        cursor.execute(f'DROP TRIGGER IF EXISTS produits_stats_{evenement}')
+    cursor.execute(f'CREATE TRIGGER produits_stats_insert AFTER INSERT ON produits BEGIN {ajout} END')
+    cursor.execute(f'CREATE TRIGGER produits_stats_delete AFTER DELETE ON produits BEGIN {retrait} END')
+    cursor.execute(f'''
+        CREATE TRIGGER produits_stats_update AFTER UPDATE OF stock, prix, categorie, seuil_reappro ON produits
+        WHEN old.stock IS NOT new.stock OR old.prix IS NOT new.prix OR old.categorie IS NOT new.categorie
+          OR old.seuil_reappro IS NOT new.seuil_reappro
+        BEGIN {retrait} {ajout} END
+    ''')
+    cursor.execute('ANALYZE produits')
+
+def _migration_taches(cursor):
+    """File des tâches de fond (exports, imports, recalculs) : SQLite sert de broker"""
+    # AUTOINCREMENT : un identifiant (et son URL de résultat) n'est jamais réutilisé après purge
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS taches (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            type TEXT NOT NULL,
+            parametres TEXT NOT NULL DEFAULT '{}',  -- JSON
+            statut TEXT NOT NULL DEFAULT 'en_attente',  -- en_attente, en_cours, terminee, echouee, annulee
+            progression REAL NOT NULL DEFAULT 0,  -- 0 à 1
+            message TEXT,
+            resultat TEXT,  -- JSON
+            fichier TEXT,  -- résultat téléchargeable, dans DOSSIER_TACHES
+            type_fichier TEXT,
+            erreur TEXT,
+            tentatives INTEGER NOT NULL DEFAULT 0,
+            max_tentatives INTEGER NOT NULL DEFAULT 3,
+            annulation INTEGER NOT NULL DEFAULT 0,  -- demandée pendant l'exécution
+            jeton TEXT,  -- exécution en cours (un par tentative)
+            executer_apres TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            vu_le TIMESTAMP,  -- dernier signe de vie de l'exécution en cours
+            cree_le TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            demarre_le TIMESTAMP,
+            termine_le TIMESTAMP
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_taches_attente ON taches (executer_apres, id) WHERE statut = 'en_attente'")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_taches_en_cours ON taches (vu_le) WHERE statut = 'en_cours'")
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_taches_type ON taches (type, cree_le)')
+    # Signe de vie de chaque pool en marche : sans pool récent, une tâche soumise resterait en attente
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS pools_taches (
+            id TEXT PRIMARY KEY,  -- pid et suffixe aléatoire du pool
+            threads INTEGER NOT NULL,
+            demarre_le TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            vu_le TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+MIGRATIONS = [
+    (1, 'Schéma initial (catégories, produits, données d\'exemple)', _migration_schema_initial),
+    (2, 'Index des filtres, tris et vues de stock des produits', _migration_index_produits),
+    (3, 'Recherche plein texte FTS5 des produits', _migration_recherche_fts),
+    (4, 'Index de pagination par clé', _migration_index_pagination),
+    (5, 'Table des paramètres modifiables à chaud', _migration_parametres),
+    (6, 'Compteur de génération du catalogue (cache des codes-barres)', _migration_generation_produits),
+    (7, 'Statistiques de stock matérialisées par triggers', _migration_stats_materialisees),
+    (8, 'Compteur de génération des catégories (cache des catégories)', _migration_generation_categories),
+    (9, 'Horodatage des compteurs de génération', _migration_generations_horodatees),
+    (10, 'Journal des changements du catalogue', _migration_journal_changements),
+    (11, "Clés d'idempotence des mouvements de stock", _migration_cles_idempotence),
+    (12, 'Registre append-only des mouvements de stock et instantanés', _migration_registre_stock),
+    (13, 'Cumuls horaires, journaliers et mensuels des ventes', _migration_ventes_cumulees),
+    (14, 'Seuils de réapprovisionnement par produit', _migration_seuils_reappro),
+    (15, 'File des tâches de fond', _migration_taches),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+# Recherche plein texte disponible (détectée au démarrage du worker)
+FTS_ACTIVE = False
+
+# Identifiant de la base, préfixe des ETag (lu au démarrage du worker)
+IDENTIFIANT_BASE = ''
+
+def migrate_database(conn):
+    """Applique les migrations manquantes, chacune dans sa propre transaction"""
+    appliquees = []
+    for version, description, migration in MIGRATIONS:
+        # BEGIN IMMEDIATE : un seul worker applique une migration donnée
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            version_actuelle = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version_actuelle >= version:
+                conn.rollback()
+                continue
+            migration(conn.cursor())
+            conn.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+            appliquees.append(version)
+            print(f"✅ Migration {version} appliquée : {description}")
+        except Exception:
+            conn.rollback()
+            raise
+    return appliquees
+
+def init_database():
+    """Initialise la base de données SQLite (migrations au démarrage du worker)"""
+    global FTS_ACTIVE, IDENTIFIANT_BASE
+    conn = db_pool.acquire()
+    try:
+        # Chemin rapide : schéma déjà à jour, une seule lecture du header
+        if conn.execute('PRAGMA user_version').fetchone()[0] < SCHEMA_VERSION:
+            migrate_database(conn)
+        
+        # La table FTS peut manquer (SQLite sans FTS5) : repli sur LIKE
+        try:
+            conn.execute('SELECT rowid FROM produits_fts LIMIT 0')
+            FTS_ACTIVE = True
+        except sqlite3.OperationalError:
+            FTS_ACTIVE = False
+        
+        IDENTIFIANT_BASE = conn.execute(
+            "SELECT valeur FROM parametres WHERE cle = 'identifiant_base'").fetchone()[0]
+    finally:
+        db_pool.release(conn)
 
 def get_categories():
-    """Récupérer toutes les catégories"""
+    """Récupérer toutes les catégories (cache du worker)"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM categories ORDER BY nom')
-        categories = cursor.fetchall()
-        conn.close()
-        return [dict(cat) for cat in categories]
+        return cache_categories.categories(get_db_connection())
     except Exception as e:
         return []
 
+@app.context_processor
+def injecter_categories():
+    """Catégories disponibles dans tous les templates"""
+    return {'categories': get_categories()}
+
 def get_all_products():
     """Récupérer tous les produits pour la gestion du stock"""
     try:
@@ -127,38 +1122,231 @@ def get_all_products():
         cursor = conn.cursor()
         cursor.execute('SELECT * FROM produits ORDER BY nom')
         produits = cursor.fetchall()
-        conn.close()
         return [dict(p) for p in produits]
     except Exception as e:
         return []
 
-def auto_init_database():
-    """Initialise automatiquement la base de données si nécessaire"""
+def get_stats_stock(conn):
+    """Statistiques de stock lues dans stats_categories (quelques lignes, quelle que soit la taille du catalogue)"""
+    categories = conn.execute(
+        'SELECT * FROM stats_categories WHERE nb > 0 ORDER BY nb DESC'
+    ).fetchall()
+    return {
+        'total_produits': sum(c['nb'] for c in categories),
+        'ruptures': sum(c['ruptures'] for c in categories),
+        'stock_faible': sum(c['stock_faible'] for c in categories),
+        'valeur_stock': round(sum(c['valeur'] for c in categories), 2),
+        'top_categories': [
+            {'categorie': c['categorie'] or None, 'count': c['nb'], 'stock_total': c['stock_total']}
+            for c in categories[:5]
+        ]
+    }
+
+def verifier_stats_stock(conn):
+    """Compare stats_categories à un recalcul complet ; retourne la liste des écarts"""
+    attendues = {ligne['categorie']: dict(ligne)
+                 for ligne in conn.execute(SQL_STATS_RECALCUL.format(stock_faible=CONDITION_STOCK_FAIBLE))}
+    stockees = {ligne['categorie']: dict(ligne)
+                for ligne in conn.execute('SELECT * FROM stats_categories WHERE nb != 0')}
+    ecarts = []
+    for categorie in sorted(set(attendues) | set(stockees)):
+        attendu = attendues.get(categorie, {})
+        stocke = stockees.get(categorie, {})
+        for colonne in ('nb', 'ruptures', 'stock_faible', 'stock_total', 'valeur'):
+            a, b = attendu.get(colonne, 0), stocke.get(colonne, 0)
+            # valeur : somme de flottants tenue par additions successives
+            if (abs(a - b) > 0.005 + 1e-9 * abs(a)) if colonne == 'valeur' else a != b:
+                ecarts.append({'categorie': categorie, 'colonne': colonne, 'attendu': a, 'stocke': b})
+    return ecarts
+
+def recalculer_stats_stock(conn):
+    """Reconstruit stats_categories depuis produits"""
+    conn.execute('BEGIN IMMEDIATE')
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        # Test si la table existe
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='produits'")
-        if not cursor.fetchone():
-            conn.close()
-            init_database()
-            print("✅ Base de données auto-initialisée")
-        else:
-            conn.close()
-    except Exception as e:
-        print(f"⚠️ Erreur auto-init: {e}")
-        try:
-            init_database()
-            print("✅ Base de données initialisée après erreur")
-        except Exception as e2:
-            print(f"❌ Erreur critique init: {e2}")
+        conn.execute('DELETE FROM stats_categories')
+        conn.execute(f'''
+            INSERT INTO stats_categories (categorie, nb, ruptures, stock_faible, stock_total, valeur)
+            {SQL_STATS_RECALCUL.format(stock_faible=CONDITION_STOCK_FAIBLE)}
+        ''')
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+
+# Pagination de /produits et /api/produits
+TAILLE_PAGE_DEFAUT = 50
+TAILLE_PAGE_MAX = 500
+
+# Colonnes de tri autorisées pour la liste des produits
+COLONNES_TRI = {
+    'nom': 'nom',
+    'prix': 'prix',
+    'stock': 'stock',
+    'categorie': 'categorie',
+    'date': 'date_creation'
+}
+# Colonnes de tri pouvant être NULL : triées sur IFNULL(colonne, '') (NULL en tête, comme ''),
+# sans quoi un curseur (NULL, id) ne serait jamais dépassé (index d'expression, migration 4)
+COLONNES_TRI_NULLABLES = ('categorie', 'date_creation')
+
+def expressions_fts(recherche):
+    """Expressions MATCH (nom, code-barres) en recherche par préfixe, None si rien à chercher"""
+    mots = re.findall(r'\w+', recherche)
+    if not mots:
+        return None
+    # Nom : tous les mots, chacun en préfixe ("gal sam" trouve "Samsung Galaxy")
+    expression_nom = ' AND '.join(f'"{mot}"*' for mot in mots)
+    # Code-barres : fragment de début de code
+    expression_code = '"' + ' '.join(mots) + '"*'
+    return expression_nom, expression_code
+
+def construire_requete_produits(recherche='', categorie='', stock_filter='',
+                                prix_min='', prix_max='', tri='nom', ordre='asc',
+                                apres=None, limite=None):
+    """Construit la requête filtrée et triée de la liste des produits
+    
+    apres : curseur décodé (valeur de tri, id) de la dernière ligne de la page précédente
+    Retourne (requête, paramètres, colonne de la clé de tri dans les résultats)
+    """
+    params = []
+    expressions = expressions_fts(recherche) if recherche and FTS_ACTIVE else None
+    
+    if expressions:
+        # Recherche plein texte classée par pertinence (bm25) ; CROSS JOIN force
+        # SQLite à partir des correspondances FTS plutôt que de parcourir produits
+        query = '''SELECT p.*, r.rang AS rang FROM (
+            SELECT id, MIN(rang) AS rang FROM (
+                SELECT rowid AS id, bm25(produits_fts) AS rang
+                FROM produits_fts WHERE produits_fts MATCH ?
+                UNION ALL
+                SELECT rowid AS id, bm25(produits_codes_fts) AS rang
+                FROM produits_codes_fts WHERE produits_codes_fts MATCH ?
+            ) GROUP BY id
+        ) r CROSS JOIN produits p WHERE p.id = r.id'''
+        params.extend(expressions)
+    else:
+        query = 'SELECT p.* FROM produits p WHERE 1=1'
+    
+    if recherche and not expressions:
+        # Repli sans FTS5
+        query += ' AND (p.nom LIKE ? OR p.code_barres LIKE ?)'
+        params.extend([f'%{recherche}%', f'%{recherche}%'])
+    
+    if categorie:
+        query += ' AND p.categorie = ?'
+        params.append(categorie)
+    
+    if stock_filter == 'out':
+        query += ' AND p.stock = 0'
+    elif stock_filter == 'low':
+        # Même expression que l'index partiel idx_produits_stock_faible
+        query += f' AND {CONDITION_STOCK_FAIBLE}'
+    elif stock_filter == 'ok':
+        query += ' AND p.stock > p.seuil_reappro'
+    
+    if prix_min:
+        query += ' AND p.prix >= ?'
+        params.append(float(prix_min))
+    
+    if prix_max:
+        query += ' AND p.prix <= ?'
+        params.append(float(prix_max))
+    
+    # Tri (id en second critère : ordre total, nécessaire à la pagination par curseur)
+    if tri == 'pertinence' and expressions:
+        cle, colonne_sql, ordre_sql = 'rang', 'r.rang', 'ASC'
+    else:
+        cle = COLONNES_TRI.get(tri, 'nom')
+        # Filtrée sur une catégorie, la colonne categorie n'est pas NULL : index (categorie, id)
+        nullable = cle in COLONNES_TRI_NULLABLES and not (cle == 'categorie' and categorie)
+        colonne_sql = f"IFNULL(p.{cle}, '')" if nullable else f'p.{cle}'
+        ordre_sql = 'DESC' if ordre == 'desc' else 'ASC'
+    
+    if apres is not None:
+        # Pagination par clé : reprend juste après la dernière ligne vue, via l'index
+        comparaison = '<' if ordre_sql == 'DESC' else '>'
+        valeur, produit_id = apres
+        if colonne_sql.startswith('IFNULL'):
+            valeur = '' if valeur is None else valeur
+            # Borne simple en plus : SQLite n'utilise pas un index d'expression pour une comparaison de lignes
+            query += f' AND {colonne_sql} {comparaison}= ?'
+            params.append(valeur)
+        query += f' AND ({colonne_sql}, p.id) {comparaison} (?, ?)'
+        params.extend([valeur, produit_id])
+    
+    query += f' ORDER BY {colonne_sql} {ordre_sql}, p.id {ordre_sql}'
+    
+    if limite is not None:
+        query += ' LIMIT ?'
+        params.append(limite)
+    
+    return query, params, cle
+
+def encoder_curseur(valeur, produit_id):
+    """Curseur opaque (valeur de tri, id) transmis dans les URLs"""
+    brut = json.dumps([valeur, produit_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(brut).decode().rstrip('=')
+
+def decoder_curseur(curseur):
+    """Décode un curseur produit par encoder_curseur()"""
+    try:
+        brut = base64.urlsafe_b64decode(curseur + '=' * (-len(curseur) % 4))
+        valeur, produit_id = json.loads(brut)
+        if not isinstance(produit_id, int) or isinstance(valeur, (list, dict)):
+            raise ValueError
+    except (ValueError, TypeError):
+        raise ValueError(f'Curseur de pagination invalide: {curseur}')
+    return valeur, produit_id
+
+def lire_limite(valeur, defaut=TAILLE_PAGE_DEFAUT):
+    """Taille de page demandée, bornée à TAILLE_PAGE_MAX"""
+    try:
+        limite = int(valeur)
+    except (TypeError, ValueError):
+        return defaut
+    return max(1, min(limite, TAILLE_PAGE_MAX))
+
+def page_produits(cursor, filtres, limite, curseur=''):
+    """Une page de la liste filtrée des produits et le curseur de la page suivante"""
+    apres = decoder_curseur(curseur) if curseur else None
+    query, params, cle = construire_requete_produits(
+        filtres['recherche'], filtres['categorie'], filtres['stock_filter'],
+        filtres['prix_min'], filtres['prix_max'], filtres['tri'], filtres['ordre'],
+        apres=apres, limite=limite + 1)
+    cursor.execute(query, params)
+    lignes = cursor.fetchall()
+    
+    # Une ligne de plus que la page : indique s'il reste des résultats
+    page = lignes[:limite]
+    curseur_suivant = None
+    if len(lignes) > limite:
+        derniere = page[-1]
+        curseur_suivant = encoder_curseur(derniere[cle], derniere['id'])
+    return [dict(p) for p in page], curseur_suivant
+
+def lire_filtres_produits(args):
+    """Filtres et tri de la liste des produits depuis la query string"""
+    recherche = args.get('q', '').strip()
+    return {
+        'recherche': recherche,
+        'categorie': args.get('cat', '').strip(),
+        'stock_filter': args.get('stock', '').strip(),
+        'prix_min': args.get('prix_min', '').strip(),
+        'prix_max': args.get('prix_max', '').strip(),
+        'tri': args.get('sort', 'pertinence' if recherche else 'nom').strip(),
+        'ordre': args.get('order', 'asc').strip()
+    }
+
+# Schéma prêt dès le démarrage du worker : plus aucune vérification dans les routes
+try:
+    init_database()
+except Exception as e:
+    print(f"❌ Erreur initialisation: {e}")
 
 @app.route('/')
 def index():
     """Page d'accueil avec recherche et aperçu produits"""
     try:
-        # Auto-initialisation de la base de données
-        auto_init_database()
         conn = get_db_connection()
         cursor = conn.cursor()
         
@@ -167,38 +1355,20 @@ def index():
         categorie = request.args.get('cat', '').strip()
         
         # Construction de la requête
-        query = 'SELECT * FROM produits WHERE 1=1'
-        params = []
-        
-        if recherche:
-            query += ' AND (nom LIKE ? OR code_barres LIKE ?)'
-            params.extend([f'%{recherche}%', f'%{recherche}%'])
-        
-        if categorie:
-            query += ' AND categorie = ?'
-            params.append(categorie)
-        
-        query += ' ORDER BY nom LIMIT 12'
+        query, params, _ = construire_requete_produits(recherche, categorie, tri='pertinence', limite=12)
         
         cursor.execute(query, params)
         produits = cursor.fetchall()
         
         # Stats rapides
-        cursor.execute('SELECT COUNT(*) as total FROM produits')
-        total = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) as ruptures FROM produits WHERE stock = 0')
-        ruptures = cursor.fetchone()[0]
-        
-        conn.close()
+        stats = get_stats_stock(conn)
         
         return render_template('index_intuitif.html', 
                              produits=[dict(p) for p in produits],
-                             categories=get_categories(),
                              recherche=recherche,
                              categorie_filtre=categorie,
-                             total=total,
-                             ruptures=ruptures)
+                             total=stats['total_produits'],
+                             ruptures=stats['ruptures'])
         
     except Exception as e:
         return render_template('error.html', error=str(e))
@@ -210,90 +1380,33 @@ def voir_produits():
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        # Paramètres de filtrage
-        recherche = request.args.get('q', '').strip()
-        categorie = request.args.get('cat', '').strip()
-        stock_filter = request.args.get('stock', '').strip()
-        prix_min = request.args.get('prix_min', '').strip()
-        prix_max = request.args.get('prix_max', '').strip()
-        tri = request.args.get('sort', 'nom').strip()
-        ordre = request.args.get('order', 'asc').strip()
-        
-        # Construction de la requête
-        query = 'SELECT * FROM produits WHERE 1=1'
-        params = []
-        
-        if recherche:
-            query += ' AND (nom LIKE ? OR code_barres LIKE ?)'
-            params.extend([f'%{recherche}%', f'%{recherche}%'])
-        
-        if categorie:
-            query += ' AND categorie = ?'
-            params.append(categorie)
-        
-        if stock_filter == 'out':
-            query += ' AND stock = 0'
-        elif stock_filter == 'low':
-            query += ' AND stock > 0 AND stock <= 5'
-        elif stock_filter == 'ok':
-            query += ' AND stock > 5'
-        
-        if prix_min:
-            query += ' AND prix >= ?'
-            params.append(float(prix_min))
-        
-        if prix_max:
-            query += ' AND prix <= ?'
-            params.append(float(prix_max))
-        
-        # Tri
-        colonnes_tri = {
-            'nom': 'nom',
-            'prix': 'prix',
-            'stock': 'stock',
-            'categorie': 'categorie',
-            'date': 'date_creation'
-        }
+        # Paramètres de filtrage et de pagination
+        filtres = lire_filtres_produits(request.args)
+        limite = lire_limite(request.args.get('limit'))
+        curseur = request.args.get('after', '').strip()
         
-        colonne_tri = colonnes_tri.get(tri, 'nom')
-        ordre_sql = 'DESC' if ordre == 'desc' else 'ASC'
-        query += f' ORDER BY {colonne_tri} {ordre_sql}'
+        produits, curseur_suivant = page_produits(cursor, filtres, limite, curseur)
         
-        cursor.execute(query, params)
-        produits = cursor.fetchall()
+        # Liens de pagination : mêmes filtres, autre curseur
+        args_page = {k: v for k, v in request.args.items() if k != 'after'}
+        page_suivante = url_for('voir_produits', **args_page, after=curseur_suivant) if curseur_suivant else None
+        premiere_page = url_for('voir_produits', **args_page) if curseur else None
         
         # Statistiques
-        cursor.execute('SELECT COUNT(*) as total FROM produits')
-        total = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) as ruptures FROM produits WHERE stock = 0')
-        ruptures = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) as stock_faible FROM produits WHERE stock > 0 AND stock <= 5')
-        stock_faible = cursor.fetchone()[0]
-        
-        conn.close()
-        
+        stats_stock = get_stats_stock(conn)
         stats = {
-            'total': total,
-            'ruptures': ruptures,
-            'stock_faible': stock_faible,
+            'total': stats_stock['total_produits'],
+            'ruptures': stats_stock['ruptures'],
+            'stock_faible': stats_stock['stock_faible'],
             'resultats': len(produits)
         }
         
         return render_template('produits_simple.html', 
-                             produits=[dict(p) for p in produits],
-                             categories=get_categories(),
+                             produits=produits,
                              stats=stats,
-                             filtres={
-                                 'recherche': recherche,
-                                 'categorie': categorie,
-                                 'stock_filter': stock_filter,
-                                 'prix_min': prix_min,
-                                 'prix_max': prix_max,
-                                 'tri': tri,
-                                 'ordre': ordre
-                             })
+                             filtres=filtres,
+                             page_suivante=page_suivante,
+                             premiere_page=premiere_page)
         
     except Exception as e:
         return render_template('error.html', error=str(e))
@@ -311,7 +1424,6 @@ def ajouter_produit():
             
             if not nom:
                 return render_template('ajouter.html', 
-                                     categories=get_categories(),
                                      error="Le nom du produit est obligatoire")
             
             # Génération automatique du code-barres si vide
@@ -324,17 +1436,19 @@ def ajouter_produit():
                 'INSERT INTO produits (nom, code_barres, prix, stock, categorie) VALUES (?, ?, ?, ?, ?)',
                 (nom, code_barres, prix, stock, categorie)
             )
+            if stock:
+                # Stock initial inscrit au registre, dans la même transaction
+                cursor.execute(SQL_REGISTRE_STOCK, (cursor.lastrowid, stock, stock, 'creation', 'ajouter'))
             conn.commit()
-            conn.close()
+            cache_codes.invalider()
             
             return redirect(url_for('index'))
             
         except Exception as e:
             return render_template('ajouter.html', 
-                                 categories=get_categories(),
                                  error=f"Erreur: {str(e)}")
     
-    return render_template('ajouter.html', categories=get_categories())
+    return render_template('ajouter.html')
 
 @app.route('/modifier/<int:id>', methods=['GET', 'POST'])
 def modifier_produit(id):
@@ -351,11 +1465,9 @@ def modifier_produit(id):
                 cursor = conn.cursor()
                 cursor.execute('SELECT * FROM produits WHERE id = ?', (id,))
                 produit = cursor.fetchone()
-                conn.close()
                 
                 return render_template('modifier_simple.html', 
                                      produit=dict(produit),
-                                     categories=get_categories(),
                                      error="Le nom du produit est obligatoire")
             
             conn = get_db_connection()
@@ -366,7 +1478,7 @@ def modifier_produit(id):
                 (nom, prix, categorie, id)
             )
             conn.commit()
-            conn.close()
+            cache_codes.invalider()
             
             return redirect(url_for('voir_produits'))
             
@@ -376,11 +1488,9 @@ def modifier_produit(id):
             cursor = conn.cursor()
             cursor.execute('SELECT * FROM produits WHERE id = ?', (id,))
             produit = cursor.fetchone()
-            conn.close()
             
             return render_template('modifier_simple.html', 
                                  produit=dict(produit),
-                                 categories=get_categories(),
                                  error=f"Erreur: {str(e)}")
     
     # GET - Afficher le formulaire
@@ -389,14 +1499,12 @@ def modifier_produit(id):
         cursor = conn.cursor()
         cursor.execute('SELECT * FROM produits WHERE id = ?', (id,))
         produit = cursor.fetchone()
-        conn.close()
         
         if not produit:
             return render_template('error.html', error="Produit non trouvé")
         
         return render_template('modifier_simple.html', 
-                             produit=dict(produit),
-                             categories=get_categories())
+                             produit=dict(produit))
         
     except Exception as e:
         return render_template('error.html', error=str(e))
@@ -407,9 +1515,18 @@ def supprimer_produit(id):
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute('DELETE FROM produits WHERE id = ?', (id,))
-        conn.commit()
-        conn.close()
+        # Le stock restant sort du registre avec le produit (transaction unique)
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            ligne = cursor.execute('SELECT stock FROM produits WHERE id = ?', (id,)).fetchone()
+            if ligne and ligne['stock']:
+                cursor.execute(SQL_REGISTRE_STOCK, (id, -ligne['stock'], 0, 'suppression', 'supprimer'))
+            cursor.execute('DELETE FROM produits WHERE id = ?', (id,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        cache_codes.invalider()
     except Exception as e:
         pass
     
@@ -423,49 +1540,126 @@ def scanner():
 @app.route('/gestion-stock')
 def gestion_stock():
     """Page de gestion du stock (quantités, réapprovisionnement)"""
-    return render_template('gestion_stock.html', produits=get_all_products(), categories=get_categories())
+    return render_template('gestion_stock.html', produits=get_all_products())
 
-@app.route('/ajuster-stock', methods=['POST'])
-def ajuster_stock():
-    """API pour ajuster le stock manuellement"""
+class ErreurStock(Exception):
+    """Mouvement de stock refusé (produit absent, stock insuffisant, quantité invalide)"""
+
+# Une seule instruction conditionnelle par mouvement : pas de lecture-modification-écriture
+SQL_MOUVEMENTS_STOCK = {
+    'ajouter': 'UPDATE produits SET stock = stock + ?1 WHERE id = ?2 RETURNING id, nom, stock',
+    'retirer': 'UPDATE produits SET stock = stock - ?1 WHERE id = ?2 AND stock >= ?1 RETURNING id, nom, stock',
+    # Retrait borné à zéro (API du scanner)
+    'retirer_borne': 'UPDATE produits SET stock = MAX(stock - ?1, 0) WHERE id = ?2 RETURNING id, nom, stock',
+    'definir': 'UPDATE produits SET stock = ?1 WHERE id = ?2 RETURNING id, nom, stock'
+}
+
+def valider_quantite(action, quantite):
+    """Quantité entière d'un mouvement ; ErreurStock si action ou quantité invalide"""
+    if action not in SQL_MOUVEMENTS_STOCK:
+        raise ErreurStock('Action non valide')
     try:
-        data = request.get_json()
-        produit_id = data.get('produit_id')
-        action = data.get('action')  # 'ajouter', 'retirer', 'definir'
-        quantite = int(data.get('quantite', 1))
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM produits WHERE id = ?', (produit_id,))
-        produit = cursor.fetchone()
-        
-        if not produit:
-            conn.close()
-            return jsonify({'success': False, 'message': 'Produit non trouvé'})
-        
-        produit_dict = dict(produit)
-        stock_actuel = produit_dict['stock']
-        
-        if action == 'ajouter':
-            nouveau_stock = stock_actuel + quantite
-        elif action == 'retirer':
-            if stock_actuel < quantite:
-                conn.close()
-                return jsonify({
-                    'success': False, 
-                    'message': f'Stock insuffisant ! Stock actuel: {stock_actuel}, demandé: {quantite}'
-                })
-            nouveau_stock = stock_actuel - quantite
-        elif action == 'definir':
-            nouveau_stock = quantite
+        quantite = int(quantite)
+    except (TypeError, ValueError):
+        raise ErreurStock(f'Quantité invalide: {quantite}')
+    if quantite < 0 or (quantite == 0 and action != 'definir'):
+        raise ErreurStock(f'Quantité invalide: {quantite}')
+    return quantite
+
+# Registre des mouvements (append-only, jamais compacté, contrairement au journal des changements)
+MOTIFS_ACTIONS = {'ajouter': 'entree', 'retirer': 'sortie', 'retirer_borne': 'sortie', 'definir': 'inventaire'}
+# Motifs qu'un client peut préciser (démarque : casse, vol, périmé ; retours clients)
+MOTIFS_STOCK = {'entree', 'sortie', 'inventaire', 'casse', 'vol', 'perime', 'retour'}
+SQL_REGISTRE_STOCK = '''
+    INSERT INTO registre_stock (produit_id, delta, stock_apres, motif, source) VALUES (?, ?, ?, ?, ?)
+'''
+
+def lire_motif(valeur):
+    """Motif facultatif d'un mouvement ; ErreurStock s'il est inconnu"""
+    if valeur in (None, ''):
+        return None
+    if valeur not in MOTIFS_STOCK:
+        raise ErreurStock(f"Motif invalide: {valeur} ({', '.join(sorted(MOTIFS_STOCK))})")
+    return valeur
+
+def appliquer_mouvement(conn, produit_id, action, quantite, source, motif=None, registre=None):
+    """Un mouvement dans la transaction en cours de l'appelant, inscrit au registre
+
+    registre : liste où accumuler les lignes du registre, que l'appelant écrit en une fois
+    (executemany) avant son commit ; sans liste, la ligne est écrite aussitôt.
+    Un refus (ErreurStock) ne modifie rien : la transaction peut continuer
+    """
+    quantite = valider_quantite(action, quantite)
+    stock_precedent = None
+    if action in ('definir', 'retirer_borne'):
+        # Stock précédent non déductible du nouveau (valeur imposée, ou retrait borné à zéro)
+        ligne = conn.execute('SELECT stock FROM produits WHERE id = ?', (produit_id,)).fetchone()
+        stock_precedent = ligne['stock'] if ligne else None
+    
+    resultat = conn.execute(SQL_MOUVEMENTS_STOCK[action], (quantite, produit_id)).fetchone()
+    if resultat is None:
+        # Chemin d'échec uniquement : distinguer produit absent et stock insuffisant
+        ligne = conn.execute('SELECT stock FROM produits WHERE id = ?', (produit_id,)).fetchone()
+        if ligne is None:
+            raise ErreurStock('Produit non trouvé')
+        raise ErreurStock(f'Stock insuffisant ! Stock actuel: {ligne["stock"]}, demandé: {quantite}')
+    
+    nouveau_stock = resultat['stock']
+    if action == 'ajouter':
+        stock_precedent = nouveau_stock - quantite
+    elif action == 'retirer':
+        stock_precedent = nouveau_stock + quantite
+
+    # Un inventaire est tracé même sans écart ; un retrait sur stock nul ne l'est pas
+    if nouveau_stock != stock_precedent or action == 'definir':
+        ligne_registre = (resultat['id'], nouveau_stock - stock_precedent, nouveau_stock,
+                          motif or MOTIFS_ACTIONS[action], source)
+        if registre is None:
+            conn.execute(SQL_REGISTRE_STOCK, ligne_registre)
         else:
-            conn.close()
+            registre.append(ligne_registre)
+
+    return {
+        'id': resultat['id'],
+        'nom': resultat['nom'],
+        'quantite': quantite,
+        'stock_precedent': stock_precedent,
+        'nouveau_stock': nouveau_stock
+    }
+
+def mouvement_stock(conn, produit_id, action, quantite, source, motif=None):
+    """Applique un mouvement de stock de façon atomique (BEGIN IMMEDIATE + UPDATE conditionnel)
+
+    Retourne {'id', 'nom', 'quantite', 'stock_precedent', 'nouveau_stock'} ; lève ErreurStock si refusé
+    """
+    valider_quantite(action, quantite)
+    # Verrou d'écriture pris d'emblée : la transaction ne dure que le temps de l'UPDATE
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        mouvement = appliquer_mouvement(conn, produit_id, action, quantite, source, motif)
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+    cache_codes.invalider()
+    return mouvement
+
+@app.route('/ajuster-stock', methods=['POST'])
+def ajuster_stock():
+    """API pour ajuster le stock manuellement"""
+    try:
+        data = request.get_json()
+        produit_id = data.get('produit_id')
+        action = data.get('action')  # 'ajouter', 'retirer', 'definir'
+        quantite = int(data.get('quantite', 1))
+        
+        if action not in ('ajouter', 'retirer', 'definir'):
             return jsonify({'success': False, 'message': 'Action non valide'})
         
-        # Mise à jour du stock
-        cursor.execute('UPDATE produits SET stock = ? WHERE id = ?', (nouveau_stock, produit_id))
-        conn.commit()
-        conn.close()
+        try:
+            mouvement = mouvement_stock(get_db_connection(), produit_id, action, quantite, 'ajuster-stock')
+        except ErreurStock as e:
+            return jsonify({'success': False, 'message': str(e)})
         
         action_text = {
             'ajouter': f'ajouté {quantite}',
@@ -475,12 +1669,12 @@ def ajuster_stock():
         
         return jsonify({
             'success': True,
-            'message': f'✅ {produit_dict["nom"]}: {action_text} unité(s)',
-            'produit': produit_dict['nom'],
+            'message': f'✅ {mouvement["nom"]}: {action_text} unité(s)',
+            'produit': mouvement['nom'],
             'action': action,
             'quantite': quantite,
-            'stock_precedent': stock_actuel,
-            'nouveau_stock': nouveau_stock
+            'stock_precedent': mouvement['stock_precedent'],
+            'nouveau_stock': mouvement['nouveau_stock']
         })
         
     except Exception as e:
@@ -499,19 +1693,13 @@ def scan():
             return jsonify({'success': False, 'message': 'Code vide'})
         
         conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM produits WHERE code_barres = ?', (code,))
-        produit = cursor.fetchone()
+        produit_dict = cache_codes.produit(conn, code)
         
-        if not produit:
-            conn.close()
+        if not produit_dict:
             return jsonify({'success': False, 'message': f'Produit non trouvé: {code}'})
         
-        produit_dict = dict(produit)
-        
         # Si aucune action spécifiée, retourner les infos du produit pour demander l'action
         if not action:
-            conn.close()
             return jsonify({
                 'success': True,
                 'ask_action': True,
@@ -526,40 +1714,25 @@ def scan():
                 'message': f'Produit trouvé: {produit_dict["nom"]}'
             })
         
-        # Traitement de l'action
-        stock_actuel = produit_dict['stock']
-        
-        if action == 'retirer':
-            if stock_actuel < quantite:
-                conn.close()
-                return jsonify({
-                    'success': False, 
-                    'message': f'❌ Stock insuffisant ! Stock actuel: {stock_actuel}, demandé: {quantite}'
-                })
-            nouveau_stock = stock_actuel - quantite
-            action_text = f'retiré {quantite}'
-        
-        elif action == 'ajouter':
-            nouveau_stock = stock_actuel + quantite
-            action_text = f'ajouté {quantite}'
-        
-        else:
-            conn.close()
+        if action not in ('retirer', 'ajouter'):
             return jsonify({'success': False, 'message': 'Action non valide'})
         
-        # Mise à jour du stock
-        cursor.execute('UPDATE produits SET stock = ? WHERE id = ?', (nouveau_stock, produit_dict['id']))
-        conn.commit()
-        conn.close()
+        # Traitement de l'action (atomique : le stock lu plus haut peut avoir changé)
+        try:
+            mouvement = mouvement_stock(conn, produit_dict['id'], action, quantite, 'scan')
+        except ErreurStock as e:
+            return jsonify({'success': False, 'message': f'❌ {e}'})
+        
+        action_text = f'{"retiré" if action == "retirer" else "ajouté"} {mouvement["quantite"]}'
         
         return jsonify({
             'success': True,
-            'message': f'✅ {produit_dict["nom"]}: {action_text} unité(s)',
-            'produit': produit_dict['nom'],
+            'message': f'✅ {mouvement["nom"]}: {action_text} unité(s)',
+            'produit': mouvement['nom'],
             'action': action,
-            'quantite': quantite,
-            'stock_precedent': stock_actuel,
-            'nouveau_stock': nouveau_stock
+            'quantite': mouvement['quantite'],
+            'stock_precedent': mouvement['stock_precedent'],
+            'nouveau_stock': mouvement['nouveau_stock']
         })
         
     except Exception as e:
@@ -570,43 +1743,18 @@ def statistiques():
     """Page statistiques"""
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Stats générales
-        cursor.execute('SELECT COUNT(*) as total FROM produits')
-        total = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) as ruptures FROM produits WHERE stock = 0')
-        ruptures = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) as stock_faible FROM produits WHERE stock > 0 AND stock <= 5')
-        stock_faible = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT SUM(stock * prix) as valeur FROM produits')
-        result = cursor.fetchone()
-        valeur_stock = result[0] or 0
-        
-        # Top catégories
-        cursor.execute('''
-            SELECT categorie, COUNT(*) as count, SUM(stock) as stock_total 
-            FROM produits 
-            GROUP BY categorie 
-            ORDER BY count DESC 
-            LIMIT 5
-        ''')
-        top_categories = cursor.fetchall()
         
-        conn.close()
+        # Stats générales et top catégories (agrégats matérialisés)
+        stats = get_stats_stock(conn)
         
-        stats = {
-            'total_produits': total,
-            'ruptures': ruptures,
-            'stock_faible': stock_faible,
-            'valeur_stock': round(valeur_stock, 2),
-            'top_categories': [dict(cat) for cat in top_categories]
-        }
+        # Meilleures ventes de la période (cumuls des ventes)
+        debut, fin = lire_fenetre_ventes({})
+        jours = duree_jours(debut, fin)
+        ventes = [dict(nom=vente['nom'], **indicateurs_ventes(vente['quantite'], vente['stock'], jours))
+                  for vente in meilleures_ventes(conn, debut, fin, 5)]
         
-        return render_template('statistiques.html', stats=stats, categories=get_categories())
+        return render_template('statistiques.html', stats=stats, meilleures_ventes=ventes,
+                               jours_ventes=JOURS_FENETRE_VENTES)
         
     except Exception as e:
         return render_template('error.html', error=str(e))
@@ -619,11 +1767,9 @@ def ruptures():
         cursor = conn.cursor()
         cursor.execute('SELECT * FROM produits WHERE stock = 0 ORDER BY nom')
         produits = cursor.fetchall()
-        conn.close()
         
         return render_template('ruptures.html', 
-                             produits=[dict(p) for p in produits],
-                             categories=get_categories())
+                             produits=[dict(p) for p in produits])
         
     except Exception as e:
         return render_template('error.html', error=str(e))
@@ -634,188 +1780,690 @@ def stock_faible():
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM produits WHERE stock > 0 AND stock <= 5 ORDER BY stock ASC')
+        cursor.execute(f'SELECT * FROM produits WHERE {CONDITION_STOCK_FAIBLE} ORDER BY stock ASC')
         produits = cursor.fetchall()
-        conn.close()
         
         return render_template('stock_faible.html', 
-                             produits=[dict(p) for p in produits],
-                             categories=get_categories())
+                             produits=[dict(p) for p in produits])
         
     except Exception as e:
         return render_template('error.html', error=str(e))
 
+# Codes-barres : encodeurs Code128 / EAN-13 en pur Python, rendus en SVG compact
+# Motifs Code128 (largeurs barre/espace alternées, en modules), valeurs 0 à 106
+CODE128_MOTIFS = (
+    '212222', '222122', '222221', '121223', '121322', '131222', '122213', '122312', '132212', '221213',
+    '221312', '231212', '112232', '122132', '122231', '113222', '123122', '123221', '223211', '221132',
+    '221231', '213212', '223112', '312131', '311222', '321122', '321221', '312212', '322112', '322211',
+    '212123', '212321', '232121', '111323', '131123', '131321', '112313', '132113', '132311', '211313',
+    '231113', '231311', '112133', '112331', '132131', '113123', '113321', '133121', '313121', '211331',
+    '231131', '213113', '213311', '213131', '311123', '311321', '331121', '312113', '312311', '332111',
+    '314111', '221411', '431111', '111224', '111422', '121124', '121421', '141122', '141221', '112214',
+    '112412', '122114', '122411', '142112', '142211', '241211', '221114', '413111', '241112', '134111',
+    '111242', '121142', '121241', '114212', '124112', '124211', '411212', '421112', '421211', '212141',
+    '214121', '412121', '111143', '111341', '131141', '114113', '114311', '411113', '411311', '113141',
+    '114131', '311141', '411131', '211412', '211214', '211232', '2331112',
+)
+CODE128_START_B, CODE128_START_C, CODE128_CODE_B, CODE128_CODE_C, CODE128_STOP = 104, 105, 100, 99, 106
+
+# EAN-13 : motifs L (R = complément, G = R inversé) et parité des 6 premiers chiffres selon le premier
+EAN13_L = ('0001101', '0011001', '0010011', '0111101', '0100011',
+           '0110001', '0101111', '0111011', '0110111', '0001011')
+EAN13_PARITES = ('LLLLLL', 'LLGLGG', 'LLGGLG', 'LLGGGL', 'LGLLGG',
+                 'LGGLLG', 'LGGGLG', 'LGLGGL', 'LGLGLG', 'LGGLGL')
+
+def code128_valeurs(code):
+    """Valeurs Code128 (start, données, checksum, stop) : jeu B, jeu C pour les suites de chiffres"""
+    if not code or any(not 32 <= ord(c) <= 126 for c in code):
+        raise ValueError(f'Code-barres non encodable en Code128: {code!r}')
+    valeurs = []
+    jeu = None
+    i = 0
+    while i < len(code):
+        chiffres = 0
+        while i + chiffres < len(code) and code[i + chiffres].isdigit():
+            chiffres += 1
+        # Jeu C (2 chiffres par symbole) rentable à partir de 4 chiffres en bord, 6 au milieu
+        extremite = i == 0 or i + chiffres == len(code)
+        if chiffres >= (4 if extremite else 6):
+            paires = chiffres // 2 * 2
+            if jeu != 'C':
+                valeurs.append(CODE128_START_C if jeu is None else CODE128_CODE_C)
+                jeu = 'C'
+            valeurs.extend(int(code[j:j + 2]) for j in range(i, i + paires, 2))
+            i += paires
+            continue
+        if jeu != 'B':
+            valeurs.append(CODE128_START_B if jeu is None else CODE128_CODE_B)
+            jeu = 'B'
+        valeurs.append(ord(code[i]) - 32)
+        i += 1
+    somme = valeurs[0] + sum(position * valeur for position, valeur in enumerate(valeurs[1:], 1))
+    return valeurs + [somme % 103, CODE128_STOP]
+
+def code128_largeurs(code):
+    """Largeurs alternées barre/espace (en modules) du symbole Code128, hors zones blanches"""
+    return [int(l) for valeur in code128_valeurs(code) for l in CODE128_MOTIFS[valeur]]
+
+def cle_ean13(debut):
+    """Clé de contrôle EAN-13 des 12 premiers chiffres"""
+    somme = sum(int(c) * (3 if position % 2 else 1) for position, c in enumerate(debut))
+    return str((10 - somme % 10) % 10)
+
+def ean13_valide(code):
+    """Vrai si code est un EAN-13 (13 chiffres, clé de contrôle correcte)"""
+    if len(code) != 13 or not code.isdigit():
+        return False
+    return cle_ean13(code[:12]) == code[12]
+
+# Codes attribués par la boutique : préfixe GS1 200-299 (circulation restreinte), jamais celui d'un fabricant
+PREFIXE_EAN13_INTERNE = '200'
+
+def codes_ean13_internes(conn, nombre):
+    """nombre codes EAN-13 internes libres, à la suite du plus grand code à 13 chiffres déjà présent
+    dans la plage (appeler dans la transaction d'écriture qui les attribue)"""
+    motif = PREFIXE_EAN13_INTERNE + '[0-9]' * (13 - len(PREFIXE_EAN13_INTERNE))
+    ligne = conn.execute('SELECT code_barres FROM produits WHERE code_barres GLOB ? '
+                         'ORDER BY code_barres DESC LIMIT 1', (motif,)).fetchone()
+    suivant = int(ligne[0][len(PREFIXE_EAN13_INTERNE):12]) + 1 if ligne else 1
+    largeur = 12 - len(PREFIXE_EAN13_INTERNE)
+    if suivant + nombre > 10 ** largeur:
+        raise ValueError(f"Plage de codes-barres internes {PREFIXE_EAN13_INTERNE} épuisée")
+    debuts = [f'{PREFIXE_EAN13_INTERNE}{numero:0{largeur}d}' for numero in range(suivant, suivant + nombre)]
+    return [debut + cle_ean13(debut) for debut in debuts]
+
+def ean13_largeurs(code):
+    """Largeurs alternées barre/espace (en modules) du symbole EAN-13, hors zones blanches"""
+    if not ean13_valide(code):
+        raise ValueError(f'EAN-13 invalide: {code!r}')
+    modules = '101'
+    for chiffre, parite in zip(code[1:7], EAN13_PARITES[int(code[0])]):
+        motif = EAN13_L[int(chiffre)]
+        if parite == 'G':
+            motif = motif.translate(str.maketrans('01', '10'))[::-1]
+        modules += motif
+    modules += '01010'
+    modules += ''.join(EAN13_L[int(chiffre)].translate(str.maketrans('01', '10')) for chiffre in code[7:])
+    modules += '101'
+    # Modules -> suites de largeurs (commence par une barre)
+    largeurs = []
+    for module in modules:
+        if largeurs and (len(largeurs) % 2 == 1) == (module == '1'):
+            largeurs[-1] += 1
+        else:
+            largeurs.append(1)
+    return largeurs
+
+HAUTEUR_BARRES = 60
+ZONE_BLANCHE = 10  # modules de chaque côté
+
+@lru_cache(maxsize=4096)
+def rendre_code_barres(code, nom='', symbologie='auto'):
+    """SVG (bytes) et ETag d'un code-barres ; mémorisé par (code, nom, symbologie)
+    
+    Toutes les barres forment un seul <path> : une sous-commande par barre, largeurs fusionnées
+    """
+    if symbologie == 'auto':
+        symbologie = 'ean13' if ean13_valide(code) else 'code128'
+    largeurs = ean13_largeurs(code) if symbologie == 'ean13' else code128_largeurs(code)
+    
+    x = ZONE_BLANCHE
+    barres = []
+    for position, largeur in enumerate(largeurs):
+        if position % 2 == 0:
+            barres.append(f'M{x} 0h{largeur}v{HAUTEUR_BARRES}h-{largeur}z')
+        x += largeur
+    largeur_totale = x + ZONE_BLANCHE
+    hauteur = HAUTEUR_BARRES + (28 if nom else 16)
+    
+    texte_nom = (f'<text x="{largeur_totale / 2:g}" y="{HAUTEUR_BARRES + 26}" text-anchor="middle" '
+                 f'font-family="Arial" font-size="8">{escape(nom[:30])}</text>') if nom else ''
+    svg = (f'<svg xmlns="http://www.w3.org/2000/svg" width="{largeur_totale * 2}" height="{hauteur * 2}" '
+           f'viewBox="0 0 {largeur_totale} {hauteur}" shape-rendering="crispEdges">'
+           f'<rect width="{largeur_totale}" height="{hauteur}" fill="white"/>'
+           f'<path fill="black" d="{"".join(barres)}"/>'
+           f'<text x="{largeur_totale / 2:g}" y="{HAUTEUR_BARRES + 12}" text-anchor="middle" '
+           f'font-family="monospace" font-size="10">{escape(code)}</text>'
+           f'{texte_nom}</svg>').encode('utf-8')
+    return svg, hashlib.sha1(svg).hexdigest()
+
+def reponse_svg(svg, etag):
+    """Réponse image/svg+xml revalidée par ETag (304 si inchangée)"""
+    response = make_response(svg)
+    response.headers['Content-Type'] = 'image/svg+xml'
+    response.headers['Cache-Control'] = 'no-cache'  # revalidation systématique, 304 sans corps
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
 @app.route('/codes-barres')
 def codes_barres():
-    """Générateur de codes-barres"""
+    """Générateur de codes-barres, paginé comme /produits (?after=, ?limit=, mêmes filtres)"""
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM produits ORDER BY nom')
-        produits = cursor.fetchall()
-        conn.close()
+        
+        filtres = lire_filtres_produits(request.args)
+        curseur = request.args.get('after', '').strip()
+        produits, curseur_suivant = page_produits(cursor, filtres, lire_limite(request.args.get('limit')), curseur)
+        
+        # Images chargées à l'affichage depuis /generer-code/<id> (ETag, cache navigateur et worker)
+        args_page = {k: v for k, v in request.args.items() if k != 'after'}
+        page_suivante = url_for('codes_barres', **args_page, after=curseur_suivant) if curseur_suivant else None
+        premiere_page = url_for('codes_barres', **args_page) if curseur else None
         
         return render_template('codes_barres.html', 
-                             produits=[dict(p) for p in produits],
-                             categories=get_categories())
+                             produits=produits,
+                             page_suivante=page_suivante,
+                             premiere_page=premiere_page)
         
     except Exception as e:
         return render_template('error.html', error=str(e))
 
 @app.route('/generer-code/<int:produit_id>')
 def generer_code_barres(produit_id):
-    """Génère et retourne l'image du code-barres (version simplifiée)"""
+    """Génère et retourne l'image SVG du code-barres (Code128, ou EAN-13 si le code en est un)"""
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM produits WHERE id = ?', (produit_id,))
+        cursor.execute('SELECT code_barres, nom FROM produits WHERE id = ?', (produit_id,))
         produit = cursor.fetchone()
-        conn.close()
         
         if not produit:
             return "Produit non trouvé", 404
         
-        produit_dict = dict(produit)
-        
-        # Générer une image SVG simple du code-barres
-        code = produit_dict['code_barres']
-        
-        # SVG simple représentant un code-barres
-        svg_content = f'''<?xml version="1.0" encoding="UTF-8"?>
-<svg width="300" height="100" xmlns="http://www.w3.org/2000/svg">
-  <rect width="300" height="100" fill="white"/>
-  
-  <!-- Barres du code-barres (pattern simple) -->
-  <rect x="20" y="10" width="2" height="60" fill="black"/>
-  <rect x="25" y="10" width="1" height="60" fill="black"/>
-  <rect x="29" y="10" width="3" height="60" fill="black"/>
-  <rect x="35" y="10" width="1" height="60" fill="black"/>
-  <rect x="39" y="10" width="2" height="60" fill="black"/>
-  <rect x="44" y="10" width="1" height="60" fill="black"/>
-  <rect x="48" y="10" width="1" height="60" fill="black"/>
-  <rect x="52" y="10" width="2" height="60" fill="black"/>
-  <rect x="57" y="10" width="3" height="60" fill="black"/>
-  <rect x="63" y="10" width="1" height="60" fill="black"/>
-  <rect x="67" y="10" width="2" height="60" fill="black"/>
-  <rect x="72" y="10" width="1" height="60" fill="black"/>
-  <rect x="76" y="10" width="1" height="60" fill="black"/>
-  <rect x="80" y="10" width="3" height="60" fill="black"/>
-  <rect x="86" y="10" width="2" height="60" fill="black"/>
-  <rect x="91" y="10" width="1" height="60" fill="black"/>
-  <rect x="95" y="10" width="2" height="60" fill="black"/>
-  <rect x="100" y="10" width="1" height="60" fill="black"/>
-  <rect x="104" y="10" width="3" height="60" fill="black"/>
-  <rect x="110" y="10" width="1" height="60" fill="black"/>
-  <rect x="114" y="10" width="2" height="60" fill="black"/>
-  <rect x="119" y="10" width="1" height="60" fill="black"/>
-  <rect x="123" y="10" width="1" height="60" fill="black"/>
-  <rect x="127" y="10" width="2" height="60" fill="black"/>
-  <rect x="132" y="10" width="3" height="60" fill="black"/>
-  <rect x="138" y="10" width="1" height="60" fill="black"/>
-  <rect x="142" y="10" width="2" height="60" fill="black"/>
-  <rect x="147" y="10" width="1" height="60" fill="black"/>
-  <rect x="151" y="10" width="1" height="60" fill="black"/>
-  <rect x="155" y="10" width="3" height="60" fill="black"/>
-  <rect x="161" y="10" width="2" height="60" fill="black"/>
-  <rect x="166" y="10" width="1" height="60" fill="black"/>
-  <rect x="170" y="10" width="2" height="60" fill="black"/>
-  <rect x="175" y="10" width="1" height="60" fill="black"/>
-  <rect x="179" y="10" width="3" height="60" fill="black"/>
-  <rect x="185" y="10" width="1" height="60" fill="black"/>
-  <rect x="189" y="10" width="2" height="60" fill="black"/>
-  <rect x="194" y="10" width="1" height="60" fill="black"/>
-  <rect x="198" y="10" width="1" height="60" fill="black"/>
-  <rect x="202" y="10" width="2" height="60" fill="black"/>
-  <rect x="207" y="10" width="3" height="60" fill="black"/>
-  <rect x="213" y="10" width="1" height="60" fill="black"/>
-  <rect x="217" y="10" width="2" height="60" fill="black"/>
-  <rect x="222" y="10" width="1" height="60" fill="black"/>
-  <rect x="226" y="10" width="1" height="60" fill="black"/>
-  <rect x="230" y="10" width="3" height="60" fill="black"/>
-  <rect x="236" y="10" width="2" height="60" fill="black"/>
-  <rect x="241" y="10" width="1" height="60" fill="black"/>
-  <rect x="245" y="10" width="2" height="60" fill="black"/>
-  <rect x="250" y="10" width="1" height="60" fill="black"/>
-  <rect x="254" y="10" width="3" height="60" fill="black"/>
-  <rect x="260" y="10" width="1" height="60" fill="black"/>
-  <rect x="264" y="10" width="2" height="60" fill="black"/>
-  <rect x="269" y="10" width="1" height="60" fill="black"/>
-  <rect x="273" y="10" width="1" height="60" fill="black"/>
-  <rect x="277" y="10" width="2" height="60" fill="black"/>
-  
-  <!-- Texte du code-barres -->
-  <text x="150" y="85" text-anchor="middle" font-family="monospace" font-size="12" fill="black">{code}</text>
-  
-  <!-- Nom du produit -->
-  <text x="150" y="98" text-anchor="middle" font-family="Arial" font-size="10" fill="black">{produit_dict['nom'][:30]}</text>
-</svg>'''
-        
-        response = make_response(svg_content)
-        response.headers['Content-Type'] = 'image/svg+xml'
-        return response
+        symbologie = request.args.get('symbologie', 'auto')
+        if symbologie not in ('auto', 'code128', 'ean13'):
+            return "Symbologie inconnue (auto, code128, ean13)", 400
+        
+        try:
+            svg, etag = rendre_code_barres(produit['code_barres'], produit['nom'], symbologie)
+        except ValueError as e:
+            return str(e), 422
+        
+        return reponse_svg(svg, etag)
         
     except Exception as e:
         return f"Erreur: {str(e)}", 500
 
+def etiquettes_planche(conn, ids=None, copies=1, avancer=None):
+    """SVG des étiquettes des produits ids (tout le catalogue sinon), copies fois chacune"""
+    copies = min(max(int(copies), 1), 100)
+    ids = [int(i) for i in ids or ()]
+    if ids:
+        marques = ','.join('?' * len(ids))
+        produits = conn.execute(f'SELECT id, nom, code_barres, prix FROM produits WHERE id IN ({marques}) ORDER BY nom',
+                                ids).fetchall()
+    else:
+        produits = conn.execute('SELECT id, nom, code_barres, prix FROM produits ORDER BY nom').fetchall()
+    
+    etiquettes = []
+    for numero, produit in enumerate(produits):
+        if avancer and numero % 500 == 0:
+            avancer(numero / len(produits))
+        try:
+            svg = rendre_code_barres(produit['code_barres'], produit['nom'])[0]
+        except ValueError:
+            continue
+        etiquettes.extend([Markup(svg.decode('utf-8'))] * copies)
+    return etiquettes
+
+@app.route('/codes-barres/planche')
+def planche_codes_barres():
+    """Planche d'étiquettes imprimable en une seule réponse (?ids=1,2,3, sinon tout le catalogue ; ?tache=1 en fond)"""
+    try:
+        conn = get_db_connection()
+        ids = [int(i) for i in request.args.get('ids', '').split(',') if i.strip()]
+        copies = min(max(int(request.args.get('copies', 1)), 1), 100)
+        
+        if request.args.get('tache') == '1':
+            return refus_sans_pool(conn) or reponse_tache_soumise(
+                conn, soumettre_tache(conn, 'planche', {'ids': ids, 'copies': copies}))
+        
+        return render_template('planche_codes_barres.html', etiquettes=etiquettes_planche(conn, ids, copies))
+        
+    except ValueError:
+        return render_template('error.html', error="Paramètres ids/copies invalides")
+    except Exception as e:
+        return render_template('error.html', error=str(e))
+
+# Paramètres à chaud (table parametres) : relus au plus toutes les 5 s par worker
+DUREE_CACHE_PARAMETRES = 5.0
+_parametres = {'valeurs': {}, 'lu_a': float('-inf')}
+
+def lire_parametre(cle, defaut=None):
+    """Valeur d'un paramètre à chaud (cache local court, commun à tous les workers via la base)"""
+    maintenant = time.monotonic()
+    if maintenant - _parametres['lu_a'] > DUREE_CACHE_PARAMETRES:
+        lignes = get_db_connection().execute('SELECT cle, valeur FROM parametres').fetchall()
+        _parametres['valeurs'] = {ligne['cle']: ligne['valeur'] for ligne in lignes}
+        _parametres['lu_a'] = maintenant
+    return _parametres['valeurs'].get(cle, defaut)
+
+def ecrire_parametre(conn, cle, valeur):
+    """Enregistre un paramètre ; les autres workers le voient sous 5 s"""
+    conn.execute(
+        'INSERT INTO parametres (cle, valeur) VALUES (?, ?) '
+        'ON CONFLICT (cle) DO UPDATE SET valeur = excluded.valeur',
+        (cle, str(valeur))
+    )
+    conn.commit()
+    _parametres['lu_a'] = float('-inf')
+
+# Journal de debug du scanner : JSON par ligne, échantillonné, désactivé par défaut
+logger_scan = logging.getLogger('boutique.scan')
+logger_scan.setLevel(logging.INFO)
+if not logger_scan.handlers:
+    _handler_scan = logging.StreamHandler()
+    _handler_scan.setFormatter(logging.Formatter('%(asctime)s %(name)s %(levelname)s %(message)s'))
+    logger_scan.addHandler(_handler_scan)
+    logger_scan.propagate = False
+
+DEBUG_SCAN_DEFAUT = '1' if os.environ.get('BOUTIQUE_DEBUG_SCAN') == '1' else '0'
+
+def journal_scan(evenement, **champs):
+    """Trace structurée d'une recherche du scanner (si activée, selon le taux d'échantillonnage)"""
+    if lire_parametre('debug_scan', DEBUG_SCAN_DEFAUT) != '1':
+        return
+    if random.random() >= float(lire_parametre('debug_scan_echantillon', '1')):
+        return
+    logger_scan.info(json.dumps({'evenement': evenement, **champs}, ensure_ascii=False))
+
+def borne_prefixe(prefixe):
+    """Plus petite chaîne supérieure à toutes celles qui commencent par prefixe"""
+    return prefixe[:-1] + chr(ord(prefixe[-1]) + 1)
+
+# Colonnes exportables : clé (paramètre ?colonnes=) -> (en-tête CSV, formatage)
+COLONNES_EXPORT = {
+    'id': ('ID', None),
+    'nom': ('Nom', None),
+    'code_barres': ('Code-barres', None),
+    'prix': ('Prix (€)', lambda prix: f"{prix:.2f}"),
+    'stock': ('Stock', None),
+    'categorie': ('Catégorie', None),
+    'date_creation': ('Date création', None)
+}
+
+# Lignes lues par fetchmany() entre deux envois
+TAILLE_LOT_EXPORT = 1000
+
+def lire_colonnes_export(valeur):
+    """Colonnes demandées (liste ou 'nom,prix,...'), toutes par défaut ; ValueError si inconnues"""
+    if isinstance(valeur, str):
+        valeur = valeur.split(',')
+    colonnes = [c.strip() for c in valeur or () if c.strip()] or list(COLONNES_EXPORT)
+    inconnues = [c for c in colonnes if c not in COLONNES_EXPORT]
+    if inconnues:
+        raise ValueError(f"Colonnes inconnues: {', '.join(inconnues)}")
+    return colonnes
+
+def generer_csv(conn, colonnes, compresser=False):
+    """Produit le CSV par morceaux depuis un curseur : mémoire constante quel que soit le catalogue"""
+    tampon = io.StringIO()
+    writer = csv.writer(tampon)
+    compresseur = zlib.compressobj(6, zlib.DEFLATED, 31) if compresser else None  # 31 = format gzip
+    formats = [COLONNES_EXPORT[col][1] for col in colonnes]
+    
+    def vider():
+        morceau = tampon.getvalue().encode('utf-8')
+        tampon.seek(0)
+        tampon.truncate()
+        return compresseur.compress(morceau) if compresseur else morceau
+    
+    # En-têtes
+    writer.writerow([COLONNES_EXPORT[col][0] for col in colonnes])
+    yield vider()
+    
+    cursor = conn.cursor()
+    cursor.execute(f'SELECT {", ".join(colonnes)} FROM produits ORDER BY nom')
+    while True:
+        lignes = cursor.fetchmany(TAILLE_LOT_EXPORT)
+        if not lignes:
+            break
+        writer.writerows(
+            [valeur if fmt is None else fmt(valeur) for valeur, fmt in zip(ligne, formats)]
+            for ligne in lignes
+        )
+        morceau = vider()
+        if morceau:
+            yield morceau
+    cursor.close()
+    
+    if compresseur:
+        yield compresseur.flush()
+
 @app.route('/export')
 def export_csv():
-    """Export CSV des produits"""
+    """Export CSV des produits (streaming, ?colonnes=nom,prix,... et gzip optionnels, ?tache=1 en fond)"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM produits ORDER BY nom')
-        produits = cursor.fetchall()
-        conn.close()
+        try:
+            colonnes = lire_colonnes_export(request.args.get('colonnes', ''))
+        except ValueError as e:
+            return render_template('error.html', error=str(e))
         
-        if not produits:
+        conn = get_db_connection()
+        if not conn.execute('SELECT 1 FROM produits LIMIT 1').fetchone():
             return render_template('error.html', error="Aucun produit à exporter")
         
-        # Créer le CSV en mémoire
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # En-têtes
-        writer.writerow(['ID', 'Nom', 'Code-barres', 'Prix (€)', 'Stock', 'Catégorie', 'Date création'])
-        
-        # Données
-        for produit in produits:
-            writer.writerow([
-                produit['id'],
-                produit['nom'],
-                produit['code_barres'],
-                f"{produit['prix']:.2f}",
-                produit['stock'],
-                produit['categorie'],
-                produit['date_creation']
-            ])
-        
-        # Préparer la réponse
-        output.seek(0)
-        
-        response = make_response(output.getvalue())
+        # ?tache=1 : export en tâche de fond, fichier à télécharger via /api/jobs/<id>/resultat
+        if request.args.get('tache') == '1':
+            return refus_sans_pool(conn) or reponse_tache_soumise(
+                conn, soumettre_tache(conn, 'export', {'colonnes': colonnes}))
+        
+        # gzip si le client l'accepte (désactivable avec ?gzip=0)
+        compresser = (request.args.get('gzip') != '0'
+                      and request.accept_encodings['gzip'] > 0)
+        
+        # La connexion de la requête reste ouverte jusqu'à la fin du flux
+        response = Response(stream_with_context(generer_csv(conn, colonnes, compresser)),
+                            mimetype='text/csv')
         response.headers['Content-Type'] = 'text/csv; charset=utf-8'
         response.headers['Content-Disposition'] = f'attachment; filename=produits_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+        response.headers['Vary'] = 'Accept-Encoding'
+        if compresser:
+            response.headers['Content-Encoding'] = 'gzip'
         
         return response
         
     except Exception as e:
         return render_template('error.html', error=str(e))
 
+# Import en masse : lignes par executemany() et par transaction
+TAILLE_LOT_IMPORT = 20000
+# Erreurs détaillées renvoyées au maximum (toutes sont comptées)
+MAX_ERREURS_IMPORT = 200
+
+# En-têtes acceptés : ceux de /export ou les noms de colonnes
+ENTETES_IMPORT = {entete: cle for cle, (entete, _) in COLONNES_EXPORT.items()}
+ENTETES_IMPORT.update({cle: cle for cle in COLONNES_EXPORT})
+
+# Upsert sur le code-barres ; stock/catégorie absents (NULL) = valeur existante conservée
+# Ligne réimportée à l'identique : aucune écriture, donc aucun trigger (stats, journal, génération, FTS)
+SQL_UPSERT_PRODUIT = '''
+    INSERT INTO produits (nom, code_barres, prix, stock, categorie)
+    VALUES (?1, ?2, ?3, COALESCE(?4, 0), COALESCE(?5, 'Autre'))
+    ON CONFLICT (code_barres) DO UPDATE SET
+        nom = excluded.nom,
+        prix = excluded.prix,
+        stock = COALESCE(?4, produits.stock),
+        categorie = COALESCE(?5, produits.categorie)
+    WHERE produits.nom IS NOT excluded.nom OR produits.prix IS NOT excluded.prix
+       OR produits.stock IS NOT COALESCE(?4, produits.stock)
+       OR produits.categorie IS NOT COALESCE(?5, produits.categorie)
+'''
+
+def lire_lignes_csv(fichier):
+    """(numéro de ligne, dict) depuis un CSV au format de /export, ligne par ligne"""
+    reader = csv.reader(fichier)
+    entetes = next(reader, None)
+    if not entetes:
+        return
+    cles = [ENTETES_IMPORT.get(entete.strip().lstrip('\ufeff')) for entete in entetes]
+    manquantes = [c for c in ('nom', 'code_barres', 'prix') if c not in cles]
+    if manquantes:
+        raise ValueError(f"Colonnes obligatoires absentes: {', '.join(manquantes)}")
+    for numero, valeurs in enumerate(reader, start=2):
+        if not valeurs:
+            continue
+        yield numero, {cle: valeur for cle, valeur in zip(cles, valeurs) if cle}
+
+def lire_lignes_ndjson(fichier):
+    """(numéro de ligne, dict ou exception) depuis un flux NDJSON (un objet JSON par ligne)"""
+    for numero, ligne in enumerate(fichier, start=1):
+        ligne = ligne.strip()
+        if not ligne:
+            continue
+        try:
+            donnees = json.loads(ligne)
+            if not isinstance(donnees, dict):
+                raise ValueError('objet JSON attendu')
+        except ValueError as e:
+            donnees = ValueError(f'JSON invalide: {e}')
+        yield numero, donnees
+
+def valider_ligne_import(donnees):
+    """Paramètres de SQL_UPSERT_PRODUIT pour une ligne, ValueError si invalide"""
+    nom = str(donnees.get('nom') or '').strip()
+    code_barres = str(donnees.get('code_barres') or '').strip()
+    if not nom:
+        raise ValueError('nom obligatoire')
+    if not code_barres:
+        raise ValueError('code-barres obligatoire')
+    
+    try:
+        prix = float(str(donnees.get('prix', '')).replace(',', '.'))
+    except ValueError:
+        raise ValueError(f"prix invalide: {donnees.get('prix')!r}")
+    if prix < 0:
+        raise ValueError('prix négatif')
+    
+    stock = donnees.get('stock')
+    if stock is not None and str(stock).strip() != '':
+        try:
+            stock = int(str(stock).strip())
+        except ValueError:
+            raise ValueError(f'stock invalide: {stock!r}')
+        if stock < 0:
+            raise ValueError('stock négatif')
+    else:
+        stock = None
+    
+    categorie = str(donnees.get('categorie') or '').strip() or None
+    return nom, code_barres, prix, stock, categorie
+
+def importer_produits(conn, lignes, taille_lot=TAILLE_LOT_IMPORT):
+    """Upsert en masse de (numéro, données) ; les lignes invalides sont rapportées sans interrompre l'import"""
+    rapport = {'lignes': 0, 'importees': 0, 'nb_erreurs': 0, 'erreurs': []}
+    
+    def erreur(numero, message):
+        rapport['nb_erreurs'] += 1
+        if len(rapport['erreurs']) < MAX_ERREURS_IMPORT:
+            rapport['erreurs'].append({'ligne': numero, 'message': message})
+    
+    def upserts(lot, ligne_par_ligne):
+        if not ligne_par_ligne:
+            conn.executemany(SQL_UPSERT_PRODUIT, [params for _, params in lot])
+            return len(lot)
+        # Rejouer ligne par ligne pour isoler les lignes refusées par SQLite
+        reussies = 0
+        for numero, params in lot:
+            try:
+                conn.execute(SQL_UPSERT_PRODUIT, params)
+                reussies += 1
+            except sqlite3.DatabaseError as e:
+                erreur(numero, str(e))
+        return reussies
+    
+    def ecrire(lot, ligne_par_ligne=False):
+        # Un lot = une transaction ; les triggers de produits (statistiques, journal, génération)
+        # suivent chaque ligne comme pour toute autre écriture, seule l'indexation FTS est faite d'un bloc
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Codes du lot avec la ligne existante avant l'upsert
+            conn.execute('''CREATE TEMP TABLE IF NOT EXISTS import_codes
+                            (code TEXT PRIMARY KEY, id INTEGER, nom TEXT, stock INTEGER)''')
+            conn.execute('DELETE FROM temp.import_codes')
+            conn.executemany('INSERT OR IGNORE INTO temp.import_codes (code) VALUES (?)',
+                             [(params[1],) for _, params in lot])
+            conn.execute('''UPDATE temp.import_codes SET (id, nom, stock) =
+                            (SELECT p.id, p.nom, p.stock FROM produits p WHERE p.code_barres = import_codes.code)''')
+            if FTS_ACTIVE:
+                conn.execute('INSERT INTO ecriture_en_masse (actif) VALUES (1)')
+            reussies = upserts(lot, ligne_par_ligne)
+            if FTS_ACTIVE:
+                # Réindexation des seules lignes nouvelles ou renommées (le code est la clé : inchangé)
+                conn.execute('DELETE FROM ecriture_en_masse')
+                conn.execute('''INSERT INTO produits_fts (produits_fts, rowid, nom)
+                                SELECT 'delete', i.id, i.nom FROM temp.import_codes i
+                                JOIN produits p ON p.code_barres = i.code
+                                WHERE i.id IS NOT NULL AND i.nom IS NOT p.nom''')
+                conn.execute('''INSERT INTO produits_fts (rowid, nom)
+                                SELECT p.id, p.nom FROM temp.import_codes i
+                                JOIN produits p ON p.code_barres = i.code
+                                WHERE i.id IS NULL OR i.nom IS NOT p.nom''')
+                conn.execute('''INSERT INTO produits_codes_fts (rowid, code_barres)
+                                SELECT p.id, p.code_barres FROM temp.import_codes i
+                                JOIN produits p ON p.code_barres = i.code
+                                WHERE i.id IS NULL''')
+            # Registre : écart de stock de chaque produit créé ou réimporté avec un autre stock
+            conn.execute('''INSERT INTO registre_stock (produit_id, delta, stock_apres, motif, source)
+                            SELECT p.id, p.stock - IFNULL(i.stock, 0), p.stock,
+                                   CASE WHEN i.id IS NULL THEN 'creation' ELSE 'import' END, 'import'
+                            FROM temp.import_codes i JOIN produits p ON p.code_barres = i.code
+                            WHERE p.stock IS NOT IFNULL(i.stock, 0)
+                            ORDER BY p.id''')
+            conn.commit()
+        except sqlite3.DatabaseError:
+            conn.rollback()
+            if ligne_par_ligne:
+                raise
+            ecrire(lot, ligne_par_ligne=True)
+            return
+        rapport['importees'] += reussies
+    
+    lot = []
+    for numero, donnees in lignes:
+        rapport['lignes'] += 1
+        try:
+            if isinstance(donnees, Exception):
+                raise donnees
+            lot.append((numero, valider_ligne_import(donnees)))
+        except ValueError as e:
+            erreur(numero, str(e))
+            continue
+        if len(lot) >= taille_lot:
+            ecrire(lot)
+            lot = []
+    if lot:
+        ecrire(lot)
+    cache_codes.invalider()
+    
+    return rapport
+
+class FluxBrut(io.RawIOBase):
+    """Corps de requête vu comme un fichier binaire (l'entrée WSGI de gunicorn n'a ni readable ni readinto)"""
+
+    def __init__(self, flux):
+        self.flux = flux
+
+    def readable(self):
+        return True
+
+    def readinto(self, tampon):
+        donnees = self.flux.read(len(tampon))
+        tampon[:len(donnees)] = donnees
+        return len(donnees)
+
+def format_import(nom_fichier, type_contenu, format_demande=''):
+    """'csv' ou 'ndjson' selon le paramètre, l'extension ou le Content-Type"""
+    format_demande = (format_demande or '').lower()
+    if format_demande in ('csv', 'ndjson'):
+        return format_demande
+    if (nom_fichier or '').lower().endswith(('.ndjson', '.jsonl')) or 'ndjson' in (type_contenu or ''):
+        return 'ndjson'
+    return 'csv'
+
+@app.route('/import', methods=['POST'])
+def import_produits():
+    """Import en masse CSV (format de /export) ou NDJSON, upsert sur le code-barres (?tache=1 en fond)"""
+    try:
+        fichier = request.files.get('fichier')
+        if fichier:
+            flux, nom_fichier, type_contenu = fichier.stream, fichier.filename, fichier.mimetype
+        else:
+            flux, nom_fichier, type_contenu = io.BufferedReader(FluxBrut(request.stream)), '', request.mimetype
+        
+        fmt = format_import(nom_fichier, type_contenu, request.args.get('format'))
+        
+        # ?tache=1 : fichier enregistré tel quel, import en tâche de fond (suivi via /api/jobs/<id>)
+        if request.args.get('tache') == '1':
+            conn = get_db_connection()
+            refus = refus_sans_pool(conn)
+            if refus:
+                return refus
+            os.makedirs(DOSSIER_TACHES, exist_ok=True)
+            nom = f'import-{os.urandom(8).hex()}.{fmt}'
+            with open(os.path.join(DOSSIER_TACHES, nom), 'wb') as copie:
+                while True:
+                    morceau = flux.read(1 << 16)
+                    if not morceau:
+                        break
+                    copie.write(morceau)
+            return reponse_tache_soumise(conn, soumettre_tache(conn, 'import', {'fichier': nom, 'format': fmt}))
+        
+        texte = io.TextIOWrapper(flux, encoding='utf-8-sig', newline='')
+        lignes = lire_lignes_ndjson(texte) if fmt == 'ndjson' else lire_lignes_csv(texte)
+        
+        debut = datetime.now()
+        rapport = importer_produits(get_db_connection(), lignes)
+        rapport['duree'] = round((datetime.now() - debut).total_seconds(), 3)
+        
+        return jsonify({'success': True, 'format': fmt, **rapport})
+        
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Erreur: {str(e)}'})
+
+# Réponses JSON en lecture seule : GET conditionnel (ETag / Last-Modified) sur la génération
+# du catalogue, corps sérialisés gardés en mémoire par (URL, génération)
+TAILLE_CACHE_REPONSES = 256
+_cache_reponses = OrderedDict()
+_cache_reponses_lock = threading.Lock()
+
+def generation_produits(conn):
+    """(génération, date de modification) du catalogue : une ligne de generations, sans lire produits"""
+    ligne = conn.execute("SELECT valeur, modifie_le FROM generations WHERE nom = 'produits'").fetchone()
+    return ligne['valeur'], datetime.fromtimestamp(ligne['modifie_le'], timezone.utc)
+
+def reponse_json_revisee(conn, construire):
+    """Réponse JSON de construire() pour la génération courante du catalogue
+    
+    304 si le client a déjà cette génération ; sinon corps repris du cache s'il a déjà été sérialisé
+    """
+    generation, modifie_le = generation_produits(conn)
+    etag = f'{IDENTIFIANT_BASE}-produits-{generation}'
+    if not is_resource_modified(request.environ, etag=etag, last_modified=modifie_le):
+        response = Response(status=304)
+    else:
+        cle = (request.full_path, generation)
+        with _cache_reponses_lock:
+            corps = _cache_reponses.get(cle)
+            if corps is not None:
+                _cache_reponses.move_to_end(cle)
+        if corps is None:
+            corps = app.json.response(construire()).get_data()
+            with _cache_reponses_lock:
+                _cache_reponses[cle] = corps
+                while len(_cache_reponses) > TAILLE_CACHE_REPONSES:
+                    _cache_reponses.popitem(last=False)
+        response = Response(corps, mimetype='application/json')
+    response.set_etag(etag)
+    response.last_modified = modifie_le
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 @app.route('/api/produits')
 def api_produits():
-    """API JSON des produits"""
+    """API JSON des produits, paginée par curseur (?limit=&after=)"""
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM produits ORDER BY nom')
-        produits = cursor.fetchall()
-        conn.close()
         
-        return jsonify({
-            'success': True,
-            'count': len(produits),
-            'produits': [dict(p) for p in produits]
-        })
+        def construire():
+            # Révision lue avant la page : un client qui suit ensuite /api/changes ne rate rien
+            rev = revision_courante(conn)
+            filtres = lire_filtres_produits(request.args)
+            limite = lire_limite(request.args.get('limit'))
+            produits, curseur_suivant = page_produits(cursor, filtres, limite,
+                                                      request.args.get('after', '').strip())
+            return {
+                'success': True,
+                'count': len(produits),
+                'limit': limite,
+                'next_cursor': curseur_suivant,
+                'rev': rev,
+                'produits': produits
+            }
+        
+        return reponse_json_revisee(conn, construire)
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
@@ -825,48 +2473,308 @@ def api_stats():
     """API JSON des statistiques"""
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Stats générales
-        cursor.execute('SELECT COUNT(*) as total FROM produits')
-        total = cursor.fetchone()[0]
         
-        cursor.execute('SELECT COUNT(*) as ruptures FROM produits WHERE stock = 0')
-        ruptures = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) as stock_faible FROM produits WHERE stock > 0 AND stock <= 5')
-        stock_faible = cursor.fetchone()[0]
+        # Stats générales et top catégories (agrégats matérialisés)
+        return reponse_json_revisee(conn, lambda: {
+            'success': True,
+            'stats': get_stats_stock(conn)
+        })
         
-        cursor.execute('SELECT SUM(stock * prix) as valeur FROM produits')
-        result = cursor.fetchone()
-        valeur_stock = result[0] or 0
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+# Flux de changements du catalogue : révisions du journal mouvements_stock
+TAILLE_PAGE_CHANGEMENTS = 500
+ATTENTE_MAX_CHANGEMENTS = 30        # secondes de long-polling au plus
+INTERVALLE_ATTENTE_CHANGEMENTS = 0.25
+JOURS_HISTORIQUE_CHANGEMENTS = 30   # politique de compaction par défaut
+
+def revision_courante(conn):
+    """Dernière révision attribuée (y compris si elle a été compactée depuis)"""
+    ligne = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'mouvements_stock'").fetchone()
+    return ligne['seq'] if ligne else 0
+
+def revision_compactee(conn):
+    """Plus haute révision supprimée par la compaction (0 si l'historique est complet)"""
+    ligne = conn.execute("SELECT valeur FROM parametres WHERE cle = 'changements_compactes_jusqua'").fetchone()
+    return int(ligne['valeur']) if ligne else 0
+
+SQL_CHANGEMENTS = '''
+    SELECT d.rev, d.produit_id, m.operation,
+           p.id IS NOT NULL AS existe, p.nom, p.code_barres, p.prix, p.stock, p.categorie, p.date_creation
+    FROM (SELECT produit_id, MAX(rev) AS rev FROM mouvements_stock
+          WHERE rev > ? GROUP BY produit_id ORDER BY rev LIMIT ?) d
+    JOIN mouvements_stock m ON m.rev = d.rev
+    LEFT JOIN produits p ON p.id = d.produit_id
+    ORDER BY d.rev
+'''
+
+def changements_depuis(conn, depuis, limite):
+    """Dernier état des produits modifiés après la révision depuis, un par produit, par révision croissante"""
+    lignes = conn.execute(SQL_CHANGEMENTS, (depuis, limite)).fetchall()
+    return [{
+        'rev': ligne['rev'],
+        'produit_id': ligne['produit_id'],
+        'operation': ligne['operation'],
+        # None : produit supprimé
+        'produit': {
+            'id': ligne['produit_id'],
+            'nom': ligne['nom'],
+            'code_barres': ligne['code_barres'],
+            'prix': ligne['prix'],
+            'stock': ligne['stock'],
+            'categorie': ligne['categorie'],
+            'date_creation': ligne['date_creation']
+        } if ligne['existe'] else None
+    } for ligne in lignes]
+
+def compacter_changements(conn, jours=JOURS_HISTORIQUE_CHANGEMENTS):
+    """Supprime l'historique de plus de jours jours ; retourne le nombre d'entrées supprimées"""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        limite = conn.execute("SELECT MAX(rev) FROM mouvements_stock WHERE date < datetime('now', ?)",
+                              (f'-{int(jours)} days',)).fetchone()[0]
+        supprimees = 0
+        if limite is not None:
+            supprimees = conn.execute('DELETE FROM mouvements_stock WHERE rev <= ?', (limite,)).rowcount
+            # Les clients plus anciens que cette révision doivent se resynchroniser
+            conn.execute(
+                "INSERT INTO parametres (cle, valeur) VALUES ('changements_compactes_jusqua', ?) "
+                "ON CONFLICT (cle) DO UPDATE SET valeur = MAX(CAST(valeur AS INTEGER), excluded.valeur)",
+                (limite,)
+            )
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+    return supprimees
+
+@app.route('/api/changes')
+def api_changes():
+    """Changements du catalogue depuis une révision (?since=&limit=&wait= secondes de long-polling)"""
+    try:
+        try:
+            depuis = max(int(request.args.get('since', 0)), 0)
+            attente = min(max(float(request.args.get('wait', 0)), 0), ATTENTE_MAX_CHANGEMENTS)
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Paramètres since/wait invalides'}), 400
+        limite = lire_limite(request.args.get('limit'), TAILLE_PAGE_CHANGEMENTS)
         
-        # Top catégories
-        cursor.execute('''
-            SELECT categorie, COUNT(*) as count, SUM(stock) as stock_total 
-            FROM produits 
-            GROUP BY categorie 
-            ORDER BY count DESC 
-            LIMIT 5
-        ''')
-        top_categories = cursor.fetchall()
+        conn = get_db_connection()
+        if depuis < revision_compactee(conn):
+            return jsonify({
+                'success': False,
+                'resync': True,
+                'rev': revision_courante(conn),
+                'error': 'Historique compacté : resynchroniser depuis /api/produits'
+            }), 410
         
-        conn.close()
+        # Long-polling : attendre le premier changement, au plus wait secondes
+        echeance = time.monotonic() + attente
+        changements = changements_depuis(conn, depuis, limite)
+        while not changements and time.monotonic() < echeance:
+            time.sleep(INTERVALLE_ATTENTE_CHANGEMENTS)
+            changements = changements_depuis(conn, depuis, limite)
         
         return jsonify({
             'success': True,
-            'stats': {
-                'total_produits': total,
-                'ruptures': ruptures,
-                'stock_faible': stock_faible,
-                'valeur_stock': round(valeur_stock, 2),
-                'top_categories': [dict(cat) for cat in top_categories]
-            }
+            'since': depuis,
+            # Révision à repasser en since à l'appel suivant
+            'rev': changements[-1]['rev'] if changements else depuis,
+            'has_more': len(changements) == limite,
+            'count': len(changements),
+            'changes': changements
         })
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+# Push des changements de stock (Server-Sent Events)
+SQL_EVENEMENTS_STOCK = '''
+    SELECT rev, produit_id, operation, stock_apres AS stock
+    FROM mouvements_stock WHERE rev > ? ORDER BY rev LIMIT ?
+'''
+INTERVALLE_PING_SSE = 15  # secondes : commentaire ": ping" qui garde la connexion ouverte
+
+class DiffuseurChangements:
+    """Lecteur unique du journal mouvements_stock par worker, qui réveille les flux SSE
+    
+    Sans broker : chaque worker interroge SQLite (PRAGMA data_version, puis les nouvelles
+    révisions) toutes les intervalle secondes, quel que soit le nombre de clients connectés
+    """
+
+    def __init__(self, intervalle=0.5, taille_tampon=10000):
+        self.intervalle = intervalle
+        self._condition = threading.Condition()
+        self._tampon = deque(maxlen=taille_tampon)  # derniers changements, révisions croissantes
+        self._base = 0   # le tampon contient tous les changements postérieurs à cette révision
+        self._rev = 0    # dernière révision lue
+        self._pid = None
+        self._attentes = set()  # (boucle, futur) des clients asynchrones (mode ASGI) en attente
+        self.abonnes = 0
+
+    def _demarrer(self):
+        """Lance le thread lecteur dans ce processus (à appeler sous self._condition)"""
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._tampon.clear()
+        conn = db_pool.acquire()
+        try:
+            self._base = self._rev = revision_courante(conn)
+        finally:
+            db_pool.release(conn)
+        threading.Thread(target=self._boucle, args=(self._pid,), name='diffuseur-changements',
+                         daemon=True).start()
+
+    def _boucle(self, pid):
+        conn = db_pool.acquire()
+        version = None
+        try:
+            while self._pid == pid:
+                try:
+                    # data_version ne bouge qu'aux commits des autres connexions : rien à lire sinon
+                    version_actuelle = conn.execute('PRAGMA data_version').fetchone()[0]
+                    if version_actuelle != version:
+                        version = version_actuelle
+                        self._lire_nouveautes(conn)
+                except sqlite3.Error as e:
+                    logger_scan.warning(json.dumps({'evenement': 'diffuseur-erreur', 'erreur': str(e)}))
+                time.sleep(self.intervalle)
+        finally:
+            db_pool.release(conn)
+
+    def _lire_nouveautes(self, conn):
+        while True:
+            lignes = conn.execute(SQL_EVENEMENTS_STOCK, (self._rev, 1000)).fetchall()
+            if not lignes:
+                return
+            with self._condition:
+                for ligne in lignes:
+                    if len(self._tampon) == self._tampon.maxlen:
+                        self._base = self._tampon[0]['rev']
+                    self._tampon.append(dict(ligne))
+                self._rev = lignes[-1]['rev']
+                self._condition.notify_all()
+                for boucle, futur in self._attentes:
+                    try:
+                        boucle.call_soon_threadsafe(_reveiller_futur, futur)
+                    except RuntimeError:
+                        pass  # boucle fermée (arrêt du worker)
+                self._attentes.clear()
+
+    def revision(self):
+        with self._condition:
+            self._demarrer()
+            return self._rev
+
+    def compter_abonne(self, delta):
+        with self._condition:
+            self.abonnes += delta
+
+    def evenements(self, depuis, timeout):
+        """Changements postérieurs à depuis, en attendant au plus timeout secondes
+        
+        Liste vide si rien de neuf ; None si depuis est plus ancien que le tampon (rattrapage en base)
+        """
+        with self._condition:
+            self._demarrer()
+            if depuis < self._base:
+                return None
+            self._condition.wait_for(lambda: self._rev > depuis, timeout)
+            return self._nouveaux(depuis)
+
+    async def evenements_async(self, depuis, timeout):
+        """Comme evenements(), sans bloquer de thread : attente sur un futur de la boucle asyncio"""
+        boucle = asyncio.get_running_loop()
+        with self._condition:
+            self._demarrer()
+            if depuis < self._base:
+                return None
+            if self._rev > depuis:
+                return self._nouveaux(depuis)
+            attente = (boucle, boucle.create_future())
+            self._attentes.add(attente)
+        try:
+            await asyncio.wait_for(attente[1], timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._condition:
+                self._attentes.discard(attente)
+        with self._condition:
+            if depuis < self._base:
+                return None
+            return self._nouveaux(depuis)
+
+    def _nouveaux(self, depuis):
+        """Événements du tampon postérieurs à depuis (à appeler sous self._condition)"""
+        # Clients presque toujours à jour : parcours depuis la fin du tampon
+        nouveaux = []
+        for evenement in reversed(self._tampon):
+            if evenement['rev'] <= depuis:
+                break
+            nouveaux.append(evenement)
+        nouveaux.reverse()
+        return nouveaux
+
+def _reveiller_futur(futur):
+    if not futur.done():
+        futur.set_result(None)
+
+diffuseur_changements = DiffuseurChangements()
+
+def evenements_en_base(depuis):
+    """Rattrapage direct en base d'un client en retard sur le tampon (None : resynchronisation)"""
+    conn = db_pool.acquire()
+    try:
+        if depuis < revision_compactee(conn):
+            return None
+        return [dict(ligne) for ligne in conn.execute(SQL_EVENEMENTS_STOCK, (depuis, 1000))]
+    finally:
+        db_pool.release(conn)
+
+def trame_sse(evenement):
+    return f"id: {evenement['rev']}\nevent: stock\ndata: {json.dumps(evenement)}\n\n"
+
+@app.route('/api/changes/stream')
+def api_changes_stream():
+    """Flux Server-Sent Events des changements de stock (reprise via Last-Event-ID ou ?since=)"""
+    demande = request.headers.get('Last-Event-ID') or request.args.get('since')
+    try:
+        depuis = int(demande) if demande else None
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Révision invalide'}), 400
+    
+    # Aucune connexion SQLite tenue pendant le flux : seul le diffuseur du worker lit la base
+    def flux(depuis):
+        diffuseur_changements.compter_abonne(1)
+        try:
+            if depuis is None:
+                depuis = diffuseur_changements.revision()
+            yield 'retry: 3000\n\n'
+            while True:
+                evenements = diffuseur_changements.evenements(depuis, INTERVALLE_PING_SSE)
+                if evenements is None:
+                    # Client en retard sur le tampon : rattrapage direct en base
+                    evenements = evenements_en_base(depuis)
+                    if evenements is None:
+                        yield 'event: resync\ndata: {}\n\n'
+                        return
+                if not evenements:
+                    yield ': ping\n\n'
+                    continue
+                for evenement in evenements:
+                    yield trame_sse(evenement)
+                depuis = evenements[-1]['rev']
+        finally:
+            diffuseur_changements.compter_abonne(-1)
+    
+    response = Response(flux(depuis), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # pas de mise en tampon par un proxy nginx
+    return response
+
 @app.route('/recherche')
 def recherche_avancee():
     """Page de recherche avancée"""
@@ -883,7 +2791,6 @@ def gerer_categories():
             
             if not nom:
                 return render_template('categories.html', 
-                                     categories=get_categories(),
                                      error="Le nom de la catégorie est obligatoire")
             
             conn = get_db_connection()
@@ -893,16 +2800,15 @@ def gerer_categories():
                 (nom, emoji, description)
             )
             conn.commit()
-            conn.close()
+            cache_categories.invalider()
             
             return redirect(url_for('gerer_categories'))
             
         except Exception as e:
             return render_template('categories.html', 
-                                 categories=get_categories(),
                                  error=f"Erreur: {str(e)}")
     
-    return render_template('categories.html', categories=get_categories())
+    return render_template('categories.html')
 
 @app.route('/supprimer-categorie/<int:id>')
 def supprimer_categorie(id):
@@ -912,7 +2818,7 @@ def supprimer_categorie(id):
         cursor = conn.cursor()
         cursor.execute('DELETE FROM categories WHERE id = ?', (id,))
         conn.commit()
-        conn.close()
+        cache_categories.invalider()
     except Exception as e:
         pass
     
@@ -920,125 +2826,851 @@ def supprimer_categorie(id):
 
 @app.route('/api/scan-product', methods=['POST'])
 def api_scan_product():
-    """API pour scanner un produit par code-barres avec debug"""
+    """API pour scanner un produit par code-barres (code exact, sinon premier code qui le prolonge)"""
     try:
         data = request.get_json()
         code_barres = data.get('code_barres', '').strip()
         
-        print(f"🔍 API Scan - Code reçu: '{code_barres}'")
-        
         if not code_barres:
             return jsonify({'success': False, 'message': 'Code-barres manquant'})
         
+        debut = time.perf_counter()
         conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Recherche exacte d'abord
-        cursor.execute('SELECT * FROM produits WHERE code_barres = ?', (code_barres,))
-        produit = cursor.fetchone()
-        
-        # Si pas trouvé, recherche flexible
-        if not produit:
-            cursor.execute('SELECT * FROM produits WHERE code_barres LIKE ?', (f'%{code_barres}%',))
-            produit = cursor.fetchone()
         
-        # Debug: afficher tous les codes-barres disponibles
-        cursor.execute('SELECT nom, code_barres FROM produits WHERE code_barres IS NOT NULL AND code_barres != ""')
-        tous_codes = cursor.fetchall()
-        print(f"📦 Codes disponibles: {[dict(c) for c in tous_codes]}")
+        # Code exact (cache du worker), sinon une seule recherche sur l'index unique :
+        # premier code de l'intervalle des codes qui commencent par celui scanné
+        produit = cache_codes.produit(conn, code_barres)
+        if produit is None:
+            ligne = conn.execute(
+                'SELECT * FROM produits WHERE code_barres >= ? AND code_barres < ? '
+                'ORDER BY code_barres LIMIT 1',
+                (code_barres, borne_prefixe(code_barres))
+            ).fetchone()
+            produit = dict(ligne) if ligne else None
         
-        conn.close()
+        journal_scan('scan-product', code=code_barres,
+                     trouve=produit['code_barres'] if produit else None,
+                     exact=bool(produit) and produit['code_barres'] == code_barres,
+                     duree_ms=round((time.perf_counter() - debut) * 1000, 3))
         
         if produit:
-            print(f"✅ Produit trouvé: {produit['nom']}")
             return jsonify({
                 'success': True,
-                'produit': dict(produit)
+                'produit': produit
             })
         else:
-            print(f"❌ Aucun produit trouvé pour: '{code_barres}'")
             return jsonify({
                 'success': False,
-                'message': f'Produit non trouvé pour le code: {code_barres}',
-                'codes_disponibles': [dict(c) for c in tous_codes]
+                'message': f'Produit non trouvé pour le code: {code_barres}'
             })
             
     except Exception as e:
-        print(f"🚨 Erreur API scan: {str(e)}")
+        logger_scan.warning(json.dumps({'evenement': 'scan-product-erreur', 'erreur': str(e)}, ensure_ascii=False))
         return jsonify({'success': False, 'message': str(e)})
 
-@app.route('/api/ajuster-stock', methods=['POST'])
-def api_ajuster_stock():
-    """API pour ajuster le stock d'un produit"""
+@app.route('/api/debug-scan', methods=['GET', 'POST'])
+def api_debug_scan():
+    """Active/désactive à chaud le journal du scanner : {"actif": true, "echantillon": 0.1}"""
     try:
-        data = request.get_json()
-        produit_id = data.get('produit_id')
-        action = data.get('action')  # 'add' ou 'remove'
-        quantite = data.get('quantite', 1)
+        if request.method == 'POST':
+            data = request.get_json() or {}
+            conn = get_db_connection()
+            if 'actif' in data:
+                ecrire_parametre(conn, 'debug_scan', '1' if data['actif'] else '0')
+            if 'echantillon' in data:
+                echantillon = float(data['echantillon'])
+                if not 0 <= echantillon <= 1:
+                    return jsonify({'success': False, 'message': 'Échantillon entre 0 et 1'})
+                ecrire_parametre(conn, 'debug_scan_echantillon', echantillon)
         
-        if not produit_id or not action:
+        return jsonify({
+            'success': True,
+            'actif': lire_parametre('debug_scan', DEBUG_SCAN_DEFAUT) == '1',
+            'echantillon': float(lire_parametre('debug_scan_echantillon', '1'))
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)})
+
+# Idempotence : un mouvement portant une clé déjà vue n'est jamais réappliqué
+LONGUEUR_MAX_CLE_IDEMPOTENCE = 100
+JOURS_CLES_IDEMPOTENCE = 7  # durée maximale d'une file hors ligne
+
+def lire_cle_idempotence(valeur):
+    """Clé d'idempotence fournie par le client (None si absente) ; ErreurStock si invalide"""
+    if valeur in (None, ''):
+        return None
+    cle = str(valeur)
+    if len(cle) > LONGUEUR_MAX_CLE_IDEMPOTENCE:
+        raise ErreurStock("Clé d'idempotence trop longue")
+    return cle
+
+def resultat_idempotent(conn, cle):
+    """Résultat déjà enregistré pour cette clé (dict), ou None ; dans la transaction de l'appelant"""
+    ligne = conn.execute('SELECT resultat FROM cles_idempotence WHERE cle = ?', (cle,)).fetchone()
+    return json.loads(ligne['resultat']) if ligne else None
+
+def enregistrer_idempotence(conn, cle, resultat):
+    """Associe le résultat à la clé, dans la même transaction que le mouvement"""
+    conn.execute('INSERT INTO cles_idempotence (cle, resultat) VALUES (?, ?)',
+                 (cle, json.dumps(resultat, ensure_ascii=False)))
+
+def purger_cles_idempotence(conn, jours=JOURS_CLES_IDEMPOTENCE):
+    """Oublie les clés de plus de jours jours ; retourne le nombre de clés supprimées"""
+    supprimees = conn.execute("DELETE FROM cles_idempotence WHERE date < datetime('now', ?)",
+                              (f'-{int(jours)} days',)).rowcount
+    conn.commit()
+    return supprimees
+
+@app.route('/api/ajuster-stock', methods=['POST'])
+def api_ajuster_stock():
+    """API pour ajuster le stock d'un produit"""
+    try:
+        data = request.get_json()
+        produit_id = data.get('produit_id')
+        action = data.get('action')  # 'add' ou 'remove'
+        quantite = data.get('quantite', 1)
+        
+        if not produit_id or not action:
             return jsonify({'success': False, 'message': 'Paramètres manquants'})
         
+        # 'remove' ne descend jamais sous zéro
+        actions = {'add': 'ajouter', 'remove': 'retirer_borne'}
+        if action not in actions:
+            return jsonify({'success': False, 'message': 'Action invalide'})
+        
+        try:
+            cle = lire_cle_idempotence(request.headers.get('Idempotency-Key') or data.get('cle'))
+            motif = lire_motif(data.get('motif'))
+        except ErreurStock as e:
+            return jsonify({'success': False, 'message': str(e)})
+        
         conn = get_db_connection()
-        cursor = conn.cursor()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Rejeu : réponse enregistrée renvoyée à l'identique, signalée par un en-tête
+            reponse = resultat_idempotent(conn, cle) if cle else None
+            rejoue = reponse is not None
+            if not rejoue:
+                try:
+                    mouvement = appliquer_mouvement(conn, produit_id, actions[action], quantite,
+                                                    'api/ajuster-stock', motif)
+                    reponse = {
+                        'success': True,
+                        'nouveau_stock': mouvement['nouveau_stock'],
+                        'action': action,
+                        'quantite': mouvement['quantite']
+                    }
+                except ErreurStock as e:
+                    reponse = {'success': False, 'message': str(e)}
+                if cle:
+                    enregistrer_idempotence(conn, cle, reponse)
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+        cache_codes.invalider()
         
-        # Récupérer le stock actuel
-        cursor.execute('SELECT stock FROM produits WHERE id = ?', (produit_id,))
-        result = cursor.fetchone()
+        response = jsonify(reponse)
+        if rejoue:
+            response.headers['Idempotent-Replayed'] = 'true'
+        return response
         
-        if not result:
-            conn.close()
-            return jsonify({'success': False, 'message': 'Produit non trouvé'})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)})
+
+# Actions acceptées par /api/scan-batch (vocabulaire de /scan et de /api/ajuster-stock)
+ACTIONS_LOT = {
+    'ajouter': 'ajouter',
+    'retirer': 'retirer',
+    'definir': 'definir',
+    'add': 'ajouter',
+    'remove': 'retirer_borne'
+}
+TAILLE_MAX_LOT_SCANS = 1000
+
+def resoudre_codes(conn, codes):
+    """code-barres -> id pour tous les codes en une requête IN (...) par tranche de 500"""
+    codes = list(dict.fromkeys(codes))
+    ids = {}
+    for debut in range(0, len(codes), 500):
+        tranche = codes[debut:debut + 500]
+        marqueurs = ', '.join('?' * len(tranche))
+        for ligne in conn.execute(f'SELECT id, code_barres FROM produits WHERE code_barres IN ({marqueurs})', tranche):
+            ids[ligne['code_barres']] = ligne['id']
+    return ids
+
+@app.route('/api/scan-batch', methods=['POST'])
+def api_scan_batch():
+    """Applique un lot de mouvements {code, action, quantite, cle} en une seule transaction
+    
+    mode 'tout_ou_rien' : la moindre erreur annule le lot ; 'meilleur_effort' (défaut) :
+    les lignes refusées sont signalées, les autres appliquées.
+    cle (facultative) : clé d'idempotence ; un mouvement déjà reçu renvoie son résultat
+    d'origine (rejoue: true) sans être réappliqué
+    motif (facultatif) : motif inscrit au registre (casse, vol, retour...)
+    """
+    try:
+        data = request.get_json()
+        mouvements = data.get('mouvements') or []
+        mode = data.get('mode', 'meilleur_effort')
         
-        stock_actuel = result[0]
+        if mode not in ('tout_ou_rien', 'meilleur_effort'):
+            return jsonify({'success': False, 'message': 'Mode invalide'})
+        if not isinstance(mouvements, list) or not mouvements:
+            return jsonify({'success': False, 'message': 'Aucun mouvement'})
+        if len(mouvements) > TAILLE_MAX_LOT_SCANS:
+            return jsonify({'success': False, 'message': f'Lot limité à {TAILLE_MAX_LOT_SCANS} mouvements'})
         
-        # Calculer le nouveau stock
-        if action == 'add':
-            nouveau_stock = stock_actuel + quantite
-        elif action == 'remove':
-            nouveau_stock = max(0, stock_actuel - quantite)
-        else:
-            conn.close()
-            return jsonify({'success': False, 'message': 'Action invalide'})
+        conn = get_db_connection()
+        codes = [str(mvt.get('code', '')).strip() for mvt in mouvements if isinstance(mvt, dict)]
+        ids = resoudre_codes(conn, [c for c in codes if c])
         
-        # Mettre à jour le stock
-        cursor.execute('UPDATE produits SET stock = ? WHERE id = ?', (nouveau_stock, produit_id))
-        conn.commit()
-        conn.close()
+        resultats = []
+        registre = []
+        annule = False
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for index, mouvement in enumerate(mouvements):
+                mouvement = mouvement if isinstance(mouvement, dict) else {}
+                code = str(mouvement.get('code', '')).strip()
+                ligne = {'index': index, 'code': code}
+                cle = None
+                try:
+                    cle = lire_cle_idempotence(mouvement.get('cle'))
+                    deja = resultat_idempotent(conn, cle) if cle else None
+                    if deja is not None:
+                        # Rejeu (réseau coupé avant la réponse) : résultat d'origine, rien de réappliqué
+                        deja.update(index=index, rejoue=True)
+                        resultats.append(deja)
+                        continue
+                    if code not in ids:
+                        raise ErreurStock(f'Produit non trouvé: {code}')
+                    action = ACTIONS_LOT.get(mouvement.get('action'))
+                    if not action:
+                        raise ErreurStock('Action non valide')
+                    resultat = appliquer_mouvement(conn, ids[code], action, mouvement.get('quantite', 1),
+                                                   'api/scan-batch', lire_motif(mouvement.get('motif')),
+                                                   registre)
+                    ligne.update(success=True, produit=resultat['nom'], quantite=resultat['quantite'],
+                                 stock_precedent=resultat['stock_precedent'],
+                                 nouveau_stock=resultat['nouveau_stock'])
+                except ErreurStock as e:
+                    ligne.update(success=False, message=str(e))
+                    if mode == 'tout_ou_rien':
+                        annule = True
+                if cle:
+                    ligne['cle'] = cle
+                    enregistrer_idempotence(conn, cle, ligne)
+                resultats.append(ligne)
+                if annule:
+                    break
+            
+            if annule:
+                conn.rollback()
+            else:
+                # Registre écrit en un seul executemany, dans la transaction du lot
+                conn.executemany(SQL_REGISTRE_STOCK, registre)
+                conn.commit()  # un seul commit (fsync) pour tout le lot
+                cache_codes.invalider()
+        except Exception:
+            conn.rollback()
+            raise
+        
+        nb_erreurs = sum(1 for r in resultats if not r['success'])
+        nb_rejoues = sum(1 for r in resultats if r.get('rejoue'))
+        if annule:
+            # Lignes valides mais annulées avec le reste du lot (les rejeux restent acquis)
+            for ligne in resultats:
+                if ligne['success'] and not ligne.get('rejoue'):
+                    for cle in ('produit', 'quantite', 'stock_precedent', 'nouveau_stock'):
+                        ligne.pop(cle)
+                    ligne.update(success=False, message='Annulé : erreur sur une autre ligne du lot')
         
         return jsonify({
-            'success': True,
-            'nouveau_stock': nouveau_stock,
-            'action': action,
-            'quantite': quantite
+            'success': not annule,
+            'mode': mode,
+            'applique': not annule,
+            'nb_ok': 0 if annule else len(resultats) - nb_erreurs,
+            'nb_erreurs': nb_erreurs,
+            'nb_rejoues': nb_rejoues,
+            'resultats': resultats,
+            'message': 'Lot annulé : aucune modification appliquée' if annule else f'{len(resultats) - nb_erreurs} mouvement(s) appliqué(s)'
         })
         
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
+# Registre des mouvements : instantanés et reconstruction du stock à une date
+JOURS_INSTANTANES_STOCK = None  # conservation des instantanés (None : tous conservés)
+
+def prendre_instantane(conn, garder_jours=JOURS_INSTANTANES_STOCK):
+    """Copie le stock de chaque produit, avec le dernier mouvement du registre qu'il inclut
+
+    Une reconstruction part de l'instantané le plus proche : son coût est borné par le
+    nombre de mouvements écoulés depuis, quelle que soit la taille du registre.
+    Retourne (id de l'instantané, nombre d'instantanés supprimés)
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        instantane_id = conn.execute(
+            'INSERT INTO instantanes_stock (jusqua) SELECT IFNULL(MAX(id), 0) FROM registre_stock'
+        ).lastrowid
+        conn.execute('''INSERT INTO instantanes_stock_lignes (instantane_id, produit_id, stock)
+                        SELECT ?, id, stock FROM produits''', (instantane_id,))
+        supprimes = 0
+        if garder_jours is not None:
+            # Le registre reste complet : seul l'historique reconstructible raccourcit
+            anciens = [ligne['id'] for ligne in conn.execute(
+                "SELECT id FROM instantanes_stock WHERE date < datetime('now', ?) AND id <> ?",
+                (f'-{int(garder_jours)} days', instantane_id))]
+            for ancien in anciens:
+                conn.execute('DELETE FROM instantanes_stock_lignes WHERE instantane_id = ?', (ancien,))
+                conn.execute('DELETE FROM instantanes_stock WHERE id = ?', (ancien,))
+            supprimes = len(anciens)
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+    return instantane_id, supprimes
+
+def lire_date_registre(valeur):
+    """Date ISO (heure UTC si sans fuseau ; jour seul = fin de journée) au format du registre"""
+    valeur = (valeur or '').strip()
+    if not valeur:
+        raise ValueError('Date manquante')
+    date = datetime.fromisoformat(valeur)
+    if len(valeur) == 10:
+        date = date.replace(hour=23, minute=59, second=59)
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return date.strftime('%Y-%m-%d %H:%M:%S')
+
+def stock_a_date(conn, date, produit_id=None):
+    """Stock de chaque produit (ou d'un seul) à la date donnée, format du registre
+
+    Dernier instantané antérieur à la date, plus la somme des mouvements inscrits ensuite
+    jusqu'à la date. Retourne (date de l'instantané, {produit_id: stock}), ou None si la
+    date précède le plus ancien instantané conservé.
+    """
+    conn.execute('BEGIN')  # instantané et registre lus dans le même état de la base
+    try:
+        instantane = conn.execute('''SELECT id, jusqua, date FROM instantanes_stock
+                                     WHERE date <= ? ORDER BY date DESC, id DESC LIMIT 1''',
+                                  (date,)).fetchone()
+        if instantane is None:
+            return None
+        borne = conn.execute('''SELECT id FROM registre_stock WHERE date <= ?
+                                ORDER BY date DESC, id DESC LIMIT 1''', (date,)).fetchone()
+        borne = max(borne['id'] if borne else 0, instantane['jusqua'])
+        if produit_id is None:
+            stocks = {ligne['produit_id']: ligne['stock'] for ligne in conn.execute(
+                'SELECT produit_id, stock FROM instantanes_stock_lignes WHERE instantane_id = ?',
+                (instantane['id'],))}
+            for ligne in conn.execute('''SELECT produit_id, SUM(delta) AS delta FROM registre_stock
+                                         WHERE id > ? AND id <= ? GROUP BY produit_id''',
+                                      (instantane['jusqua'], borne)):
+                stocks[ligne['produit_id']] = stocks.get(ligne['produit_id'], 0) + ligne['delta']
+        else:
+            ligne = conn.execute('''SELECT stock FROM instantanes_stock_lignes
+                                    WHERE instantane_id = ? AND produit_id = ?''',
+                                 (instantane['id'], produit_id)).fetchone()
+            delta = conn.execute('''SELECT IFNULL(SUM(delta), 0) FROM registre_stock
+                                    WHERE produit_id = ? AND id > ? AND id <= ?''',
+                                 (produit_id, instantane['jusqua'], borne)).fetchone()[0]
+            stocks = {produit_id: (ligne['stock'] if ligne else 0) + delta}
+    finally:
+        conn.rollback()
+    return instantane['date'], stocks
+
+@app.route('/api/registre-stock')
+def api_registre_stock():
+    """Mouvements du registre, du plus récent au plus ancien (?produit_id=&avant=&limit=)"""
+    try:
+        try:
+            produit_id = int(request.args['produit_id']) if request.args.get('produit_id') else None
+            avant = int(request.args['avant']) if request.args.get('avant') else None
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Paramètres produit_id/avant invalides'}), 400
+        limite = lire_limite(request.args.get('limit'))
+
+        conditions, params = [], []
+        if produit_id is not None:
+            conditions.append('produit_id = ?')
+            params.append(produit_id)
+        if avant is not None:
+            conditions.append('id < ?')
+            params.append(avant)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        conn = get_db_connection()
+        mouvements = [dict(ligne) for ligne in conn.execute(
+            f'SELECT * FROM registre_stock {where} ORDER BY id DESC LIMIT ?', params + [limite])]
+
+        return jsonify({
+            'success': True,
+            'count': len(mouvements),
+            # id à repasser en avant= pour la page suivante
+            'avant': mouvements[-1]['id'] if len(mouvements) == limite else None,
+            'mouvements': mouvements
+        })
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/stock-a-date')
+def api_stock_a_date():
+    """Stock reconstruit à une date (?date=AAAA-MM-JJ[THH:MM:SS]&produit_id=)"""
+    try:
+        try:
+            date = lire_date_registre(request.args.get('date'))
+            produit_id = int(request.args['produit_id']) if request.args.get('produit_id') else None
+        except ValueError as e:
+            return jsonify({'success': False, 'error': f'Paramètres invalides: {e}'}), 400
+
+        resultat = stock_a_date(get_db_connection(), date, produit_id)
+        if resultat is None:
+            return jsonify({'success': False, 'error': f'Aucun instantané antérieur au {date}'}), 404
+        date_instantane, stocks = resultat
+
+        return jsonify({
+            'success': True,
+            'date': date,
+            'instantane': date_instantane,
+            'count': len(stocks),
+            'stocks': [{'produit_id': pid, 'stock': stock} for pid, stock in sorted(stocks.items())]
+        })
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+# Analyse des ventes : vélocité, couverture et meilleures ventes, lues dans les cumuls
+JOURS_FENETRE_VENTES = 30
+PROFONDEUR_MAX_CLASSEMENT = 1000  # au-delà, meilleures ventes par agrégation complète
+FORMATS_PERIODES = {'heure': '%Y-%m-%d %H:00:00', 'jour': '%Y-%m-%d', 'mois': '%Y-%m'}
+
+def lire_fenetre_ventes(args, maintenant=None):
+    """Fenêtre [début, fin) à l'heure près, en UTC : ?depuis=&jusqua= (dates ISO) ou ?jours=
+
+    jusqua est inclus (jour entier pour une date seule) ; par défaut, les
+    JOURS_FENETRE_VENTES derniers jours jusqu'à l'heure en cours incluse
+    """
+    def lire(valeur):
+        date = datetime.fromisoformat(valeur.strip())
+        if date.tzinfo is not None:
+            date = date.astimezone(timezone.utc).replace(tzinfo=None)
+        return date.replace(minute=0, second=0, microsecond=0)
+
+    maintenant = maintenant or datetime.now(timezone.utc).replace(tzinfo=None)
+    if args.get('jusqua'):
+        fin = lire(args['jusqua']) + (timedelta(days=1) if len(args['jusqua'].strip()) == 10 else timedelta(hours=1))
+    else:
+        fin = maintenant.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    if args.get('depuis'):
+        debut = lire(args['depuis'])
+    else:
+        jours = float(args.get('jours', JOURS_FENETRE_VENTES))
+        if not 0 < jours <= 3660:
+            raise ValueError(f'jours hors limites: {jours}')
+        debut = fin - timedelta(days=jours)
+        debut = debut.replace(minute=0, second=0, microsecond=0)
+    if debut >= fin:
+        raise ValueError('depuis doit précéder jusqua')
+    return debut, fin
+
+def tranches_fenetre(debut, fin, mois=False):
+    """Découpe [début, fin) en plages ('heure' | 'jour' | 'mois', début, fin) les plus larges possibles
+
+    Quelle que soit la longueur de la fenêtre, au plus 2 x 23 heures, 2 x 30 jours et les mois
+    entiers sont lus (sans les mois : tous les jours entiers)
+    """
+    jour_debut = datetime(debut.year, debut.month, debut.day)
+    if jour_debut < debut:
+        jour_debut += timedelta(days=1)
+    jour_fin = datetime(fin.year, fin.month, fin.day)
+    if jour_debut >= jour_fin:
+        return [('heure', debut, fin)]
+
+    tranches = [('heure', debut, jour_debut)] if debut < jour_debut else []
+    mois_debut = datetime(jour_debut.year, jour_debut.month, 1)
+    if mois_debut < jour_debut:
+        mois_debut = datetime(mois_debut.year + mois_debut.month // 12, mois_debut.month % 12 + 1, 1)
+    mois_fin = datetime(jour_fin.year, jour_fin.month, 1)
+    if mois and mois_debut < mois_fin:
+        if jour_debut < mois_debut:
+            tranches.append(('jour', jour_debut, mois_debut))
+        tranches.append(('mois', mois_debut, mois_fin))
+        if mois_fin < jour_fin:
+            tranches.append(('jour', mois_fin, jour_fin))
+    else:
+        tranches.append(('jour', jour_debut, jour_fin))
+    if jour_fin < fin:
+        tranches.append(('heure', jour_fin, fin))
+    return tranches
+
+def requete_tranches(cible, cle, tranches, filtre=None, parmi=None):
+    """UNION ALL des cumuls de cible ('produits' ou 'categories') couvrant les tranches
+
+    filtre : une seule clé ; parmi : un ensemble de clés
+    """
+    condition, valeurs = '', []
+    if filtre is not None:
+        condition, valeurs = f' AND {cle} = ?', [filtre]
+    elif parmi is not None:
+        condition, valeurs = f' AND {cle} IN (SELECT value FROM json_each(?))', [json.dumps(sorted(parmi))]
+    selections, params = [], []
+    for niveau, debut, fin in tranches:
+        selections.append(f'SELECT {cle} AS cle, quantite FROM ventes_{cible}_{niveau} '
+                          f'WHERE {niveau} >= ? AND {niveau} < ?{condition}')
+        params += [debut.strftime(FORMATS_PERIODES[niveau]), fin.strftime(FORMATS_PERIODES[niveau])] + valeurs
+    return ' UNION ALL '.join(selections), params
+
+def duree_jours(debut, fin, maintenant=None):
+    """Jours écoulés de la fenêtre (une fenêtre qui s'étend dans le futur s'arrête à maintenant)"""
+    maintenant = maintenant or datetime.now(timezone.utc).replace(tzinfo=None)
+    return max((min(fin, maintenant) - debut).total_seconds(), 0) / 86400
+
+def indicateurs_ventes(quantite, stock, jours):
+    """Vélocité (unités par jour) et couverture (jours de stock au rythme de la fenêtre)"""
+    velocite = quantite / jours if jours else 0.0
+    return {
+        'quantite': quantite,
+        'velocite_jour': round(velocite, 3),
+        'stock': stock,
+        'jours_couverture': round(stock / velocite, 1) if velocite and stock is not None else None
+    }
+
+def ventes_totales(conn, debut, fin, produit_id=None, categorie=None):
+    """Unités vendues sur la fenêtre : un produit, une catégorie, ou toute la boutique"""
+    if produit_id is not None:
+        sous_requete, params = requete_tranches('produits', 'produit_id', tranches_fenetre(debut, fin), produit_id)
+    else:
+        sous_requete, params = requete_tranches('categories', 'categorie', tranches_fenetre(debut, fin), categorie)
+    return conn.execute(f'SELECT IFNULL(SUM(quantite), 0) FROM ({sous_requete})', params).fetchone()[0]
+
+def serie_ventes(conn, debut, fin, pas, produit_id=None, categorie=None):
+    """Unités vendues par heure ou par jour sur la fenêtre (périodes sans vente omises)"""
+    if pas == 'jour':
+        # Jours entiers couvrant la fenêtre
+        debut = datetime(debut.year, debut.month, debut.day)
+        fin = datetime(fin.year, fin.month, fin.day) + (timedelta(days=1) if fin.hour else timedelta())
+    if produit_id is not None:
+        cible, cle, filtre = 'produits', 'produit_id', produit_id
+    else:
+        cible, cle, filtre = 'categories', 'categorie', categorie
+    condition = f' AND {cle} = ?' if filtre is not None else ''
+    params = [debut.strftime(FORMATS_PERIODES[pas]), fin.strftime(FORMATS_PERIODES[pas])]
+    return [dict(ligne) for ligne in conn.execute(
+        f'''SELECT {pas} AS periode, SUM(quantite) AS quantite FROM ventes_{cible}_{pas}
+            WHERE {pas} >= ? AND {pas} < ?{condition} GROUP BY {pas} ORDER BY {pas}''',
+        params + ([filtre] if filtre is not None else []))]
+
+def periodes_tranche(niveau, debut, fin):
+    """Périodes d'une tranche, au format des cumuls"""
+    periodes = []
+    while debut < fin:
+        periodes.append(debut.strftime(FORMATS_PERIODES[niveau]))
+        if niveau == 'mois':
+            debut = datetime(debut.year + debut.month // 12, debut.month % 12 + 1, 1)
+        else:
+            debut += timedelta(hours=1) if niveau == 'heure' else timedelta(days=1)
+    return periodes
+
+def totaux_ventes(conn, tranches, limite, candidats=None):
+    """(produit_id, quantité) des limite produits les plus vendus sur les tranches, parmi candidats"""
+    sous_requete, params = requete_tranches('produits', 'produit_id', tranches, parmi=candidats)
+    return conn.execute(f'''SELECT cle, SUM(quantite) AS quantite FROM ({sous_requete})
+                            GROUP BY cle ORDER BY quantite DESC LIMIT ?''', params + [limite]).fetchall()
+
+def meilleures_ventes(conn, debut, fin, limite):
+    """Produits les plus vendus sur la fenêtre (cumuls mensuels pour les mois entiers)
+
+    Algorithme à seuil : les profondeur premiers de chaque période (heure, jour ou mois) de la
+    fenêtre sont candidats ; un produit absent de tous ces classements a vendu au plus la somme
+    des derniers scores lus. Si le limite-ième candidat atteint ce seuil, le classement est
+    exact ; sinon la profondeur augmente, puis on se replie sur l'agrégation complète
+    (ventes sans produits phares).
+    """
+    tranches = tranches_fenetre(debut, fin, mois=True)
+    periodes = [(niveau, periode) for niveau, d, f in tranches for periode in periodes_tranche(niveau, d, f)]
+    profondeur = max(2 * limite, 20)
+    classement = None
+    conn.execute('BEGIN')  # classements et totaux lus dans le même état de la base
+    try:
+        while classement is None and profondeur <= PROFONDEUR_MAX_CLASSEMENT:
+            candidats, seuil = set(), 0
+            for niveau, periode in periodes:
+                lignes = conn.execute(f'''SELECT produit_id, quantite FROM ventes_produits_{niveau}
+                                          WHERE {niveau} = ? ORDER BY quantite DESC LIMIT ?''',
+                                      (periode, profondeur)).fetchall()
+                candidats.update(ligne['produit_id'] for ligne in lignes)
+                if len(lignes) == profondeur:
+                    seuil += lignes[-1]['quantite']
+            totaux = totaux_ventes(conn, tranches, limite, candidats)
+            if not seuil or len(totaux) == limite and totaux[-1]['quantite'] >= seuil:
+                classement = totaux
+            profondeur *= 4
+        if classement is None:
+            classement = totaux_ventes(conn, tranches, limite)
+
+        produits = {}
+        if classement:
+            marqueurs = ', '.join('?' * len(classement))
+            produits = {ligne['id']: ligne for ligne in conn.execute(
+                f'SELECT id, nom, code_barres, categorie, stock FROM produits WHERE id IN ({marqueurs})',
+                [ligne['cle'] for ligne in classement])}
+    finally:
+        conn.rollback()
+    return [{'produit_id': ligne['cle'], 'quantite': ligne['quantite'],
+             **{cle: produits[ligne['cle']][cle] if ligne['cle'] in produits else None
+                for cle in ('nom', 'code_barres', 'categorie', 'stock')}}
+            for ligne in classement]
+
+def stock_actuel(conn, produit_id=None, categorie=None):
+    """Stock courant d'un produit, d'une catégorie (statistiques matérialisées) ou de la boutique"""
+    if produit_id is not None:
+        ligne = conn.execute('SELECT stock FROM produits WHERE id = ?', (produit_id,)).fetchone()
+    elif categorie is not None:
+        ligne = conn.execute('SELECT stock_total FROM stats_categories WHERE categorie = ?', (categorie,)).fetchone()
+    else:
+        ligne = conn.execute('SELECT SUM(stock_total) FROM stats_categories').fetchone()
+    return ligne[0] if ligne else None
+
+def lire_cible_ventes(args):
+    """(produit_id, categorie) demandés ; ni l'un ni l'autre : toute la boutique"""
+    produit_id = int(args['produit_id']) if args.get('produit_id') else None
+    return produit_id, (args.get('categorie') or None if produit_id is None else None)
+
+@app.route('/api/ventes/velocite')
+def api_ventes_velocite():
+    """Vélocité et jours de couverture (?produit_id= ou ?categorie=, fenêtre ?jours= ou ?depuis=&jusqua=)"""
+    try:
+        try:
+            debut, fin = lire_fenetre_ventes(request.args)
+            produit_id, categorie = lire_cible_ventes(request.args)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': f'Paramètres invalides: {e}'}), 400
+
+        conn = get_db_connection()
+        quantite = ventes_totales(conn, debut, fin, produit_id, categorie)
+        return jsonify({
+            'success': True,
+            'depuis': debut.isoformat(),
+            'jusqua': fin.isoformat(),
+            'produit_id': produit_id,
+            'categorie': categorie,
+            **indicateurs_ventes(quantite, stock_actuel(conn, produit_id, categorie), duree_jours(debut, fin))
+        })
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/ventes/serie')
+def api_ventes_serie():
+    """Ventes par heure ou par jour (?pas=heure|jour, mêmes cible et fenêtre que /api/ventes/velocite)"""
+    try:
+        pas = request.args.get('pas', 'jour')
+        if pas not in ('heure', 'jour'):
+            return jsonify({'success': False, 'error': 'pas invalide (heure ou jour)'}), 400
+        try:
+            debut, fin = lire_fenetre_ventes(request.args)
+            produit_id, categorie = lire_cible_ventes(request.args)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': f'Paramètres invalides: {e}'}), 400
+
+        points = serie_ventes(get_db_connection(), debut, fin, pas, produit_id, categorie)
+        return jsonify({
+            'success': True,
+            'depuis': debut.isoformat(),
+            'jusqua': fin.isoformat(),
+            'pas': pas,
+            'count': len(points),
+            'points': points
+        })
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/ventes/top')
+def api_ventes_top():
+    """Meilleures ventes sur la fenêtre (?limit=, ?jours= ou ?depuis=&jusqua=), avec vélocité et couverture"""
+    try:
+        try:
+            debut, fin = lire_fenetre_ventes(request.args)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': f'Paramètres invalides: {e}'}), 400
+        limite = lire_limite(request.args.get('limit'), 20)
+
+        jours = duree_jours(debut, fin)
+        produits = [
+            {'produit_id': vente['produit_id'], 'nom': vente['nom'], 'code_barres': vente['code_barres'],
+             'categorie': vente['categorie'], **indicateurs_ventes(vente['quantite'], vente['stock'], jours)}
+            for vente in meilleures_ventes(get_db_connection(), debut, fin, limite)
+        ]
+        return jsonify({
+            'success': True,
+            'depuis': debut.isoformat(),
+            'jusqua': fin.isoformat(),
+            'count': len(produits),
+            'produits': produits
+        })
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+# Seuils de réapprovisionnement : demande lissée sur l'historique, délai fournisseur et stock de sécurité
+JOURS_HISTORIQUE_SEUILS = 90
+LISSAGE_DEMANDE = 0.1      # poids de la veille dans la moyenne exponentielle des ventes journalières
+DELAI_REAPPRO_JOURS = 7
+TAUX_SERVICE = 0.95        # probabilité de ne pas tomber en rupture pendant le délai
+JOURS_VENTE_MIN_SEUIL = 3  # jours avec vente sur la fenêtre en dessous desquels le seuil n'est pas recalculé
+
+def calculer_seuils(ventes, jours, lissage, delai, service, jours_vente_min=JOURS_VENTE_MIN_SEUIL):
+    """(produit_id, seuil, demande_jour) des produits vendus au moins jours_vente_min jours sur la
+    fenêtre, et nombre de produits vendus
+
+    ventes : lignes (produit_id, âge en jours depuis la veille, quantité) des cumuls journaliers ;
+    les jours sans vente comptent pour zéro. Demande et écart-type sont des moyennes
+    exponentielles (poids α(1-α)^âge, normalisés sur la fenêtre) ; le seuil est la demande
+    pendant le délai plus un stock de sécurité z·σ·√délai, arrondi à l'unité supérieure.
+    Un historique plus court ne permet pas d'estimer la demande : ces produits sont ignorés.
+    """
+    total = 1 - (1 - lissage) ** jours
+    poids = [lissage * (1 - lissage) ** age / total for age in range(jours)]
+    z = NormalDist().inv_cdf(service)
+    racine = math.sqrt(delai)
+    if numpy is not None:
+        # Lignes sqlite3.Row aplaties : numpy.array les convertirait une à une, bien plus lentement
+        ventes = numpy.fromiter(chain.from_iterable(ventes), numpy.int64, 3 * len(ventes)).reshape(-1, 3)
+        ids, produits = numpy.unique(ventes[:, 0], return_inverse=True)
+        ponderees = numpy.array(poids)[ventes[:, 1]] * ventes[:, 2]
+        moyenne = numpy.bincount(produits, ponderees, len(ids))
+        carres = numpy.bincount(produits, ponderees * ventes[:, 2], len(ids))
+        ecart_type = numpy.sqrt(numpy.maximum(carres - moyenne * moyenne, 0))
+        seuils = numpy.ceil(moyenne * delai + z * ecart_type * racine - 1e-9).astype(numpy.int64)
+        # Une ligne par produit et par jour de vente
+        retenus = numpy.bincount(produits, minlength=len(ids)) >= jours_vente_min
+        return (list(zip(ids[retenus].tolist(), seuils[retenus].tolist(),
+                         numpy.round(moyenne[retenus], 3).tolist())), len(ids))
+    sommes = {}
+    for produit_id, age, quantite in ventes:
+        somme = sommes.setdefault(produit_id, [0.0, 0.0, 0])
+        somme[0] += poids[age] * quantite
+        somme[1] += poids[age] * quantite * quantite
+        somme[2] += 1
+    resultats = []
+    for produit_id, (moyenne, carres, jours_vente) in sorted(sommes.items()):
+        if jours_vente < jours_vente_min:
+            continue
+        ecart_type = math.sqrt(max(carres - moyenne * moyenne, 0))
+        resultats.append((produit_id, math.ceil(moyenne * delai + z * ecart_type * racine - 1e-9),
+                          round(moyenne, 3)))
+    return resultats, len(sommes)
+
+def recalculer_seuils(conn, jours=JOURS_HISTORIQUE_SEUILS, lissage=LISSAGE_DEMANDE,
+                      delai=DELAI_REAPPRO_JOURS, service=TAUX_SERVICE, jours_vente_min=JOURS_VENTE_MIN_SEUIL,
+                      aujourdhui=None):
+    """Recalcule seuil_reappro et demande_jour des produits depuis les ventes journalières
+
+    Lecture et calcul sans verrou d'écriture ; seules les lignes modifiées sont réécrites, en une
+    mise à jour ensembliste (statistiques et génération tenues par les triggers habituels).
+    Un produit vendu moins de jours_vente_min jours sur la fenêtre (nouveau, jamais vendu, vente
+    occasionnelle) garde son seuil actuel (5 par défaut) : il reste signalé en stock faible.
+    """
+    if not 0 < lissage <= 1 or not 0 < service < 1 or jours < 1 or delai < 0 or not 1 <= jours_vente_min <= jours:
+        raise ValueError('paramètres de calcul des seuils invalides')
+    rapport = {'vendus': 0, 'calcules': 0, 'modifies': 0, 'calcul': 'numpy' if numpy is not None else 'python'}
+    if not conn.execute('SELECT 1 FROM ventes_produits_jour LIMIT 1').fetchone():
+        rapport['calcul'] = None
+        return rapport
+
+    debut = time.perf_counter()
+    aujourdhui = aujourdhui or datetime.now(timezone.utc).date()
+    # Jours complets uniquement : la journée en cours ne compte pas comme une journée creuse
+    ventes = conn.execute(
+        'SELECT produit_id, CAST(julianday(?) - julianday(jour) AS INTEGER), quantite '
+        'FROM ventes_produits_jour WHERE jour >= ? AND jour < ?',
+        ((aujourdhui - timedelta(days=1)).isoformat(), (aujourdhui - timedelta(days=jours)).isoformat(),
+         aujourdhui.isoformat())).fetchall()
+    rapport['lecture'] = round(time.perf_counter() - debut, 3)
+
+    debut = time.perf_counter()
+    seuils, rapport['vendus'] = calculer_seuils(ventes, jours, lissage, delai, service, jours_vente_min)
+    rapport['calcules'] = len(seuils)
+    rapport['duree_calcul'] = round(time.perf_counter() - debut, 3)
+
+    # Lignes à réécrire, préparées hors verrou (seul ce calcul modifie les seuils)
+    debut = time.perf_counter()
+    conn.execute('''CREATE TEMP TABLE IF NOT EXISTS seuils_calcules
+                    (id INTEGER PRIMARY KEY, seuil INTEGER, demande REAL)''')
+    conn.execute('DELETE FROM temp.seuils_calcules')
+    conn.executemany('INSERT INTO temp.seuils_calcules (id, seuil, demande) VALUES (?, ?, ?)', seuils)
+    conn.execute('''DELETE FROM temp.seuils_calcules WHERE NOT EXISTS
+                    (SELECT 1 FROM produits p WHERE p.id = seuils_calcules.id
+                     AND (p.seuil_reappro IS NOT seuils_calcules.seuil
+                          OR p.demande_jour IS NOT seuils_calcules.demande))''')
+    rapport['modifies'] = conn.execute('SELECT COUNT(*) FROM temp.seuils_calcules').fetchone()[0]
+    conn.commit()
+
+    rapport['verrou'] = 0.0
+    if rapport['modifies']:
+        debut_verrou = time.perf_counter()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Une seule instruction : triggers de statistiques (stock faible) et de génération
+            # appliqués ligne à ligne, dans la transaction
+            conn.execute('''UPDATE produits SET seuil_reappro = s.seuil, demande_jour = s.demande
+                            FROM temp.seuils_calcules s WHERE s.id = produits.id''')
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+        rapport['verrou'] = round(time.perf_counter() - debut_verrou, 3)
+    conn.execute('DELETE FROM temp.seuils_calcules')
+    conn.commit()
+    rapport['ecriture'] = round(time.perf_counter() - debut, 3)
+    return rapport
+
+def initialiser_codes_barres(conn, avancer=None):
+    """Codes EAN-13 internes pour les produits qui n'en ont pas, par lots ; renvoie les codes attribués"""
+    total = conn.execute("SELECT COUNT(*) FROM produits WHERE code_barres = ''").fetchone()[0]
+    attribues = []
+    dernier_id = 0
+    while True:
+        if avancer:
+            avancer(min(len(attribues), total), total)
+        # Lecture de la plage et attribution dans la même transaction : pas de doublon entre processus
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            ids = [ligne[0] for ligne in conn.execute(
+                "SELECT id FROM produits WHERE code_barres = '' AND id > ? ORDER BY id LIMIT ?",
+                (dernier_id, TAILLE_LOT_EXPORT)).fetchall()]
+            codes = codes_ean13_internes(conn, len(ids))
+            conn.executemany('UPDATE produits SET code_barres = ? WHERE id = ?', zip(codes, ids))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        if not ids:
+            break
+        attribues.extend(codes)
+        dernier_id = ids[-1]
+    cache_codes.invalider()
+    return attribues
+
 @app.route('/init-codes-barres')
 def init_codes_barres():
-    """Initialiser les codes-barres pour les produits existants"""
+    """Initialiser les codes-barres pour les produits existants (?tache=1 en fond, suivi via /api/jobs/<id>)"""
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Récupérer les produits sans codes-barres
-        cursor.execute('SELECT id, nom FROM produits WHERE code_barres IS NULL OR code_barres = ""')
-        produits = cursor.fetchall()
         
-        # Assigner des codes-barres simples
-        for i, produit in enumerate(produits):
-            code_barres = f"12345678901{i:02d}"  # Codes simples pour test
-            cursor.execute('UPDATE produits SET code_barres = ? WHERE id = ?', (code_barres, produit[0]))
-        
-        conn.commit()
-        conn.close()
+        if request.args.get('tache') == '1':
+            return refus_sans_pool(conn) or reponse_tache_soumise(conn, soumettre_tache(conn, 'init-codes-barres'))
         
+        codes = initialiser_codes_barres(conn)
         return jsonify({
             'success': True, 
-            'message': f'{len(produits)} produits mis à jour avec codes-barres',
-            'codes': [f"12345678901{i:02d}" for i in range(len(produits))]
+            'message': f'{len(codes)} produits mis à jour avec codes-barres',
+            'codes': codes
         })
         
     except Exception as e:
@@ -1052,27 +3684,1114 @@ def test_codes():
 @app.route('/aide')
 def aide():
     """Page d'aide"""
-    return render_template('aide.html', categories=get_categories())
+    return render_template('aide.html')
+
+@app.route('/api/db-pool')
+def api_db_pool():
+    """Compteurs du pool de connexions du worker courant"""
+    return jsonify({'success': True, 'pool': db_pool.stats()})
+
+@app.route('/api/cache-codes')
+def api_cache_codes():
+    """Compteurs du cache des codes-barres du worker courant"""
+    return jsonify({'success': True, 'cache': cache_codes.stats()})
+
+@app.route('/api/cache-categories')
+def api_cache_categories():
+    """Compteurs du cache des catégories du worker courant"""
+    return jsonify({'success': True, 'cache': cache_categories.stats()})
 
 @app.route('/favicon.ico')
 def favicon():
     """Favicon simple"""
     return '', 204
 
+# Tâches de fond : file dans SQLite, exécutée hors des workers HTTP par un pool de threads
+# (flask taches, lancé par gunicorn si BOUTIQUE_TACHES=1) ; plusieurs pools peuvent servir la même base
+DOSSIER_TACHES = (os.environ.get('BOUTIQUE_TACHES_DOSSIER')
+                  or os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), 'taches'))
+TACHES_ACTIVEES = os.environ.get('BOUTIQUE_TACHES') == '1'
+THREADS_TACHES = int(os.environ.get('BOUTIQUE_TACHES_THREADS', '2'))
+MAX_TENTATIVES_TACHE = 3
+DELAI_REESSAI_TACHE = 5       # secondes avant la 2e tentative, doublé ensuite
+DELAI_ABANDON_TACHE = 60      # secondes sans signe de vie : exécution perdue, remise en file
+INTERVALLE_SIGNE_VIE_POOL = 5  # secondes entre deux signes de vie d'un pool
+DELAI_POOL_INACTIF = 15       # secondes sans signe de vie : pool considéré arrêté
+JOURS_CONSERVATION_TACHES = 7
+STATUTS_TACHES = ('en_attente', 'en_cours', 'terminee', 'echouee', 'annulee')
+STATUTS_FINAUX = ('terminee', 'echouee', 'annulee')
+# Erreurs de la tâche elle-même (paramètres, données) : une nouvelle tentative n'y changerait rien
+ERREURS_DEFINITIVES = (ValueError, TypeError)
+
+logger_taches = logging.getLogger('boutique.taches')
+logger_taches.setLevel(logging.INFO)
+if not logger_taches.handlers:
+    _handler_taches = logging.StreamHandler()
+    _handler_taches.setFormatter(logging.Formatter('%(asctime)s %(name)s %(levelname)s %(message)s'))
+    logger_taches.addHandler(_handler_taches)
+    logger_taches.propagate = False
+
+TYPES_TACHES = OrderedDict()
+
+def type_tache(nom, parametres=(), api=True):
+    """Enregistre fonction(conn, tache, **parametres) -> dict (résultat) comme type de tâche
+
+    api=False : type soumis seulement par l'application (pas par POST /api/jobs)
+    """
+    def enregistrer(fonction):
+        TYPES_TACHES[nom] = {'fonction': fonction, 'parametres': frozenset(parametres), 'api': api}
+        return fonction
+    return enregistrer
+
+class TacheAnnulee(Exception):
+    """Levée par Tache.avancer() quand l'annulation de la tâche a été demandée"""
+
+class Tache:
+    """Exécution d'une tâche, vue depuis sa fonction : progression, annulation, fichier résultat"""
+
+    def __init__(self, ligne, jeton):
+        self.id = ligne['id']
+        self.type = ligne['type']
+        self.parametres = json.loads(ligne['parametres'])
+        self.tentative = ligne['tentatives']
+        self.max_tentatives = ligne['max_tentatives']
+        self.jeton = jeton
+        self.progression = 0.0
+        self.message = None
+        self.annulee = False  # positionné par le superviseur du pool
+        self.fichier = None
+        self.type_fichier = None
+
+    def avancer(self, progression, message=None):
+        """Progression de 0 à 1 (publiée par le superviseur) ; TacheAnnulee si l'annulation est demandée"""
+        self.progression = min(max(progression, 0.0), 1.0)
+        if message is not None:
+            self.message = message
+        if self.annulee:
+            raise TacheAnnulee()
+
+    def chemin_resultat(self, nom, type_fichier):
+        """Chemin du fichier résultat, téléchargeable via /api/jobs/<id>/resultat"""
+        os.makedirs(DOSSIER_TACHES, exist_ok=True)
+        self.fichier = f'{self.id}-{nom}'
+        self.type_fichier = type_fichier
+        return os.path.join(DOSSIER_TACHES, self.fichier)
+
+SQL_RECLAMER_TACHE = '''
+    UPDATE taches SET statut = 'en_cours', jeton = ?, tentatives = tentatives + 1, progression = 0,
+                      message = NULL, demarre_le = CURRENT_TIMESTAMP, vu_le = CURRENT_TIMESTAMP
+    WHERE id = (SELECT id FROM taches WHERE statut = 'en_attente' AND executer_apres <= CURRENT_TIMESTAMP
+                ORDER BY executer_apres, id LIMIT 1)
+    RETURNING id, type, parametres, tentatives, max_tentatives
+'''
+
+class PoolTaches:
+    """Threads qui réclament et exécutent les tâches en attente, plus un superviseur
+
+    Une tâche est réclamée par une seule mise à jour sous verrou d'écriture : jamais deux
+    exécutions à la fois, quel que soit le nombre de pools. Le superviseur publie progression
+    et signe de vie des exécutions du pool, leur relaie les annulations et remet en file les
+    exécutions abandonnées par un pool disparu. Le jeton de chaque tentative garantit qu'une
+    exécution remise en file ne peut plus écrire son résultat.
+    """
+
+    def __init__(self, threads=THREADS_TACHES, intervalle=1.0):
+        self.threads = threads
+        self.intervalle = intervalle
+        self._reveil = threading.Event()
+        self._arret = threading.Event()
+        self._lock = threading.Lock()
+        self._en_cours = {}  # jeton -> Tache
+        self._pid = None
+        self.identifiant = None
+        self.executees = 0
+
+    def demarrer(self):
+        """Lance les threads dans ce processus (sans effet s'ils tournent déjà)"""
+        with self._lock:
+            if self._pid == os.getpid() and not self._arret.is_set():
+                return
+            self._pid = os.getpid()
+            self._arret.clear()
+            self.identifiant = f'{os.getpid()}-{os.urandom(4).hex()}'
+        # Premier signe de vie avant de rendre la main : les soumissions qui suivent sont acceptées
+        conn = db_pool.acquire()
+        try:
+            self._signaler(conn)
+        finally:
+            db_pool.release(conn)
+        for numero in range(self.threads):
+            threading.Thread(target=self._boucle, name=f'tache-{numero + 1}', daemon=True).start()
+        threading.Thread(target=self._superviser, name='taches-superviseur', daemon=True).start()
+
+    def actif(self):
+        return self._pid == os.getpid() and not self._arret.is_set()
+
+    def reveiller(self):
+        """Tâche soumise depuis ce processus : pas besoin d'attendre le prochain passage"""
+        self._reveil.set()
+
+    def arreter(self):
+        """Arrête le pool ; les exécutions en cours sont remises en file (sans compter de tentative)"""
+        self._arret.set()
+        self._reveil.set()
+        with self._lock:
+            jetons = [(jeton,) for jeton in self._en_cours]
+            self._en_cours.clear()
+        conn = db_pool.acquire()
+        try:
+            if jetons:
+                conn.executemany('''UPDATE taches SET statut = 'en_attente', jeton = NULL, progression = 0,
+                                    tentatives = tentatives - 1, executer_apres = CURRENT_TIMESTAMP
+                                    WHERE jeton = ? AND statut = 'en_cours' ''', jetons)
+            conn.execute('DELETE FROM pools_taches WHERE id = ?', (self.identifiant,))
+            conn.commit()
+        finally:
+            db_pool.release(conn)
+
+    def _boucle(self):
+        while not self._arret.is_set():
+            try:
+                tache = self._reclamer()
+            except sqlite3.Error as e:
+                logger_taches.warning(json.dumps({'evenement': 'reclamation-erreur', 'erreur': str(e)}))
+                tache = None
+            if tache is None:
+                self._reveil.wait(self.intervalle)
+                self._reveil.clear()
+                continue
+            self._executer(tache)
+
+    def _reclamer(self):
+        conn = db_pool.acquire()
+        try:
+            # Lecture sans verrou d'abord : un pool inactif ne prend jamais le verrou d'écriture
+            if not conn.execute("SELECT 1 FROM taches WHERE statut = 'en_attente' "
+                                "AND executer_apres <= CURRENT_TIMESTAMP LIMIT 1").fetchone():
+                return None
+            jeton = os.urandom(12).hex()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                ligne = conn.execute(SQL_RECLAMER_TACHE, (jeton,)).fetchone()
+            except Exception:
+                conn.rollback()
+                raise
+            conn.commit()
+        finally:
+            db_pool.release(conn)
+        if ligne is None:
+            return None  # réclamée entre-temps par un autre thread ou pool
+        tache = Tache(ligne, jeton)
+        with self._lock:
+            self._en_cours[jeton] = tache
+        return tache
+
+    def _executer(self, tache):
+        definition = TYPES_TACHES.get(tache.type)
+        conn = db_pool.acquire()
+        try:
+            if definition is None:
+                raise ValueError(f'type de tâche inconnu: {tache.type}')
+            resultat = definition['fonction'](conn, tache, **tache.parametres)
+            statut, erreur = 'terminee', None
+        except TacheAnnulee:
+            statut, resultat, erreur = 'annulee', None, None
+        except Exception as e:
+            statut, resultat, erreur = 'echouee', None, e
+        finally:
+            # Transaction laissée ouverte par la tâche : annulée avant d'écrire son statut
+            db_pool.release(conn)
+        with self._lock:
+            if self._en_cours.pop(tache.jeton, None) is None:
+                return  # pool arrêté entre-temps : tâche déjà remise en file
+        try:
+            self._terminer(tache, statut, resultat, erreur)
+        except sqlite3.Error as e:
+            # Statut non écrit : le superviseur d'un pool la remettra en file (signe de vie perdu)
+            logger_taches.warning(json.dumps({'evenement': 'fin-erreur', 'tache': tache.id, 'erreur': str(e)}))
+        self.executees += 1
+
+    def _terminer(self, tache, statut, resultat, erreur):
+        reessai = (statut == 'echouee' and not isinstance(erreur, ERREURS_DEFINITIVES)
+                   and tache.tentative < tache.max_tentatives)
+        if statut != 'terminee' and tache.fichier:
+            supprimer_fichier_tache(tache.fichier)
+            tache.fichier = tache.type_fichier = None
+        conn = db_pool.acquire()
+        try:
+            if reessai:
+                delai = DELAI_REESSAI_TACHE * 2 ** (tache.tentative - 1)
+                conn.execute('''UPDATE taches SET statut = 'en_attente', jeton = NULL, erreur = ?,
+                                executer_apres = datetime('now', ?)
+                                WHERE id = ? AND jeton = ?''',
+                             (str(erreur), f'+{delai} seconds', tache.id, tache.jeton))
+            else:
+                conn.execute('''UPDATE taches SET statut = ?, jeton = NULL, erreur = ?, resultat = ?,
+                                progression = CASE WHEN ? = 'terminee' THEN 1 ELSE progression END,
+                                message = ?, fichier = ?, type_fichier = ?, termine_le = CURRENT_TIMESTAMP
+                                WHERE id = ? AND jeton = ?''',
+                             (statut, str(erreur) if erreur else None,
+                              json.dumps(resultat) if resultat is not None else None, statut,
+                              tache.message, tache.fichier, tache.type_fichier, tache.id, tache.jeton))
+            conn.commit()
+        finally:
+            db_pool.release(conn)
+        if erreur is not None:
+            logger_taches.warning(json.dumps({'evenement': 'reessai' if reessai else 'echec', 'tache': tache.id,
+                                              'type': tache.type, 'tentative': tache.tentative,
+                                              'erreur': str(erreur)}))
+
+    def _superviser(self):
+        purge, signe_vie = 0.0, time.monotonic()
+        while not self._arret.wait(self.intervalle):
+            conn = db_pool.acquire()
+            try:
+                if time.monotonic() - signe_vie >= INTERVALLE_SIGNE_VIE_POOL:
+                    self._signaler(conn)
+                    signe_vie = time.monotonic()
+                self._publier(conn)
+                recuperer_taches_abandonnees(conn)
+                planifier_taches_periodiques(conn)
+                if time.monotonic() - purge > 3600:
+                    purger_taches(conn)
+                    purge = time.monotonic()
+            except sqlite3.Error as e:
+                logger_taches.warning(json.dumps({'evenement': 'superviseur-erreur', 'erreur': str(e)}))
+            finally:
+                db_pool.release(conn)
+
+    def _signaler(self, conn):
+        """Signe de vie du pool (et oubli des pools arrêtés sans s'être retirés)"""
+        conn.execute('''INSERT INTO pools_taches (id, threads) VALUES (?, ?)
+                        ON CONFLICT (id) DO UPDATE SET threads = excluded.threads, vu_le = CURRENT_TIMESTAMP''',
+                     (self.identifiant, self.threads))
+        conn.execute("DELETE FROM pools_taches WHERE vu_le < datetime('now', '-1 day')")
+        conn.commit()
+
+    def _publier(self, conn):
+        """Progression et signe de vie des exécutions du pool ; annulations demandées entre-temps"""
+        with self._lock:
+            taches = list(self._en_cours.values())
+        if not taches:
+            return
+        conn.executemany('UPDATE taches SET progression = ?, message = ?, vu_le = CURRENT_TIMESTAMP '
+                         'WHERE id = ? AND jeton = ?',
+                         [(tache.progression, tache.message, tache.id, tache.jeton) for tache in taches])
+        conn.commit()
+        marqueurs = ','.join('?' * len(taches))
+        annulees = {ligne[0] for ligne in conn.execute(
+            f'SELECT jeton FROM taches WHERE annulation = 1 AND id IN ({marqueurs})',
+            [tache.id for tache in taches])}
+        for tache in taches:
+            if tache.jeton in annulees:
+                tache.annulee = True
+
+pool_taches = PoolTaches()
+
+def supprimer_fichier_tache(nom):
+    try:
+        os.remove(os.path.join(DOSSIER_TACHES, os.path.basename(nom)))
+    except FileNotFoundError:
+        pass
+
+def soumettre_tache(conn, type_tache_soumis, parametres=None, max_tentatives=MAX_TENTATIVES_TACHE):
+    """Met une tâche en file et renvoie son identifiant ; ValueError si type ou paramètres inconnus"""
+    definition = TYPES_TACHES.get(type_tache_soumis)
+    if definition is None:
+        raise ValueError(f'type de tâche inconnu: {type_tache_soumis}')
+    parametres = parametres or {}
+    inconnus = set(parametres) - definition['parametres']
+    if inconnus:
+        raise ValueError(f"paramètre(s) inconnu(s) pour {type_tache_soumis}: {', '.join(sorted(inconnus))}")
+    if not 1 <= max_tentatives <= 10:
+        raise ValueError('max_tentatives doit être compris entre 1 et 10')
+    cursor = conn.execute('INSERT INTO taches (type, parametres, max_tentatives) VALUES (?, ?, ?)',
+                          (type_tache_soumis, json.dumps(parametres), max_tentatives))
+    conn.commit()
+    pool_taches.reveiller()
+    return cursor.lastrowid
+
+def pools_actifs(conn):
+    """Nombre de pools ayant donné signe de vie récemment (dans ce processus ou ailleurs)"""
+    return conn.execute("SELECT COUNT(*) FROM pools_taches WHERE vu_le >= datetime('now', ?)",
+                        (f'-{DELAI_POOL_INACTIF} seconds',)).fetchone()[0]
+
+def refus_sans_pool(conn):
+    """503 si aucun pool n'exécute les tâches (une tâche soumise resterait en attente), sinon None"""
+    if pools_actifs(conn):
+        return None
+    response = jsonify({'success': False,
+                        'error': 'aucun pool actif : tâches de fond non exécutées '
+                                 '(BOUTIQUE_TACHES=1, ou flask --app app taches)'})
+    response.status_code = 503
+    return response
+
+def decrire_tache(ligne):
+    """Représentation JSON d'une tâche (liens de suivi et de téléchargement compris)"""
+    tache = {cle: ligne[cle] for cle in ligne.keys() if cle not in ('jeton', 'fichier')}
+    tache['parametres'] = json.loads(ligne['parametres'])
+    tache['resultat'] = json.loads(ligne['resultat']) if ligne['resultat'] else None
+    tache['url'] = url_for('api_job', tache_id=ligne['id'])
+    tache['resultat_url'] = (url_for('api_job_resultat', tache_id=ligne['id'])
+                             if ligne['fichier'] and ligne['statut'] == 'terminee' else None)
+    return tache
+
+def reponse_tache_soumise(conn, tache_id):
+    """202 Accepted avec la tâche et son URL de suivi"""
+    ligne = conn.execute('SELECT * FROM taches WHERE id = ?', (tache_id,)).fetchone()
+    response = jsonify({'success': True, 'tache': decrire_tache(ligne)})
+    response.status_code = 202
+    response.headers['Location'] = url_for('api_job', tache_id=tache_id)
+    return response
+
+def recuperer_taches_abandonnees(conn):
+    """Remet en file (ou en échec, tentatives épuisées) les exécutions sans signe de vie"""
+    delai = f'-{DELAI_ABANDON_TACHE} seconds'
+    if not conn.execute("SELECT 1 FROM taches WHERE statut = 'en_cours' AND vu_le < datetime('now', ?) LIMIT 1",
+                        (delai,)).fetchone():
+        return 0
+    cursor = conn.execute('''
+        UPDATE taches SET
+            statut = CASE WHEN annulation THEN 'annulee'
+                          WHEN tentatives < max_tentatives THEN 'en_attente' ELSE 'echouee' END,
+            termine_le = CASE WHEN annulation OR tentatives >= max_tentatives THEN CURRENT_TIMESTAMP END,
+            erreur = 'exécution interrompue (pool arrêté ou bloqué)',
+            jeton = NULL, executer_apres = CURRENT_TIMESTAMP
+        WHERE statut = 'en_cours' AND vu_le < datetime('now', ?)
+    ''', (delai,))
+    conn.commit()
+    if cursor.rowcount:
+        logger_taches.warning(json.dumps({'evenement': 'abandonnees', 'taches': cursor.rowcount}))
+    return cursor.rowcount
+
+def lire_taches_periodiques(valeur):
+    """{type: heures} depuis 'recalculer-seuils=24,instantane-stock=24'"""
+    periodiques = {}
+    for element in (valeur or '').split(','):
+        if not element.strip():
+            continue
+        nom, _, heures = element.partition('=')
+        periodiques[nom.strip()] = float(heures)
+    return periodiques
+
+def planifier_taches_periodiques(conn):
+    """Soumet chaque tâche périodique dont aucune n'a été créée depuis sa période (un seul pool la crée)"""
+    for nom, heures in TACHES_PERIODIQUES.items():
+        depuis = f'-{int(heures * 3600)} seconds'
+        if conn.execute("SELECT 1 FROM taches WHERE type = ? AND cree_le > datetime('now', ?) LIMIT 1",
+                        (nom, depuis)).fetchone():
+            continue
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('''INSERT INTO taches (type) SELECT ? WHERE NOT EXISTS
+                            (SELECT 1 FROM taches WHERE type = ? AND cree_le > datetime('now', ?))''',
+                         (nom, nom, depuis))
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+
+def purger_taches(conn, jours=JOURS_CONSERVATION_TACHES):
+    """Supprime les tâches terminées depuis plus de jours jours, avec leurs fichiers"""
+    lignes = conn.execute(
+        "SELECT id, fichier, parametres FROM taches WHERE statut IN ('terminee', 'echouee', 'annulee') "
+        "AND termine_le < datetime('now', ?)", (f'-{jours} days',)).fetchall()
+    for ligne in lignes:
+        # Résultat, et fichier reçu pour un import
+        for fichier in (ligne['fichier'], json.loads(ligne['parametres']).get('fichier')):
+            if fichier:
+                supprimer_fichier_tache(fichier)
+    conn.executemany('DELETE FROM taches WHERE id = ?', [(ligne['id'],) for ligne in lignes])
+    conn.commit()
+    return len(lignes)
+
+# Types de tâches
+
+@type_tache('export', parametres=('colonnes',))
+def tache_export(conn, tache, colonnes=None):
+    """Export CSV du catalogue dans un fichier, téléchargé ensuite"""
+    colonnes = lire_colonnes_export(colonnes)
+    total = conn.execute('SELECT IFNULL(SUM(nb), 0) FROM stats_categories').fetchone()[0]
+    chemin = tache.chemin_resultat(f'produits_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv', 'text/csv')
+    with open(chemin, 'wb') as fichier:
+        for numero, morceau in enumerate(generer_csv(conn, colonnes)):
+            fichier.write(morceau)
+            # Un morceau par lot de TAILLE_LOT_EXPORT lignes (le premier : les en-têtes)
+            tache.avancer(min(numero * TAILLE_LOT_EXPORT / total, 0.99) if total else 0.99)
+    return {'produits': total, 'colonnes': colonnes, 'octets': os.path.getsize(chemin)}
+
+@type_tache('import', parametres=('fichier', 'format'), api=False)
+def tache_import(conn, tache, fichier, format='csv'):
+    """Import en masse d'un fichier reçu par POST /import?tache=1
+
+    Une annulation arrête l'import au lot suivant : les lots déjà écrits sont conservés
+    (l'upsert rend une nouvelle tentative sans effet sur eux).
+    """
+    chemin = os.path.join(DOSSIER_TACHES, os.path.basename(fichier))
+    taille = os.path.getsize(chemin) or 1
+    with open(chemin, 'rb') as brut:
+        texte = io.TextIOWrapper(brut, encoding='utf-8-sig', newline='')
+        lignes = lire_lignes_ndjson(texte) if format == 'ndjson' else lire_lignes_csv(texte)
+
+        def suivies():
+            for numero, (ligne, donnees) in enumerate(lignes):
+                if numero % 1000 == 0:
+                    tache.avancer(min(brut.tell() / taille, 0.99), f'{numero} lignes lues')
+                yield ligne, donnees
+
+        rapport = importer_produits(conn, suivies())
+    supprimer_fichier_tache(fichier)
+    return {'format': format, **rapport}
+
+@type_tache('init-codes-barres')
+def tache_init_codes_barres(conn, tache):
+    """Codes EAN-13 internes pour les produits qui n'en ont pas (voir initialiser_codes_barres)"""
+    codes = initialiser_codes_barres(
+        conn, avancer=lambda fait, total: tache.avancer(fait / total, f'{fait} produits sur {total}'))
+    return {'message': f'{len(codes)} produits mis à jour avec codes-barres', 'mis_a_jour': len(codes),
+            'codes': codes[:MAX_ERREURS_IMPORT]}
+
+@type_tache('planche', parametres=('ids', 'copies'))
+def tache_planche(conn, tache, ids=None, copies=1):
+    """Planche d'étiquettes (HTML imprimable) dans un fichier"""
+    etiquettes = etiquettes_planche(conn, ids, copies, tache.avancer)
+    chemin = tache.chemin_resultat('planche.html', 'text/html')
+    with app.app_context():
+        html = render_template('planche_codes_barres.html', etiquettes=etiquettes)
+    with open(chemin, 'w', encoding='utf-8') as fichier:
+        fichier.write(html)
+    return {'etiquettes': len(etiquettes), 'octets': os.path.getsize(chemin)}
+
+@type_tache('recalculer-seuils', parametres=('jours', 'lissage', 'delai', 'service', 'jours_vente_min'))
+def tache_recalculer_seuils(conn, tache, **parametres):
+    """Seuils de réapprovisionnement (voir flask recalculer-seuils)"""
+    return recalculer_seuils(conn, **parametres)
+
+@type_tache('instantane-stock', parametres=('garder_jours',))
+def tache_instantane_stock(conn, tache, garder_jours=JOURS_INSTANTANES_STOCK):
+    """Instantané du stock (voir flask instantane-stock)"""
+    instantane_id, supprimes = prendre_instantane(conn, garder_jours)
+    return {'instantane': instantane_id, 'supprimes': supprimes}
+
+@type_tache('recalculer-ventes')
+def tache_recalculer_ventes(conn, tache):
+    """Cumuls des ventes reconstruits depuis le registre"""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        recalculer_ventes(conn)
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+    return {'tables': [table for table, *_ in ROLLUPS_VENTES]}
+
+@type_tache('recalculer-stats')
+def tache_recalculer_stats(conn, tache):
+    """Statistiques matérialisées reconstruites depuis produits"""
+    ecarts = verifier_stats_stock(conn)
+    if ecarts:
+        recalculer_stats_stock(conn)
+    return {'ecarts': len(ecarts)}
+
+@type_tache('compacter-changements', parametres=('jours',))
+def tache_compacter_changements(conn, tache, jours=JOURS_HISTORIQUE_CHANGEMENTS):
+    """Historique de /api/changes et clés d'idempotence anciennes supprimés"""
+    return {'changements': compacter_changements(conn, jours), 'cles': purger_cles_idempotence(conn)}
+
+# Tâches soumises automatiquement par les pools : BOUTIQUE_TACHES_PERIODIQUES='recalculer-seuils=24,...'
+TACHES_PERIODIQUES = lire_taches_periodiques(os.environ.get('BOUTIQUE_TACHES_PERIODIQUES', ''))
+_periodiques_inconnues = set(TACHES_PERIODIQUES) - set(TYPES_TACHES)
+if _periodiques_inconnues:
+    raise RuntimeError(f"BOUTIQUE_TACHES_PERIODIQUES : type(s) inconnu(s) {', '.join(sorted(_periodiques_inconnues))}")
+
+def lire_tache(conn, tache_id):
+    return conn.execute('SELECT * FROM taches WHERE id = ?', (tache_id,)).fetchone()
+
+@app.route('/api/jobs', methods=['GET', 'POST'])
+def api_jobs():
+    """Soumettre une tâche de fond (POST {type, parametres, max_tentatives}) ou lister les dernières"""
+    try:
+        conn = get_db_connection()
+        if request.method == 'POST':
+            donnees = request.get_json(silent=True) or {}
+            definition = TYPES_TACHES.get(donnees.get('type'))
+            if definition is None or not definition['api']:
+                return jsonify({'success': False, 'error': 'type de tâche inconnu',
+                                'types': [nom for nom, d in TYPES_TACHES.items() if d['api']]}), 400
+            refus = refus_sans_pool(conn)
+            if refus:
+                return refus
+            try:
+                parametres = donnees.get('parametres') or {}
+                if not isinstance(parametres, dict):
+                    raise ValueError('parametres doit être un objet JSON')
+                tache_id = soumettre_tache(conn, donnees['type'], parametres,
+                                           int(donnees.get('max_tentatives', MAX_TENTATIVES_TACHE)))
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+            return reponse_tache_soumise(conn, tache_id)
+
+        filtres, params = [], []
+        statut = request.args.get('statut')
+        if statut:
+            if statut not in STATUTS_TACHES:
+                return jsonify({'success': False, 'error': f'statut invalide ({", ".join(STATUTS_TACHES)})'}), 400
+            filtres.append('statut = ?')
+            params.append(statut)
+        if request.args.get('type'):
+            filtres.append('type = ?')
+            params.append(request.args['type'])
+        where = f"WHERE {' AND '.join(filtres)}" if filtres else ''
+        lignes = conn.execute(f'SELECT * FROM taches {where} ORDER BY id DESC LIMIT ?',
+                              params + [lire_limite(request.args.get('limit'), 50)]).fetchall()
+        return jsonify({'success': True, 'pools_actifs': pools_actifs(conn), 'count': len(lignes),
+                        'taches': [decrire_tache(l) for l in lignes]})
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/jobs/<int:tache_id>')
+def api_job(tache_id):
+    """Statut, progression et résultat d'une tâche de fond"""
+    try:
+        ligne = lire_tache(get_db_connection(), tache_id)
+        if ligne is None:
+            return jsonify({'success': False, 'error': 'Tâche introuvable'}), 404
+        return jsonify({'success': True, 'tache': decrire_tache(ligne)})
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/jobs/<int:tache_id>/resultat')
+def api_job_resultat(tache_id):
+    """Fichier produit par une tâche terminée (export CSV, planche d'étiquettes)"""
+    try:
+        ligne = lire_tache(get_db_connection(), tache_id)
+        if ligne is None or not ligne['fichier']:
+            return jsonify({'success': False, 'error': 'Aucun fichier pour cette tâche'}), 404
+        if ligne['statut'] != 'terminee':
+            return jsonify({'success': False, 'error': f"Tâche {ligne['statut']}"}), 409
+        chemin = os.path.join(DOSSIER_TACHES, os.path.basename(ligne['fichier']))
+        if not os.path.exists(chemin):
+            return jsonify({'success': False, 'error': 'Fichier expiré'}), 410
+        return send_file(chemin, mimetype=ligne['type_fichier'],
+                         as_attachment=ligne['type_fichier'] != 'text/html',
+                         download_name=ligne['fichier'].split('-', 1)[1])
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/jobs/<int:tache_id>/annuler', methods=['POST'])
+def api_job_annuler(tache_id):
+    """Annule une tâche en attente, ou demande l'arrêt d'une tâche en cours"""
+    try:
+        conn = get_db_connection()
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute("UPDATE taches SET statut = 'annulee', termine_le = CURRENT_TIMESTAMP "
+                     "WHERE id = ? AND statut = 'en_attente'", (tache_id,))
+        conn.execute("UPDATE taches SET annulation = 1 WHERE id = ? AND statut = 'en_cours'", (tache_id,))
+        conn.commit()
+        ligne = lire_tache(conn, tache_id)
+        if ligne is None:
+            return jsonify({'success': False, 'error': 'Tâche introuvable'}), 404
+        return jsonify({'success': True, 'tache': decrire_tache(ligne)})
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/jobs/<int:tache_id>/relancer', methods=['POST'])
+def api_job_relancer(tache_id):
+    """Remet en file une tâche échouée ou annulée (tentatives remises à zéro)"""
+    try:
+        conn = get_db_connection()
+        refus = refus_sans_pool(conn)
+        if refus:
+            return refus
+        cursor = conn.execute('''UPDATE taches SET statut = 'en_attente', tentatives = 0, annulation = 0,
+                                 progression = 0, message = NULL, erreur = NULL, termine_le = NULL,
+                                 executer_apres = CURRENT_TIMESTAMP
+                                 WHERE id = ? AND statut IN ('echouee', 'annulee')''', (tache_id,))
+        conn.commit()
+        ligne = lire_tache(conn, tache_id)
+        if ligne is None:
+            return jsonify({'success': False, 'error': 'Tâche introuvable'}), 404
+        if not cursor.rowcount:
+            return jsonify({'success': False, 'error': f"Tâche {ligne['statut']} : rien à relancer"}), 409
+        pool_taches.reveiller()
+        return reponse_tache_soumise(conn, tache_id)
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+def requetes_des_routes():
+    """Requêtes SQL servies par les routes (pour le contrôle des plans d'exécution)"""
+    requetes = [
+        ('index/produits/statistiques/api-stats', 'SELECT * FROM stats_categories WHERE nb > 0 ORDER BY nb DESC', []),
+        ('ruptures', 'SELECT * FROM produits WHERE stock = 0 ORDER BY nom', []),
+        ('stock-faible', f'SELECT * FROM produits WHERE {CONDITION_STOCK_FAIBLE} ORDER BY stock ASC', []),
+        ('gestion-stock/codes-barres/export/api', 'SELECT * FROM produits ORDER BY nom', []),
+        ('scan', 'SELECT * FROM produits WHERE code_barres = ?', ['PHONE001']),
+        ('api/scan-product',
+         'SELECT * FROM produits WHERE code_barres >= ? AND code_barres < ? ORDER BY code_barres LIMIT 1',
+         ['PHONE', borne_prefixe('PHONE')]),
+        ('modifier/generer-code/ajuster-stock', 'SELECT * FROM produits WHERE id = ?', [1]),
+        ('init-codes-barres', "SELECT id FROM produits WHERE code_barres = '' AND id > ? ORDER BY id LIMIT ?",
+         [0, TAILLE_LOT_EXPORT]),
+        ('init-codes-barres: plage interne',
+         'SELECT code_barres FROM produits WHERE code_barres GLOB ? ORDER BY code_barres DESC LIMIT 1',
+         [PREFIXE_EAN13_INTERNE + '[0-9]' * 10]),
+        ('catégories', 'SELECT * FROM categories ORDER BY nom', []),
+        ('api/changes: révision', "SELECT seq FROM sqlite_sequence WHERE name = 'mouvements_stock'", []),
+        ('compacter-changements',
+         "SELECT MAX(rev) FROM mouvements_stock WHERE date < datetime('now', ?)", ['-30 days']),
+        # (première page : même parcours par rowid décroissant, arrêté à LIMIT)
+        ('api/registre-stock', 'SELECT * FROM registre_stock WHERE id < ? ORDER BY id DESC LIMIT ?', [1000, 50]),
+        ('api/registre-stock produit',
+         'SELECT * FROM registre_stock WHERE produit_id = ? AND id < ? ORDER BY id DESC LIMIT ?', [1, 1000, 50]),
+        ('api/stock-a-date: borne',
+         'SELECT id FROM registre_stock WHERE date <= ? ORDER BY date DESC, id DESC LIMIT 1',
+         ['2024-01-01 00:00:00']),
+        ('api/stock-a-date',
+         'SELECT produit_id, SUM(delta) AS delta FROM registre_stock WHERE id > ? AND id <= ? GROUP BY produit_id',
+         [0, 1000]),
+        ('api/stock-a-date produit',
+         'SELECT IFNULL(SUM(delta), 0) FROM registre_stock WHERE produit_id = ? AND id > ? AND id <= ?',
+         [1, 0, 1000]),
+    ]
+    # Toutes les combinaisons filtre/tri de /produits et de l'accueil
+    for categorie in ('', 'Autre'):
+        for stock_filter in ('', 'out', 'low', 'ok'):
+            for prix_min, prix_max in (('', ''), ('10', '100')):
+                for tri in COLONNES_TRI:
+                    for ordre in ('asc', 'desc'):
+                        query, params, _ = construire_requete_produits('', categorie, stock_filter,
+                                                                       prix_min, prix_max, tri, ordre,
+                                                                       limite=TAILLE_PAGE_DEFAUT + 1)
+                        nom = f'produits cat={categorie or "-"} stock={stock_filter or "-"} prix={prix_min or "-"}..{prix_max or "-"} tri={tri} {ordre}'
+                        requetes.append((nom, query, params))
+    # Pages suivantes (curseur)
+    for tri in COLONNES_TRI:
+        for ordre in ('asc', 'desc'):
+            query, params, _ = construire_requete_produits(tri=tri, ordre=ordre, apres=(0, 0),
+                                                           limite=TAILLE_PAGE_DEFAUT + 1)
+            requetes.append((f'produits page suivante tri={tri} {ordre}', query, params))
+    # Recherche (plein texte si disponible) combinée aux filtres
+    for categorie in ('', 'Autre'):
+        for tri in ('pertinence', 'nom', 'prix'):
+            query, params, _ = construire_requete_produits('gal', categorie, tri=tri)
+            requetes.append((f'recherche cat={categorie or "-"} tri={tri}', query, params))
+    # Flux de changements : seule la plage de révisions demandée est lue
+    requetes.append(('api/changes', SQL_CHANGEMENTS, [0, TAILLE_PAGE_CHANGEMENTS]))
+    # Ventes sur une fenêtre d'un an (tranches d'heures, de jours et de mois)
+    debut, fin = datetime(2025, 1, 15, 13), datetime(2026, 1, 20, 7)
+    for nom, cible, cle, filtre in (('produit', 'produits', 'produit_id', 1),
+                                    ('catégorie', 'categories', 'categorie', 'Autre')):
+        sous_requete, params = requete_tranches(cible, cle, tranches_fenetre(debut, fin), filtre)
+        requetes.append((f'api/ventes/velocite {nom}', f'SELECT SUM(quantite) FROM ({sous_requete})', params))
+    for niveau in ('heure', 'jour', 'mois'):
+        requetes.append((f'api/ventes/top: classement par {niveau}',
+                         f'SELECT produit_id, quantite FROM ventes_produits_{niveau} WHERE {niveau} = ? '
+                         'ORDER BY quantite DESC LIMIT ?', [debut.strftime(FORMATS_PERIODES[niveau]), 40]))
+    sous_requete, params = requete_tranches('produits', 'produit_id', tranches_fenetre(debut, fin, mois=True),
+                                            parmi={1, 2, 3})
+    requetes.append(('api/ventes/top: totaux des candidats', f'SELECT cle, SUM(quantite) AS quantite '
+                     f'FROM ({sous_requete}) GROUP BY cle ORDER BY quantite DESC LIMIT 20', params))
+    requetes.append(('recalculer-seuils: ventes de la fenêtre',
+                     'SELECT produit_id, CAST(julianday(?) - julianday(jour) AS INTEGER), quantite '
+                     'FROM ventes_produits_jour WHERE jour >= ? AND jour < ?',
+                     ['2025-12-31', '2025-10-02', '2026-01-01']))
+    requetes.append(('api/ventes/serie produit',
+                     'SELECT jour, SUM(quantite) FROM ventes_produits_jour WHERE jour >= ? AND jour < ? '
+                     'AND produit_id = ? GROUP BY jour ORDER BY jour', ['2025-01-01', '2026-01-01', 1]))
+    # File des tâches de fond : réclamation, abandons, tâches périodiques, liste filtrée
+    requetes.append(('taches: réclamation',
+                     "SELECT id FROM taches WHERE statut = 'en_attente' AND executer_apres <= CURRENT_TIMESTAMP "
+                     "ORDER BY executer_apres, id LIMIT 1", []))
+    requetes.append(('taches: abandonnées',
+                     "SELECT 1 FROM taches WHERE statut = 'en_cours' AND vu_le < datetime('now', ?) LIMIT 1",
+                     ['-60 seconds']))
+    requetes.append(('taches: périodiques',
+                     "SELECT 1 FROM taches WHERE type = ? AND cree_le > datetime('now', ?) LIMIT 1",
+                     ['recalculer-seuils', '-86400 seconds']))
+    requetes.append(('api/jobs?type=', 'SELECT * FROM taches WHERE type = ? ORDER BY id DESC LIMIT ?',
+                     ['export', 50]))
+    return requetes
+
+@app.cli.command('verifier-plans')
+def verifier_plans():
+    """Vérifie via EXPLAIN QUERY PLAN que chaque requête des routes utilise un index"""
+    conn = db_pool.acquire()
+    try:
+        echecs = 0
+        for nom, query, params in requetes_des_routes():
+            plan = [ligne[3] for ligne in conn.execute('EXPLAIN QUERY PLAN ' + query, params)]
+            # "SCAN <table>" sans USING INDEX = parcours complet d'une table
+            # (les sous-requêtes matérialisées et tables virtuelles FTS ne comptent pas)
+            parcours_complet = [etape for etape in plan
+                                if etape.startswith('SCAN ') and 'INDEX' not in etape
+                                and etape.split()[1] in ('produits', 'p', 'categories', 'mouvements_stock', 'm',
+                                                            'registre_stock', 'ventes_produits_heure',
+                                                            'ventes_produits_jour', 'ventes_produits_mois',
+                                                            'taches')]
+            if parcours_complet:
+                echecs += 1
+                print(f"❌ {nom}: {' | '.join(plan)}")
+            else:
+                print(f"✅ {nom}: {' | '.join(plan)}")
+    finally:
+        db_pool.release(conn)
+    
+    if echecs:
+        print(f"❌ {echecs} requête(s) sans index")
+        raise SystemExit(1)
+    print("✅ Toutes les requêtes des routes utilisent un index")
+
+@app.cli.command('verifier-stats')
+@click.option('--reparer', is_flag=True, help='Reconstruire stats_categories en cas d\'écart')
+def verifier_stats(reparer):
+    """Compare les statistiques matérialisées à un recalcul complet depuis produits"""
+    conn = db_pool.acquire()
+    try:
+        ecarts = verifier_stats_stock(conn)
+        for ecart in ecarts:
+            print(f"❌ {ecart['categorie'] or '(sans catégorie)'} {ecart['colonne']}: "
+                  f"attendu {ecart['attendu']}, stocké {ecart['stocke']}")
+        if ecarts and reparer:
+            recalculer_stats_stock(conn)
+            print("✅ Statistiques reconstruites")
+            return
+    finally:
+        db_pool.release(conn)
+    
+    if ecarts:
+        print(f"❌ {len(ecarts)} écart(s) (relancer avec --reparer pour reconstruire)")
+        raise SystemExit(1)
+    print("✅ Statistiques matérialisées cohérentes")
+
+@app.cli.command('compacter-changements')
+@click.option('--jours', type=int, default=JOURS_HISTORIQUE_CHANGEMENTS, show_default=True,
+              help="Historique conservé, en jours")
+def compacter_changements_cli(jours):
+    """Supprime l'historique ancien du flux /api/changes"""
+    conn = db_pool.acquire()
+    try:
+        supprimees = compacter_changements(conn, jours)
+        print(f"✅ {supprimees} changement(s) de plus de {jours} jours supprimé(s), "
+              f"révision compactée : {revision_compactee(conn)}")
+        cles = purger_cles_idempotence(conn)
+        print(f"✅ {cles} clé(s) d'idempotence de plus de {JOURS_CLES_IDEMPOTENCE} jours supprimée(s)")
+    finally:
+        db_pool.release(conn)
+
+@app.cli.command('instantane-stock')
+@click.option('--garder-jours', type=int, default=JOURS_INSTANTANES_STOCK,
+              help="Instantanés conservés, en jours (défaut : tous)")
+def instantane_stock_cli(garder_jours):
+    """Prend un instantané du stock (borne le coût de /api/stock-a-date)"""
+    conn = db_pool.acquire()
+    try:
+        instantane_id, supprimes = prendre_instantane(conn, garder_jours)
+        jusqua = conn.execute('SELECT jusqua FROM instantanes_stock WHERE id = ?', (instantane_id,)).fetchone()[0]
+        print(f"✅ Instantané {instantane_id} pris (registre jusqu'au mouvement {jusqua})")
+        if garder_jours is not None:
+            print(f"✅ {supprimes} instantané(s) de plus de {garder_jours} jours supprimé(s)")
+    finally:
+        db_pool.release(conn)
+
+@app.cli.command('recalculer-ventes')
+def recalculer_ventes_cli():
+    """Reconstruit les cumuls des ventes depuis le registre des mouvements"""
+    conn = db_pool.acquire()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            recalculer_ventes(conn)
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+        print(f"✅ Cumuls des ventes reconstruits ({', '.join(table for table, *_ in ROLLUPS_VENTES)})")
+    finally:
+        db_pool.release(conn)
+
+@app.cli.command('recalculer-seuils')
+@click.option('--jours', type=int, default=JOURS_HISTORIQUE_SEUILS, show_default=True,
+              help="Historique de ventes pris en compte, en jours")
+@click.option('--lissage', type=float, default=LISSAGE_DEMANDE, show_default=True,
+              help="Coefficient de lissage exponentiel de la demande (0 à 1)")
+@click.option('--delai', type=float, default=DELAI_REAPPRO_JOURS, show_default=True,
+              help="Délai de réapprovisionnement, en jours")
+@click.option('--service', type=float, default=TAUX_SERVICE, show_default=True,
+              help="Taux de service visé (stock de sécurité)")
+@click.option('--jours-vente-min', type=int, default=JOURS_VENTE_MIN_SEUIL, show_default=True,
+              help="Jours avec vente requis sur la fenêtre (sinon le seuil actuel est gardé)")
+def recalculer_seuils_cli(jours, lissage, delai, service, jours_vente_min):
+    """Recalcule les seuils de réapprovisionnement (stock faible) depuis l'historique des ventes"""
+    conn = db_pool.acquire()
+    try:
+        try:
+            rapport = recalculer_seuils(conn, jours, lissage, delai, service, jours_vente_min)
+        except ValueError as e:
+            raise click.BadParameter(str(e))
+        if rapport['calcul'] is None:
+            print("⚠️ Aucune vente enregistrée : seuils inchangés")
+            return
+        print(f"✅ {rapport['vendus']} produit(s) vendu(s) sur la fenêtre, {rapport['calcules']} avec assez "
+              f"d'historique, {rapport['modifies']} seuil(s) modifié(s) "
+              f"(calcul {rapport['calcul']} : lecture {rapport['lecture']} s, calcul {rapport['duree_calcul']} s, "
+              f"écriture {rapport['ecriture']} s dont {rapport['verrou']} s sous verrou)")
+    finally:
+        db_pool.release(conn)
+
+@app.cli.command('taches')
+@click.option('--threads', type=int, default=THREADS_TACHES, show_default=True,
+              help="Tâches exécutées en parallèle")
+def taches_cli(threads):
+    """Exécute les tâches de fond (file partagée : plusieurs processus peuvent tourner)"""
+    if threads < 1:
+        raise click.BadParameter('au moins 1 thread', param_hint='--threads')
+    pool = pool_taches
+    pool.threads = threads
+    arret = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: arret.set())
+    pool.demarrer()
+    print(f"🧵 {threads} thread(s) de tâches de fond, base {DB_PATH}")
+    try:
+        while not arret.wait(1.0):
+            pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.arreter()
+        print(f"✅ Pool arrêté ({pool.executees} tâche(s) exécutée(s))")
+
+@app.cli.command('importer')
+@click.argument('chemin', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), default=None,
+              help="Format du fichier (déduit de l'extension par défaut)")
+def importer(chemin, fmt):
+    """Importe un catalogue CSV/NDJSON (upsert sur le code-barres)"""
+    fmt = format_import(chemin, '', fmt)
+    conn = db_pool.acquire()
+    try:
+        with open(chemin, encoding='utf-8-sig', newline='') as fichier:
+            lignes = lire_lignes_ndjson(fichier) if fmt == 'ndjson' else lire_lignes_csv(fichier)
+            debut = datetime.now()
+            rapport = importer_produits(conn, lignes)
+            duree = (datetime.now() - debut).total_seconds()
+    finally:
+        db_pool.release(conn)
+    
+    debit = rapport['lignes'] / duree if duree else 0
+    print(f"✅ {rapport['importees']}/{rapport['lignes']} lignes importées en {duree:.2f}s ({debit:.0f} lignes/s)")
+    for err in rapport['erreurs']:
+        print(f"❌ Ligne {err['ligne']}: {err['message']}")
+    if rapport['nb_erreurs'] > len(rapport['erreurs']):
+        print(f"… {rapport['nb_erreurs'] - len(rapport['erreurs'])} autres erreurs")
+
+# Mode ASGI (optionnel) : gunicorn -k uvicorn.workers.UvicornWorker app:asgi_app
+THREADS_ASGI = int(os.environ.get('BOUTIQUE_ASGI_THREADS', '32'))
+
+class ApplicationAsgi:
+    """Point d'entrée ASGI servant les mêmes routes que l'application WSGI
+    
+    Les attentes longues (/api/changes?wait=, /api/changes/stream) sont servies en asynchrone
+    natif, sans thread ni connexion SQLite pendant l'attente. Toutes les autres requêtes
+    passent par l'application Flask dans un pool de threads borné : les accès SQLite restent
+    synchrones, mais hors de la boucle d'événements.
+    """
+
+    def __init__(self, wsgi_app, threads=THREADS_ASGI):
+        self.wsgi_app = wsgi_app
+        self.threads = threads
+        self._executeur = None
+        self._pid = None
+
+    @property
+    def executeur(self):
+        # Pool créé dans le worker (après le fork), jamais hérité du processus maître
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._executeur = ThreadPoolExecutor(self.threads, thread_name_prefix='boutique-asgi')
+            db_pool.max_idle = max(db_pool.max_idle, self.threads)
+        return self._executeur
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._cycle_de_vie(receive, send)
+        elif scope['type'] == 'http':
+            if scope['path'] == '/api/changes/stream':
+                await self._flux_changements(scope, receive, send)
+            elif scope['path'] == '/api/changes':
+                await self._attendre_changements(scope, receive, send)
+            else:
+                await self._wsgi(scope, receive, send)
+
+    async def _cycle_de_vie(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.executeur
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self._executeur is not None:
+                    self._executeur.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _executer(self, fonction, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executeur, fonction, *args)
+
+    async def _wsgi(self, scope, receive, send, query_string=None):
+        """Requête transmise à l'application Flask, exécutée dans le pool de threads"""
+        corps = bytearray()
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            corps += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+        environ = environ_wsgi(scope, bytes(corps), query_string)
+        boucle = asyncio.get_running_loop()
+        
+        def envoyer(message):
+            asyncio.run_coroutine_threadsafe(send(message), boucle).result()
+        
+        def executer():
+            # Toute la réponse est produite dans le même thread : les générateurs
+            # stream_with_context (exports) gardent ainsi leur contexte de requête
+            entete = {}
+            def start_response(status, headers, exc_info=None):
+                entete['status'] = int(status.split(' ', 1)[0])
+                entete['headers'] = [(nom.lower().encode('latin-1'), valeur.encode('latin-1'))
+                                     for nom, valeur in headers]
+            iterable = self.wsgi_app(environ, start_response)
+            debut = {'type': 'http.response.start', 'status': entete['status'], 'headers': entete['headers']}
+            try:
+                # Taille connue : réponse déjà en mémoire (cas courant), rendue d'un bloc à la boucle
+                if any(nom == b'content-length' for nom, _ in entete['headers']):
+                    return [debut, {'type': 'http.response.body', 'body': b''.join(iterable)}]
+                envoyer(debut)
+                for morceau in iterable:
+                    if morceau:
+                        envoyer({'type': 'http.response.body', 'body': morceau, 'more_body': True})
+                envoyer({'type': 'http.response.body', 'body': b''})
+            finally:
+                if hasattr(iterable, 'close'):
+                    iterable.close()
+            return []
+        
+        for message in await self._executer(executer):
+            await send(message)
+
+    async def _attendre_changements(self, scope, receive, send):
+        """Long-polling sans thread : attente sur le diffuseur, puis réponse par l'app Flask sans attente"""
+        params = parse_qs(scope['query_string'].decode('latin-1'), keep_blank_values=True)
+        try:
+            depuis = max(int(params.get('since', ['0'])[0]), 0)
+            attente = min(max(float(params.get('wait', ['0'])[0]), 0), ATTENTE_MAX_CHANGEMENTS)
+        except ValueError:
+            attente = 0  # l'app Flask renvoie l'erreur 400
+        if attente:
+            await diffuseur_changements.evenements_async(depuis, attente)
+            params['wait'] = ['0']
+        await self._wsgi(scope, receive, send, urlencode(params, doseq=True))
+
+    async def _flux_changements(self, scope, receive, send):
+        """Flux Server-Sent Events natif : une coroutine par client, aucun thread tenu"""
+        entetes = dict(scope['headers'])
+        demande = entetes.get(b'last-event-id', b'').decode('latin-1') or \
+            parse_qs(scope['query_string'].decode('latin-1')).get('since', [''])[0]
+        try:
+            depuis = int(demande) if demande else None
+        except ValueError:
+            await self._wsgi(scope, receive, send)  # réponse 400 de l'app Flask
+            return
+        
+        deconnexion = asyncio.ensure_future(attendre_deconnexion(receive))
+        diffuseur_changements.compter_abonne(1)
+        try:
+            if depuis is None:
+                depuis = await self._executer(diffuseur_changements.revision)
+            await send({'type': 'http.response.start', 'status': 200, 'headers': [
+                (b'content-type', b'text/event-stream; charset=utf-8'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ]})
+            await envoyer_sse(send, 'retry: 3000\n\n')
+            while not deconnexion.done():
+                attente = asyncio.ensure_future(diffuseur_changements.evenements_async(depuis, INTERVALLE_PING_SSE))
+                await asyncio.wait({attente, deconnexion}, return_when=asyncio.FIRST_COMPLETED)
+                if deconnexion.done():
+                    attente.cancel()
+                    return
+                evenements = attente.result()
+                if evenements is None:
+                    # Client en retard sur le tampon : rattrapage direct en base
+                    evenements = await self._executer(evenements_en_base, depuis)
+                    if evenements is None:
+                        await envoyer_sse(send, 'event: resync\ndata: {}\n\n', fin=True)
+                        return
+                if not evenements:
+                    await envoyer_sse(send, ': ping\n\n')
+                    continue
+                await envoyer_sse(send, ''.join(trame_sse(evenement) for evenement in evenements))
+                depuis = evenements[-1]['rev']
+        finally:
+            diffuseur_changements.compter_abonne(-1)
+            deconnexion.cancel()
+
+def environ_wsgi(scope, corps, query_string=None):
+    """Environnement WSGI (PEP 3333) d'une requête HTTP ASGI"""
+    serveur = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': query_string if query_string is not None else scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': serveur[0],
+        'SERVER_PORT': str(serveur[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(corps),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for nom, valeur in scope['headers']:
+        nom = nom.decode('latin-1').upper().replace('-', '_')
+        valeur = valeur.decode('latin-1')
+        if nom in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            environ[nom] = valeur
+        else:
+            cle = f'HTTP_{nom}'
+            environ[cle] = f'{environ[cle]},{valeur}' if cle in environ else valeur
+    return environ
+
+async def attendre_deconnexion(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+async def envoyer_sse(send, texte, fin=False):
+    await send({'type': 'http.response.body', 'body': texte.encode('utf-8'), 'more_body': not fin})
+
+asgi_app = ApplicationAsgi(app)
+
 if __name__ == '__main__':
     print("🚀 BOUTIQUE MOBILE - VERSION MINIMALE")
     print("=" * 50)
     
     # Initialisation de la base de données
     try:
-        init_database()
-        print("✅ Base de données SQLite initialisée")
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT COUNT(*) FROM produits')
-        count = cursor.fetchone()[0]
-        conn.close()
+        with app.app_context():
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            cursor.execute('SELECT COUNT(*) FROM produits')
+            count = cursor.fetchone()[0]
         
         print(f"📦 {count} produits en base")
         
@@ -1093,5 +4812,10 @@ if __name__ == '__main__':
     print("   ✅ Interface responsive")
     print("   ✅ Base de données persistante")
     
+    # Tâches de fond dans le processus servi (pas dans le processus de surveillance du reloader)
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true' and TACHES_ACTIVEES and THREADS_TACHES > 0:
+        pool_taches.threads = THREADS_TACHES
+        pool_taches.demarrer()
+    
     # Lancement
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,13 @@
+"""Banc d'essai de la boutique : catalogues synthétiques, scénarios de charge, comparaison
+
+Usage (depuis la racine du dépôt) :
+
+    python -m benchmark generer --produits 100000 --base /tmp/bench.db
+    python -m benchmark lancer --base /tmp/bench.db --sortie avant.json
+    python -m benchmark lancer --base /tmp/bench.db --pilote http --mode asgi \\
+        --concurrence 20 --attentes 300 --sortie asgi.json
+    python -m benchmark comparer avant.json apres.json --seuil 10
+
+Les scénarios passent par la vraie application Flask : client de test en processus
+(pilote "client") ou gunicorn local lancé pour l'occasion (pilote "http").
+"""
@@ -0,0 +1,207 @@
+"""Ligne de commande du banc d'essai : python -m benchmark --help"""
+
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+import click
+
+from .catalogue import DISTRIBUTIONS_STOCK, FORMATS_CODES, generer_catalogue, generer_ventes, supprimer_base
+from .comparaison import avertissements_contexte, comparer
+from .pilotes import RACINE, PiloteClient, PiloteHttp, charger_app
+from .scenarios import SCENARIOS, Contexte, lancer_scenario, selectionner
+
+
+@click.group()
+def cli():
+    """Banc d'essai de la boutique"""
+
+
+@cli.command()
+@click.option('--base', required=True, type=click.Path(dir_okay=False), help='Fichier SQLite à créer')
+@click.option('--produits', default=10000, show_default=True)
+@click.option('--categories', default=20, show_default=True)
+@click.option('--formats', default=','.join(FORMATS_CODES), show_default=True,
+              help='Formats de codes-barres, séparés par des virgules')
+@click.option('--stock', 'distribution', type=click.Choice(DISTRIBUTIONS_STOCK), default='longue-traine',
+              show_default=True)
+@click.option('--graine', default=42, show_default=True)
+@click.option('--ventes-jours', default=0, show_default=True, help='Jours d\'historique de ventes à générer')
+@click.option('--ventes-par-jour', default=2000, show_default=True)
+@click.option('--ecraser', is_flag=True, help='Remplacer la base si elle existe')
+def generer(base, produits, categories, formats, distribution, graine, ventes_jours, ventes_par_jour, ecraser):
+    """Génère un catalogue synthétique reproductible"""
+    formats = [f.strip() for f in formats.split(',') if f.strip()]
+    inconnus = set(formats) - set(FORMATS_CODES)
+    if inconnus:
+        raise click.BadParameter(f"formats inconnus : {', '.join(sorted(inconnus))}", param_hint='--formats')
+    if os.path.exists(base):
+        if not ecraser:
+            raise click.ClickException(f'{base} existe déjà (--ecraser pour le remplacer)')
+        supprimer_base(base)
+
+    app_module = charger_app(base)
+    print(f"🏭 Génération de {produits} produits dans {base}...")
+    rapport = generer_catalogue(app_module, produits, categories, formats, distribution, graine)
+    print(f"✅ {rapport['importees']} produits importés en {rapport['duree']}s "
+          f"({rapport['erreurs']} erreur(s))")
+    if ventes_jours:
+        print(f"🛒 Génération de {ventes_jours} jours de ventes ({ventes_par_jour}/jour)...")
+        rapport = generer_ventes(app_module, ventes_jours, ventes_par_jour, graine)
+        print(f"✅ {rapport['lignes']} ventes inscrites au registre en {rapport['duree']}s")
+
+
+def demarrer_attentes(pilote, nombre):
+    """nombre clients en long-polling sur /api/changes, relancés jusqu'à l'arrêt"""
+    arret = threading.Event()
+
+    def client():
+        conn = pilote.connexion(timeout=60)
+        while not arret.is_set():
+            try:
+                conn.request('GET', '/api/changes?since=1000000000000&wait=30')
+                conn.getresponse().read()
+            except OSError:
+                conn.close()
+                conn = pilote.connexion(timeout=60)
+                time.sleep(0.5)
+        conn.close()
+
+    for _ in range(nombre):
+        threading.Thread(target=client, daemon=True).start()
+    return arret
+
+
+def meta_execution(pilote, chemin_base, options):
+    conn = sqlite3.connect(chemin_base)
+    try:
+        nb_produits = conn.execute('SELECT COUNT(*) FROM produits').fetchone()[0]
+        parametre = conn.execute("SELECT valeur FROM parametres WHERE cle = 'benchmark_catalogue'").fetchone()
+    finally:
+        conn.close()
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RACINE,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'plateforme': platform.platform(),
+        'cpus': os.cpu_count(),
+        'base': os.path.abspath(chemin_base),
+        'produits': nb_produits,
+        'catalogue': json.loads(parametre[0]) if parametre else None,
+        **pilote.description(),
+        **options,
+    }
+
+
+@cli.command()
+@click.option('--base', required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--pilote', 'nom_pilote', type=click.Choice(['client', 'http']), default='client', show_default=True)
+@click.option('--mode', type=click.Choice(['wsgi', 'asgi', 'gevent']), default='wsgi', show_default=True,
+              help='Mode du gunicorn lancé (pilote http)')
+@click.option('--workers', default=2, show_default=True, help='Workers gunicorn (pilote http)')
+@click.option('--url', help='Serveur déjà lancé à mesurer (pilote http), au lieu d\'un gunicorn local')
+@click.option('--requetes', default=200, show_default=True, help='Requêtes par scénario')
+@click.option('--concurrence', default=1, show_default=True, help='Clients simultanés')
+@click.option('--echauffement', default=5, show_default=True, help='Requêtes non mesurées par scénario')
+@click.option('--attentes', default=0, show_default=True,
+              help='Clients en long-polling inactifs pendant la mesure (pilote http)')
+@click.option('--flux', default=100, show_default=True, help='Flux SSE ouverts (scénario sse-diffusion)')
+@click.option('--lignes-import', default=20000, show_default=True, help='Lignes réimportées (scénario import)')
+@click.option('--scenarios', 'noms', help='Scénarios à lancer, séparés par des virgules (défaut : tous)')
+@click.option('--exclure', default='', help='Scénarios à ignorer, séparés par des virgules')
+@click.option('--sortie', type=click.Path(dir_okay=False), help='Fichier JSON des résultats')
+def lancer(base, nom_pilote, mode, workers, url, requetes, concurrence, echauffement, attentes, flux,
+           lignes_import, noms, exclure, sortie):
+    """Lance les scénarios et écrit débits et percentiles de latence en JSON"""
+    try:
+        choisis = selectionner(nom_pilote, [n for n in (noms or '').split(',') if n],
+                               [n for n in exclure.split(',') if n])
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--scenarios')
+    if attentes and nom_pilote != 'http':
+        raise click.BadParameter('réservé au pilote http', param_hint='--attentes')
+
+    options = {'requetes': requetes, 'concurrence': concurrence, 'echauffement': echauffement,
+               'attentes': attentes, 'flux': flux, 'lignes_import': lignes_import}
+    # Mode wsgi : un thread par flux ou attente ouverte, en plus des clients mesurés (pire cas :
+    # toutes les connexions sur le même worker)
+    threads = 32 + flux + attentes + concurrence
+    pilote = PiloteHttp(base, mode, workers, url, threads) if nom_pilote == 'http' else PiloteClient(base)
+    arret_attentes = None
+    try:
+        resultats = {'meta': meta_execution(pilote, base, options), 'scenarios': {}}
+        ctx = Contexte(pilote, base, options)
+        if attentes:
+            arret_attentes = demarrer_attentes(pilote, attentes)
+            time.sleep(1)
+        print(f"🚀 {len(choisis)} scénario(s), pilote {nom_pilote}, {ctx.nb_produits} produits")
+        for nom in choisis:
+            resume = lancer_scenario(ctx, nom)
+            resultats['scenarios'][nom] = resume
+            latence = resume['latence_ms']
+            etat = '✅' if not resume['erreurs'] else f"❌ {resume['erreurs']} erreur(s)"
+            print(f"{etat} {nom:32} {resume['debit']:>10.1f}/s  p50 {latence['p50']:>9.2f} ms  "
+                  f"p95 {latence['p95']:>9.2f} ms  p99 {latence['p99']:>9.2f} ms")
+    finally:
+        if arret_attentes is not None:
+            arret_attentes.set()
+        pilote.fermer()
+
+    if sortie:
+        with open(sortie, 'w', encoding='utf-8') as f:
+            json.dump(resultats, f, ensure_ascii=False, indent=2)
+        print(f"💾 Résultats écrits dans {sortie}")
+
+
+@cli.command('comparer')
+@click.argument('base', type=click.File(encoding='utf-8'))
+@click.argument('nouveau', type=click.File(encoding='utf-8'))
+@click.option('--seuil', default=10.0, show_default=True, help='Variation tolérée, en %')
+@click.option('--tout', is_flag=True, help='Afficher aussi les indicateurs sans régression')
+def commande_comparer(base, nouveau, seuil, tout):
+    """Compare deux résultats ; code de sortie 1 en cas de régression"""
+    base, nouveau = json.load(base), json.load(nouveau)
+    for message in avertissements_contexte(base, nouveau):
+        print(f"⚠️ Contexte différent : {message}")
+
+    lignes = comparer(base, nouveau, seuil)
+    regressions = [ligne for ligne in lignes if ligne['regression']]
+    for ligne in lignes:
+        if not (tout or ligne['regression']):
+            continue
+        etat = '❌' if ligne['regression'] else '✅'
+        variation = f"{ligne['variation']:+.1f}%" if ligne['variation'] is not None else ''
+        print(f"{etat} {ligne['scenario']:32} {ligne['indicateur']:14} "
+              f"{ligne['avant']:>10} → {ligne['apres']:<10} {variation}")
+
+    if regressions:
+        print(f"❌ {len(regressions)} régression(s) au-delà de {seuil}%")
+        sys.exit(1)
+    print(f"✅ Aucune régression au-delà de {seuil}% ({len(lignes)} indicateurs comparés)")
+
+
+@cli.command('scenarios')
+def lister_scenarios():
+    """Liste les scénarios disponibles"""
+    for nom, definition in SCENARIOS.items():
+        details = []
+        if definition['pilotes'] != ('client', 'http'):
+            details.append(f"pilote {'/'.join(definition['pilotes'])}")
+        if definition['mutation']:
+            details.append('écrit en base')
+        print(f"{nom:32} {', '.join(details)}")
+
+
+cli(prog_name='python -m benchmark')
@@ -0,0 +1,142 @@
+"""Génération de catalogues synthétiques, directement dans un fichier SQLite"""
+
+import json
+import os
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+FORMATS_CODES = ('ean13', 'code128', 'interne')
+DISTRIBUTIONS_STOCK = ('uniforme', 'longue-traine', 'ruptures')
+
+TYPES = ('Câble', 'Chargeur', 'Coque', 'Écouteurs', 'Batterie', 'Support', 'Adaptateur',
+         'Clavier', 'Souris', 'Enceinte', 'Montre', 'Tablette', 'Smartphone', 'Casque')
+MARQUES = ('Galaxy', 'Nova', 'Orion', 'Pixel', 'Lumina', 'Vega', 'Atlas', 'Zenith', 'Kappa', 'Sirius')
+QUALIFICATIFS = ('USB-C', 'sans fil', 'rapide', 'mini', 'pro', 'renforcé', 'magnétique', 'noir',
+                 'blanc', '20W', '65W', '2m', 'étanche', 'bluetooth')
+EMOJIS = ('📱', '💻', '🎧', '🔌', '🔋', '⌚', '🖱️', '⌨️', '🔊', '📦')
+
+
+def cle_ean13(chiffres):
+    """Chiffre de contrôle EAN-13 des 12 premiers chiffres"""
+    somme = sum(int(c) * (3 if i % 2 else 1) for i, c in enumerate(chiffres))
+    return str((10 - somme % 10) % 10)
+
+
+def generer_code(format_code, numero, alea):
+    """Code-barres unique (par numéro) dans le format demandé"""
+    if format_code == 'ean13':
+        chiffres = f'20{numero:010d}'  # préfixe 20 : codes à usage interne
+        return chiffres + cle_ean13(chiffres)
+    if format_code == 'code128':
+        return f'{alea.choice(MARQUES)[:3].upper()}-{numero:07d}'
+    return f'P{numero:06d}'
+
+
+def generer_stock(distribution, alea):
+    if distribution == 'uniforme':
+        return alea.randint(0, 100)
+    if distribution == 'longue-traine':
+        # Beaucoup de petits stocks, quelques références très fournies
+        return min(int(alea.paretovariate(1.2)) - 1, 500)
+    # 'ruptures' : 30 % de ruptures, le reste en stock faible ou moyen
+    return 0 if alea.random() < 0.3 else alea.randint(1, 50)
+
+
+def noms_categories(nb_categories):
+    return [f'{TYPES[i]} & accessoires' if i < len(TYPES) else f'Rayon {i + 1}'
+            for i in range(nb_categories)]
+
+
+def lignes_catalogue(nb_produits, categories, formats, distribution, alea):
+    """(numéro, données) au format de l'import, avec une popularité de catégorie non uniforme"""
+    poids = [1 / (rang + 1) for rang in range(len(categories))]
+    for numero in range(1, nb_produits + 1):
+        nom = f'{alea.choice(TYPES)} {alea.choice(MARQUES)} {alea.choice(QUALIFICATIFS)} {numero}'
+        yield numero, {
+            'nom': nom,
+            'code_barres': generer_code(formats[numero % len(formats)], numero, alea),
+            'prix': f'{min(max(alea.lognormvariate(3, 1), 0.5), 2000):.2f}',
+            'stock': str(generer_stock(distribution, alea)),
+            'categorie': alea.choices(categories, poids)[0],
+        }
+
+
+def supprimer_base(chemin):
+    for suffixe in ('', '-wal', '-shm'):
+        if os.path.exists(chemin + suffixe):
+            os.remove(chemin + suffixe)
+
+
+def generer_catalogue(app_module, nb_produits=10000, nb_categories=20, formats=FORMATS_CODES,
+                      distribution='longue-traine', graine=42):
+    """Remplit la base de l'application (schéma et tables dérivées tenus par l'import en masse)"""
+    alea = random.Random(graine)
+    categories = noms_categories(nb_categories)
+    conn = app_module.db_pool.acquire()
+    try:
+        with conn:
+            conn.executemany(
+                'INSERT OR IGNORE INTO categories (nom, emoji, description) VALUES (?, ?, ?)',
+                [(nom, EMOJIS[i % len(EMOJIS)], 'Catégorie générée pour le banc d\'essai')
+                 for i, nom in enumerate(categories)])
+
+        debut = time.perf_counter()
+        rapport = app_module.importer_produits(
+            conn, lignes_catalogue(nb_produits, categories, list(formats), distribution, alea))
+        duree = time.perf_counter() - debut
+
+        description = {
+            'produits': nb_produits,
+            'categories': nb_categories,
+            'formats': list(formats),
+            'distribution': distribution,
+            'graine': graine,
+        }
+        app_module.ecrire_parametre(conn, 'benchmark_catalogue', json.dumps(description))
+        return {**description, 'importees': rapport['importees'], 'erreurs': rapport['nb_erreurs'],
+                'duree': round(duree, 2)}
+    finally:
+        app_module.db_pool.release(conn)
+
+
+def generer_ventes(app_module, jours=365, ventes_par_jour=2000, graine=42):
+    """Historique de ventes (sorties du registre) sur les jours écoulés, popularité en loi de Zipf
+
+    Les lignes passent par le trigger du registre : les cumuls des ventes sont tenus comme en
+    production. Un instantané final rend /api/stock-a-date cohérent malgré les dates passées.
+    """
+    alea = random.Random(graine)
+    conn = app_module.db_pool.acquire()
+    try:
+        ids = [ligne[0] for ligne in conn.execute('SELECT id FROM produits')]
+        alea.shuffle(ids)
+        cumul, poids = [], 0.0
+        for rang in range(len(ids)):
+            poids += 1 / (rang + 1)
+            cumul.append(poids)
+
+        debut = time.perf_counter()
+        aujourdhui = datetime.now(timezone.utc).replace(tzinfo=None, hour=0, minute=0, second=0, microsecond=0)
+        for jour in range(jours, 0, -1):
+            origine = aujourdhui - timedelta(days=jour)
+            # Heures d'ouverture, dans l'ordre chronologique (comme le registre en production)
+            secondes = sorted(alea.randint(8 * 3600, 20 * 3600 - 1) for _ in range(ventes_par_jour))
+            produits = alea.choices(ids, cum_weights=cumul, k=ventes_par_jour)
+            with conn:
+                conn.executemany(
+                    'INSERT INTO registre_stock (produit_id, delta, stock_apres, motif, source, date) '
+                    "VALUES (?, ?, 0, 'sortie', 'benchmark', ?)",
+                    [(produit_id, -alea.choice((1, 1, 1, 2, 3)),
+                      (origine + timedelta(seconds=seconde)).strftime('%Y-%m-%d %H:%M:%S'))
+                     for produit_id, seconde in zip(produits, secondes)])
+        duree = time.perf_counter() - debut
+        app_module.prendre_instantane(conn)
+
+        parametre = conn.execute("SELECT valeur FROM parametres WHERE cle = 'benchmark_catalogue'").fetchone()
+        description = json.loads(parametre[0]) if parametre else {}
+        description['ventes'] = {'jours': jours, 'par_jour': ventes_par_jour}
+        app_module.ecrire_parametre(conn, 'benchmark_catalogue', json.dumps(description))
+        return {'lignes': jours * ventes_par_jour, 'duree': round(duree, 2)}
+    finally:
+        app_module.db_pool.release(conn)
@@ -0,0 +1,63 @@
+"""Comparaison de deux résultats : régressions de débit et de latence au-delà d'un seuil"""
+
+# (chemin dans le résumé, sens) : +1 si une hausse est une amélioration, -1 si c'est une régression
+INDICATEURS = (
+    (('debit',), +1),
+    (('latence_ms', 'p50'), -1),
+    (('latence_ms', 'p95'), -1),
+    (('latence_ms', 'p99'), -1),
+    # amplification-ecriture : pages du WAL par mouvement de stock
+    (('pages_par_mouvement',), -1),
+    (('pages_par_mouvement_lot',), -1),
+    (('pages_par_vente',), -1),
+)
+
+# En dessous, les écarts de latence relèvent du bruit de mesure
+LATENCE_MIN_MS = 0.2
+
+
+def valeur(resume, chemin):
+    for cle in chemin:
+        if not isinstance(resume, dict) or cle not in resume:
+            return None
+        resume = resume[cle]
+    return resume
+
+
+def comparer(base, nouveau, seuil=10.0):
+    """Lignes de comparaison par scénario commun ; chaque ligne indique si elle est une régression"""
+    lignes = []
+    for nom, resume_nouveau in nouveau['scenarios'].items():
+        resume_base = base['scenarios'].get(nom)
+        if resume_base is None:
+            continue
+        for chemin, sens in INDICATEURS:
+            avant, apres = valeur(resume_base, chemin), valeur(resume_nouveau, chemin)
+            if not avant or apres is None:
+                continue
+            variation = (apres - avant) / avant * 100
+            bruit = chemin[0] == 'latence_ms' and max(avant, apres) < LATENCE_MIN_MS
+            lignes.append({
+                'scenario': nom,
+                'indicateur': '.'.join(chemin),
+                'avant': avant,
+                'apres': apres,
+                'variation': round(variation, 1),
+                'regression': not bruit and variation * sens < -seuil,
+            })
+        # Erreurs apparues (ou cohérence perdue) : toujours une régression
+        if resume_nouveau.get('erreurs', 0) > resume_base.get('erreurs', 0) or \
+                resume_base.get('coherent') and not resume_nouveau.get('coherent', True):
+            lignes.append({'scenario': nom, 'indicateur': 'erreurs', 'avant': resume_base.get('erreurs', 0),
+                           'apres': resume_nouveau.get('erreurs', 0), 'variation': None, 'regression': True})
+    return lignes
+
+
+def avertissements_contexte(base, nouveau):
+    """Différences d'environnement qui rendent la comparaison douteuse"""
+    messages = []
+    for cle in ('pilote', 'mode', 'workers', 'threads', 'concurrence', 'produits'):
+        avant, apres = base['meta'].get(cle), nouveau['meta'].get(cle)
+        if avant != apres:
+            messages.append(f'{cle} : {avant} → {apres}')
+    return messages
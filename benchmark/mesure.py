@@ -0,0 +1,79 @@
+"""Exécution concurrente des requêtes d'un scénario et résumé des latences"""
+
+import threading
+import time
+
+QUANTILES = (50, 90, 95, 99)
+
+
+def percentile(valeurs_triees, p):
+    """Percentile p (0-100) par interpolation linéaire, sur des valeurs déjà triées"""
+    if not valeurs_triees:
+        return 0.0
+    rang = (len(valeurs_triees) - 1) * p / 100
+    bas = int(rang)
+    haut = min(bas + 1, len(valeurs_triees) - 1)
+    return valeurs_triees[bas] + (valeurs_triees[haut] - valeurs_triees[bas]) * (rang - bas)
+
+
+def resumer(latences, erreurs, duree, unites=None):
+    """Débit et percentiles de latence (ms) d'une série de mesures en secondes"""
+    latences = sorted(latences)
+    resume = {
+        'requetes': len(latences),
+        'erreurs': erreurs,
+        'duree': round(duree, 3),
+        # unités traitées par seconde (requêtes, ou lignes / mouvements selon le scénario)
+        'debit': round((unites if unites is not None else len(latences)) / duree, 1) if duree else 0.0,
+        'latence_ms': {f'p{q}': round(percentile(latences, q) * 1000, 3) for q in QUANTILES},
+    }
+    if latences:
+        resume['latence_ms']['moyenne'] = round(sum(latences) / len(latences) * 1000, 3)
+        resume['latence_ms']['max'] = round(latences[-1] * 1000, 3)
+    return resume
+
+
+def executer(requete, nombre, concurrence=1, echauffement=0):
+    """Appelle requete(i) nombre fois réparties sur concurrence threads
+
+    requete renvoie True si la réponse est celle attendue ; une exception compte comme erreur.
+    """
+    for i in range(echauffement):
+        try:
+            requete(-1 - i)
+        except Exception:
+            pass  # compté lors de la mesure
+
+    latences = []
+    erreurs = [0]
+    verrou = threading.Lock()
+    suivant = iter(range(nombre))
+
+    def travailleur():
+        mesures, en_erreur = [], 0
+        while True:
+            with verrou:
+                i = next(suivant, None)
+            if i is None:
+                break
+            debut = time.perf_counter()
+            try:
+                ok = requete(i)
+            except Exception:
+                ok = False
+            mesures.append(time.perf_counter() - debut)
+            en_erreur += not ok
+        with verrou:
+            latences.extend(mesures)
+            erreurs[0] += en_erreur
+
+    debut = time.perf_counter()
+    if concurrence <= 1:
+        travailleur()
+    else:
+        threads = [threading.Thread(target=travailleur) for _ in range(concurrence)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return resumer(latences, erreurs[0], time.perf_counter() - debut)
@@ -0,0 +1,149 @@
+"""Pilotes : l'application Flask en processus (client de test) ou servie par un gunicorn local"""
+
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# entetes : noms en minuscules (uvicorn et gunicorn ne les écrivent pas de la même façon)
+Reponse = namedtuple('Reponse', 'statut corps entetes')
+
+
+def charger_app(chemin_base):
+    """Importe app.py sur la base demandée (choisie une fois pour toutes, à l'import)"""
+    os.environ['BOUTIQUE_DB_PATH'] = chemin_base
+    if RACINE not in sys.path:
+        sys.path.insert(0, RACINE)
+    import app as app_module
+    if os.path.abspath(app_module.DB_PATH) != os.path.abspath(chemin_base):
+        raise RuntimeError(f'app déjà chargée sur {app_module.DB_PATH} : une seule base par processus')
+    return app_module
+
+
+def port_libre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class PiloteClient:
+    """Client de test Flask, un par thread : mesure l'application sans la pile réseau"""
+    nom = 'client'
+
+    def __init__(self, chemin_base):
+        self.app = charger_app(chemin_base)
+        self._local = threading.local()
+
+    def description(self):
+        return {'pilote': self.nom}
+
+    def requete(self, methode, chemin, json=None, entetes=None, donnees=None):
+        if not hasattr(self._local, 'client'):
+            self._local.client = self.app.app.test_client()
+        reponse = self._local.client.open(chemin, method=methode, json=json, data=donnees,
+                                          headers=entetes or {})
+        try:
+            return Reponse(reponse.status_code, reponse.get_data(),
+                           {nom.lower(): valeur for nom, valeur in reponse.headers.items()})
+        finally:
+            reponse.close()
+
+    def fermer(self):
+        pass
+
+
+class PiloteHttp:
+    """gunicorn local (mode wsgi, asgi ou gevent) lancé sur la base, ou serveur existant via url"""
+    nom = 'http'
+
+    def __init__(self, chemin_base, mode='wsgi', workers=2, url=None, threads=None):
+        self.mode = mode
+        self.workers = workers
+        self.threads = threads if mode == 'wsgi' and not url else None
+        self.processus = None
+        self._local = threading.local()
+        if url:
+            hote, _, port = url.split('://', 1)[-1].rstrip('/').partition(':')
+            self.hote, self.port = hote, int(port or 80)
+            self.externe = True
+            return
+
+        self.hote, self.port = '127.0.0.1', port_libre()
+        self.externe = False
+        self.journal = tempfile.NamedTemporaryFile(prefix='benchmark-gunicorn-', suffix='.log', delete=False)
+        env = dict(os.environ, BOUTIQUE_DB_PATH=chemin_base, BOUTIQUE_MODE_SERVEUR=mode)
+        if self.threads:
+            env['BOUTIQUE_WSGI_THREADS'] = str(self.threads)
+        # Processus des tâches de fond lancé par gunicorn.conf.py, comme en production
+        env.setdefault('BOUTIQUE_TACHES', '1')
+        self.processus = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-b', f'{self.hote}:{self.port}', '-w', str(workers),
+             '--log-level', 'warning'],
+            cwd=RACINE, env=env, stdout=self.journal, stderr=subprocess.STDOUT)
+        self._attendre_demarrage()
+
+    def _attendre_demarrage(self, delai=30):
+        echeance = time.monotonic() + delai
+        while time.monotonic() < echeance:
+            if self.processus.poll() is not None:
+                raise RuntimeError(f'gunicorn arrêté au démarrage (journal : {self.journal.name})')
+            try:
+                if self.requete('GET', '/api/db-pool').statut == 200:
+                    return
+            except OSError:
+                self._local.__dict__.clear()
+            time.sleep(0.2)
+        raise RuntimeError(f'gunicorn ne répond pas après {delai}s (journal : {self.journal.name})')
+
+    def description(self):
+        return {'pilote': self.nom, 'mode': self.mode, 'workers': None if self.externe else self.workers,
+                'threads': self.threads,
+                'serveur': f'{self.hote}:{self.port}'}
+
+    def connexion(self, timeout=60):
+        """Nouvelle connexion HTTP vers le serveur (flux SSE, attentes longues)"""
+        return http.client.HTTPConnection(self.hote, self.port, timeout=timeout)
+
+    def requete(self, methode, chemin, json=None, entetes=None, donnees=None):
+        entetes = dict(entetes or {})
+        corps = donnees
+        if json is not None:
+            corps = _json_octets(json)
+            entetes['Content-Type'] = 'application/json'
+        # Connexion persistante par thread ; une reprise si le serveur l'a fermée entre-temps
+        for tentative in range(2):
+            conn = getattr(self._local, 'conn', None)
+            if conn is None:
+                conn = self._local.conn = self.connexion()
+            try:
+                conn.request(methode, chemin, body=corps, headers=entetes)
+                reponse = conn.getresponse()
+                return Reponse(reponse.status, reponse.read(),
+                               {nom.lower(): valeur for nom, valeur in reponse.getheaders()})
+            except (ConnectionError, http.client.HTTPException):
+                conn.close()
+                self._local.conn = None
+                if tentative:
+                    raise
+
+    def fermer(self):
+        if self.processus is not None:
+            self.processus.terminate()
+            try:
+                self.processus.wait(10)
+            except subprocess.TimeoutExpired:
+                self.processus.kill()
+            self.journal.close()
+            os.unlink(self.journal.name)
+
+
+def _json_octets(donnees):
+    return json.dumps(donnees).encode('utf-8')
@@ -0,0 +1,937 @@
+"""Scénarios : les parcours clés de l'application, et quelques mesures dédiées
+
+Un scénario ordinaire prépare ses données puis renvoie requete(i) -> bool (réponse attendue),
+exécutée par mesure.executer. Un scénario dédié (dedie=True) mène sa propre mesure et
+renvoie directement son résumé.
+"""
+
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from urllib.parse import quote
+
+from .catalogue import lignes_catalogue, noms_categories
+from .mesure import executer, resumer
+from .pilotes import RACINE
+
+SCENARIOS = OrderedDict()
+
+TRIS = ('nom', 'prix', 'stock', 'categorie', 'date')
+FILTRES_STOCK = ('out', 'low', 'ok')
+
+
+def scenario(nom, pilotes=('client', 'http'), part=1.0, dedie=False, mutation=False):
+    """Enregistre un scénario ; part : fraction du nombre de requêtes demandé (scénarios lourds)"""
+    def enregistrer(fonction):
+        SCENARIOS[nom] = {'fonction': fonction, 'pilotes': pilotes, 'part': part,
+                          'dedie': dedie, 'mutation': mutation}
+        return fonction
+    return enregistrer
+
+
+class Contexte:
+    """Pilote, base et échantillon de produits partagés par les scénarios d'une exécution"""
+
+    def __init__(self, pilote, chemin_base, options, graine=42):
+        self.pilote = pilote
+        self.chemin_base = chemin_base
+        self.options = options
+        self.alea = random.Random(graine)
+        conn = sqlite3.connect(chemin_base)
+        try:
+            lignes = conn.execute(
+                'SELECT id, code_barres, categorie FROM produits ORDER BY random() LIMIT 2000').fetchall()
+            self.categories = [nom for nom, in conn.execute(
+                'SELECT categorie FROM stats_categories WHERE nb > 0 ORDER BY nb DESC LIMIT 5')]
+            self.nb_produits = conn.execute('SELECT COUNT(*) FROM produits').fetchone()[0]
+            parametre = conn.execute(
+                "SELECT valeur FROM parametres WHERE cle = 'benchmark_catalogue'").fetchone()
+            self.catalogue = json.loads(parametre[0]) if parametre else None
+        finally:
+            conn.close()
+        self.ids = [ligne[0] for ligne in lignes]
+        self.codes = [ligne[1] for ligne in lignes]
+
+    def id_au_hasard(self, i):
+        return self.ids[i % len(self.ids)]
+
+    def code_au_hasard(self, i):
+        return self.codes[(i * 7919) % len(self.codes)]
+
+
+def get(ctx, chemin, statuts=(200,), entetes=None):
+    def requete(i):
+        return ctx.pilote.requete('GET', chemin, entetes=entetes).statut in statuts
+    return requete
+
+
+def post_json(ctx, chemin, construire, succes=True):
+    def requete(i):
+        reponse = ctx.pilote.requete('POST', chemin, json=construire(i))
+        if reponse.statut != 200:
+            return False
+        return not succes or json.loads(reponse.corps).get('success', False)
+    return requete
+
+
+# Pages et filtres de /produits
+
+@scenario('accueil')
+def accueil(ctx):
+    return get(ctx, '/')
+
+
+@scenario('produits')
+def produits(ctx):
+    return get(ctx, '/produits')
+
+
+def scenario_tri(tri, ordre):
+    @scenario(f'produits-tri-{tri}-{ordre}')
+    def produits_tri(ctx):
+        return get(ctx, f'/produits?sort={tri}&order={ordre}')
+
+for _tri in TRIS:
+    for _ordre in ('asc', 'desc'):
+        scenario_tri(_tri, _ordre)
+
+
+def scenario_stock(filtre):
+    @scenario(f'produits-stock-{filtre}')
+    def produits_stock(ctx):
+        return get(ctx, f'/produits?stock={filtre}')
+
+for _filtre in FILTRES_STOCK:
+    scenario_stock(_filtre)
+
+
+@scenario('produits-categorie')
+def produits_categorie(ctx):
+    categorie = ctx.categories[0] if ctx.categories else 'Autre'
+    return get(ctx, f'/produits?cat={quote(categorie)}')
+
+
+@scenario('produits-prix')
+def produits_prix(ctx):
+    return get(ctx, '/produits?prix_min=10&prix_max=100')
+
+
+@scenario('produits-recherche')
+def produits_recherche(ctx):
+    return get(ctx, '/produits?q=gal')
+
+
+@scenario('produits-recherche-filtree')
+def produits_recherche_filtree(ctx):
+    categorie = ctx.categories[0] if ctx.categories else 'Autre'
+    return get(ctx, f'/produits?q=cab&cat={quote(categorie)}&sort=prix')
+
+
+@scenario('produits-page-suivante')
+def produits_page_suivante(ctx):
+    page = json.loads(ctx.pilote.requete('GET', '/api/produits').corps)
+    return get(ctx, f"/produits?after={page['next_cursor']}" if page.get('next_cursor') else '/produits')
+
+
+@scenario('statistiques')
+def statistiques(ctx):
+    return get(ctx, '/statistiques')
+
+
+# Scan
+
+@scenario('scan')
+def scan(ctx):
+    return post_json(ctx, '/scan', lambda i: {'code': ctx.code_au_hasard(i)})
+
+
+@scenario('scan-product')
+def scan_product(ctx):
+    return post_json(ctx, '/api/scan-product', lambda i: {'code_barres': ctx.code_au_hasard(i)})
+
+
+@scenario('scan-product-prefixe')
+def scan_product_prefixe(ctx):
+    return post_json(ctx, '/api/scan-product', lambda i: {'code_barres': ctx.code_au_hasard(i)[:-2]})
+
+
+# API JSON (réponses conditionnelles)
+
+@scenario('api-produits')
+def api_produits(ctx):
+    return get(ctx, '/api/produits')
+
+
+def scenario_304(nom, chemin):
+    @scenario(nom)
+    def non_modifie(ctx):
+        etag = ctx.pilote.requete('GET', chemin).entetes.get('etag')
+        return get(ctx, chemin, statuts=(304,), entetes={'If-None-Match': etag})
+
+scenario_304('api-produits-304', '/api/produits')
+
+
+@scenario('api-stats')
+def api_stats(ctx):
+    return get(ctx, '/api/stats')
+
+scenario_304('api-stats-304', '/api/stats')
+
+
+@scenario('api-changes')
+def api_changes(ctx):
+    rev = json.loads(ctx.pilote.requete('GET', '/api/produits?limit=1').corps).get('rev', 0)
+    return get(ctx, f'/api/changes?since={max(rev - 100, 0)}')
+
+
+# Analyse des ventes (cumuls ; --ventes-jours à la génération pour un historique)
+
+@scenario('ventes-velocite-produit')
+def ventes_velocite_produit(ctx):
+    def requete(i):
+        return ctx.pilote.requete('GET', f'/api/ventes/velocite?produit_id={ctx.id_au_hasard(i)}&jours=365').statut == 200
+    return requete
+
+
+@scenario('ventes-velocite-categorie')
+def ventes_velocite_categorie(ctx):
+    categorie = ctx.categories[0] if ctx.categories else 'Autre'
+    return get(ctx, f'/api/ventes/velocite?categorie={quote(categorie)}&jours=365')
+
+
+@scenario('ventes-serie-produit')
+def ventes_serie_produit(ctx):
+    def requete(i):
+        return ctx.pilote.requete('GET', f'/api/ventes/serie?produit_id={ctx.id_au_hasard(i)}&jours=365').statut == 200
+    return requete
+
+
+@scenario('ventes-top-30j')
+def ventes_top_30j(ctx):
+    return get(ctx, '/api/ventes/top?jours=30')
+
+
+@scenario('ventes-top-an', part=0.1)
+def ventes_top_an(ctx):
+    return get(ctx, '/api/ventes/top?jours=365')
+
+
+# Codes-barres et export
+
+@scenario('generer-code')
+def generer_code(ctx):
+    def requete(i):
+        return ctx.pilote.requete('GET', f'/generer-code/{ctx.id_au_hasard(i)}').statut == 200
+    return requete
+
+
+@scenario('rendu-codes', pilotes=('client',))
+def rendu_codes(ctx):
+    """Encodage et rendu SVG hors cache mémoïsé (débit d'encodage pur)"""
+    rendre = ctx.pilote.app.rendre_code_barres.__wrapped__
+
+    def requete(i):
+        svg, etag = rendre(ctx.code_au_hasard(i), 'Produit')
+        return bool(svg)
+    return requete
+
+
+@scenario('codes-barres')
+def codes_barres(ctx):
+    return get(ctx, '/codes-barres')
+
+
+@scenario('export', part=0.02)
+def export(ctx):
+    return get(ctx, '/export')
+
+
+# Export complet dans un processus neuf : pic de mémoire anonyme (tas Python et SQLite, en Ko),
+# relevé tous les 100 morceaux ; les pages de la base projetées en mémoire (mmap) n'y comptent pas
+MESURE_EXPORT = """
+import json, re, resource, sys, time
+import app
+
+def memoire_ko():
+    try:
+        with open('/proc/self/status') as statut:
+            return int(re.search(r'RssAnon:\\s+(\\d+)', statut.read()).group(1))
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # hors Linux : pic, fichiers compris (octets sous macOS)
+
+reponse = app.app.test_client().get('/export', buffered=False)
+octets, pic, debut = 0, memoire_ko(), time.perf_counter()
+for numero, morceau in enumerate(reponse.response):
+    octets += len(morceau)
+    if sys.argv[1] == 'entete':
+        break
+    if numero % 100 == 0:
+        pic = max(pic, memoire_ko())
+reponse.close()
+print(json.dumps({'octets': octets, 'duree': time.perf_counter() - debut, 'memoire_ko': max(pic, memoire_ko())}))
+"""
+# Cache de pages SQLite (cache_size, ~32 Mo : rempli dès que la base dépasse mmap_size) plus une marge ;
+# au-delà, l'export ne tient plus en mémoire bornée (un export non streamé d'1M lignes : ~1 Go)
+CROISSANCE_MEMOIRE_EXPORT_MO = 64
+
+@scenario('export-memoire', dedie=True)
+def export_memoire(ctx):
+    """Pic de mémoire d'un export CSV complet, comparé au même export arrêté après le premier morceau
+
+    Streaming : l'écart reste borné par le cache de pages SQLite, quelle que soit la taille du
+    catalogue (à vérifier sur 1M produits).
+    """
+    env = dict(os.environ, BOUTIQUE_DB_PATH=ctx.chemin_base)
+
+    def mesurer(mode):
+        resultat = subprocess.run([sys.executable, '-c', MESURE_EXPORT, mode], cwd=RACINE, env=env,
+                                  capture_output=True, text=True)
+        if resultat.returncode != 0:
+            return None
+        return json.loads(resultat.stdout.strip().splitlines()[-1])
+
+    entete, complet = mesurer('entete'), mesurer('complet')
+    if not entete or not complet:
+        resume = resumer([], 1, 0)
+        resume['coherent'] = False
+        return resume
+    croissance_mo = (complet['memoire_ko'] - entete['memoire_ko']) / 1024
+    resume = resumer([complet['duree']], 0, complet['duree'], unites=ctx.nb_produits)
+    resume.update({'coherent': croissance_mo < CROISSANCE_MEMOIRE_EXPORT_MO, 'lignes': ctx.nb_produits,
+                   'octets': complet['octets'], 'memoire_entete_mo': round(entete['memoire_ko'] / 1024, 1),
+                   'memoire_complet_mo': round(complet['memoire_ko'] / 1024, 1),
+                   'croissance_memoire_mo': round(croissance_mo, 1)})
+    return resume
+
+
+# Écritures (en fin de parcours : elles modifient la base)
+
+@scenario('ajuster-stock', mutation=True)
+def ajuster_stock(ctx):
+    def requete(i):
+        reponse = ctx.pilote.requete(
+            'POST', '/api/ajuster-stock',
+            json={'produit_id': ctx.id_au_hasard(i), 'action': 'add', 'quantite': 1},
+            entetes={'Idempotency-Key': uuid.uuid4().hex})
+        return reponse.statut == 200 and json.loads(reponse.corps).get('success', False)
+    return requete
+
+
+TAILLE_LOT_SCAN = 20
+# Au-delà, une lecture a attendu derrière une écriture (scénario verrou-ecriture)
+LECTURE_LENTE_S = 0.5
+
+@scenario('scan-batch', mutation=True)
+def scan_batch(ctx):
+    """Lots de TAILLE_LOT_SCAN mouvements (une transaction par lot)"""
+    def construire(i):
+        return {'mouvements': [{'code': ctx.code_au_hasard(i * TAILLE_LOT_SCAN + j), 'action': 'add',
+                                'quantite': 1, 'cle': uuid.uuid4().hex}
+                               for j in range(TAILLE_LOT_SCAN)]}
+    return post_json(ctx, '/api/scan-batch', construire)
+
+
+# Mesures dédiées
+
+@scenario('rejeu-hors-ligne', dedie=True, mutation=True)
+def rejeu_hors_ligne(ctx):
+    """Coupures réseau simulées : chaque lot est envoyé, sa réponse perdue, puis rejoué
+
+    Le stock final doit refléter chaque mouvement une seule fois.
+    """
+    nb_lots = max(ctx.options['requetes'] // 10, 5)
+    code = ctx.codes[0]
+
+    def stock():
+        return json.loads(ctx.pilote.requete('POST', '/scan', json={'code': code}).corps)['produit']['stock']
+
+    def envoyer_sans_lire(lot):
+        if ctx.pilote.nom != 'http':
+            ctx.pilote.requete('POST', '/api/scan-batch', json=lot)  # réponse ignorée
+            return
+        # Requête envoyée puis connexion coupée avant la réponse
+        conn = ctx.pilote.connexion()
+        conn.request('POST', '/api/scan-batch', body=json.dumps(lot).encode('utf-8'),
+                     headers={'Content-Type': 'application/json'})
+        conn.close()
+
+    stock_initial = stock()
+    latences, rejoues = [], 0
+    debut = time.perf_counter()
+    for _ in range(nb_lots):
+        lot = {'mouvements': [{'code': code, 'action': 'add', 'quantite': 1, 'cle': uuid.uuid4().hex}
+                              for _ in range(TAILLE_LOT_SCAN)]}
+        envoyer_sans_lire(lot)
+        debut_rejeu = time.perf_counter()
+        reponse = json.loads(ctx.pilote.requete('POST', '/api/scan-batch', json=lot).corps)
+        latences.append(time.perf_counter() - debut_rejeu)
+        rejoues += reponse.get('nb_rejoues', 0)
+    duree = time.perf_counter() - debut
+
+    attendu = stock_initial + nb_lots * TAILLE_LOT_SCAN
+    ecart = stock() - attendu
+    resume = resumer(latences, abs(ecart), duree)
+    resume.update({'coherent': ecart == 0, 'ecart_stock': ecart, 'mouvements_rejoues': rejoues})
+    return resume
+
+
+@scenario('stock-concurrent', dedie=True, mutation=True)
+def stock_concurrent(ctx):
+    """Threads appliquant +1 puis -1 au même produit (API et scan en alternance), puis +1 chacun
+
+    Aucun mouvement perdu : stock final = stock initial + nombre de threads, registre compris.
+    """
+    nb_threads = max(ctx.options['concurrence'], 8)
+    nb_paires = max(ctx.options['requetes'] // (2 * nb_threads), 10)
+    produit_id, code = ctx.ids[0], ctx.codes[0]
+
+    def lire_base(requete, *parametres):
+        conn = sqlite3.connect(ctx.chemin_base, timeout=30)
+        try:
+            return conn.execute(requete, parametres).fetchone()
+        finally:
+            conn.close()
+
+    def mouvement(n, sens):
+        # Threads pairs : /api/ajuster-stock, impairs : /scan
+        if n % 2:
+            reponse = ctx.pilote.requete('POST', '/scan', json={
+                'code': code, 'action': 'ajouter' if sens > 0 else 'retirer', 'quantite': 1})
+        else:
+            reponse = ctx.pilote.requete('POST', '/api/ajuster-stock', json={
+                'produit_id': produit_id, 'action': 'add' if sens > 0 else 'remove', 'quantite': 1})
+        return reponse.statut == 200 and json.loads(reponse.corps).get('success', False)
+
+    latences, erreurs, verrou = [], [], threading.Lock()
+    depart = threading.Barrier(nb_threads, timeout=60)
+
+    def executer_thread(n):
+        depart.wait()
+        # Chaque thread a au plus une unité d'avance : le stock ne descend jamais sous l'initial
+        for sens in [1, -1] * nb_paires + [1]:
+            debut = time.perf_counter()
+            succes = mouvement(n, sens)
+            with verrou:
+                latences.append(time.perf_counter() - debut)
+                if not succes:
+                    erreurs.append(sens)
+
+    stock_initial = lire_base('SELECT stock FROM produits WHERE id = ?', produit_id)[0]
+    dernier_registre = lire_base('SELECT IFNULL(MAX(id), 0) FROM registre_stock')[0]
+    threads = [threading.Thread(target=executer_thread, args=(n,)) for n in range(nb_threads)]
+    debut = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duree = time.perf_counter() - debut
+
+    attendu = stock_initial + nb_threads
+    ecart = lire_base('SELECT stock FROM produits WHERE id = ?', produit_id)[0] - attendu
+    # Registre : somme des écarts égale au mouvement net, dernier stock inscrit égal au stock final
+    delta_registre, dernier_stock = lire_base(
+        'SELECT SUM(delta), (SELECT stock_apres FROM registre_stock WHERE produit_id = ?1 AND id > ?2 '
+        'ORDER BY id DESC LIMIT 1) FROM registre_stock WHERE produit_id = ?1 AND id > ?2',
+        produit_id, dernier_registre)
+    registre_coherent = delta_registre == nb_threads and dernier_stock == attendu
+    resume = resumer(latences, len(erreurs), duree)
+    resume.update({'coherent': ecart == 0 and not erreurs and registre_coherent, 'ecart_stock': ecart,
+                   'threads': nb_threads, 'mouvements': len(latences), 'registre_coherent': registre_coherent})
+    return resume
+
+
+@scenario('pagination-complete', dedie=True, mutation=True)
+def pagination_complete(ctx):
+    """Parcours complet de /api/produits par curseur sur chaque tri, avec des catégories et dates NULL
+
+    Chaque produit doit être vu exactement une fois, y compris après un curseur dont la valeur
+    de tri est NULL. Latence : une page. Les produits ajoutés sont retirés ensuite (les scénarios
+    suivants comptent le catalogue).
+    """
+    conn = sqlite3.connect(ctx.chemin_base)
+    try:
+        with conn:
+            conn.executemany('INSERT OR IGNORE INTO produits (nom, code_barres, prix, stock, categorie, date_creation) '
+                             'VALUES (?, ?, 1, 1, NULL, NULL)', [(f'Sans catégorie {i}', f'PAGNULL{i}') for i in range(3)])
+        attendus = {ligne[0] for ligne in conn.execute('SELECT id FROM produits')}
+    finally:
+        conn.close()
+
+    latences, erreurs, parcours = [], 0, {}
+    debut = time.perf_counter()
+    try:
+        for tri in TRIS:
+            for ordre in ('asc', 'desc'):
+                vus, curseur, limite = [], '', 1  # première page d'une ligne : en ordre croissant, curseur NULL
+                while True:
+                    debut_page = time.perf_counter()
+                    reponse = ctx.pilote.requete(
+                        'GET', f'/api/produits?sort={tri}&order={ordre}&limit={limite}&after={quote(curseur)}')
+                    limite = 500
+                    latences.append(time.perf_counter() - debut_page)
+                    page = json.loads(reponse.corps)
+                    vus.extend(produit['id'] for produit in page['produits'])
+                    curseur = page['next_cursor']
+                    if not curseur:
+                        break
+                complet = len(vus) == len(attendus) and set(vus) == attendus
+                erreurs += not complet
+                parcours[f'{tri}-{ordre}'] = {'vus': len(vus), 'complet': complet}
+    finally:
+        conn = sqlite3.connect(ctx.chemin_base, timeout=30)
+        try:
+            with conn:
+                conn.execute("DELETE FROM produits WHERE code_barres LIKE 'PAGNULL%'")
+        finally:
+            conn.close()
+    resume = resumer(latences, erreurs, time.perf_counter() - debut)
+    resume.update({'coherent': not erreurs, 'produits': len(attendus), 'parcours': parcours})
+    return resume
+
+
+@scenario('verrou-ecriture', pilotes=('http',), dedie=True, mutation=True)
+def verrou_ecriture(ctx):
+    """Lectures servies pendant qu'un autre processus tient le verrou d'écriture (import, recalcul)
+
+    Des mouvements de stock attendent le verrou (busy timeout) ; les lectures envoyées pendant
+    ce temps ne doivent pas attendre avec eux. Une lecture de plus de LECTURE_LENTE_S compte
+    comme erreur : c'est ce qui arrive avec des workers gevent, que sqlite3 bloque en entier.
+    """
+    duree_verrou = 2.0
+    nb_lecteurs = 4
+    script = ('import sqlite3, sys, time\n'
+              'conn = sqlite3.connect(sys.argv[1], isolation_level=None)\n'
+              'conn.execute("BEGIN IMMEDIATE")\n'
+              'print("verrou", flush=True)\n'
+              'time.sleep(float(sys.argv[2]))\n'
+              'conn.execute("ROLLBACK")\n')
+    latences, verrou_lat = [], threading.Lock()
+    connectes = threading.Barrier(nb_lecteurs + 1, timeout=60)
+    verrou = None
+
+    def lire():
+        # Connexion (persistante) ouverte avant les écritures : répartie sur les workers
+        ctx.pilote.requete('GET', '/api/produits?limit=20')
+        connectes.wait()
+        connectes.wait()
+        while verrou.poll() is None:
+            debut_lecture = time.perf_counter()
+            ctx.pilote.requete('GET', '/api/produits?limit=20')
+            with verrou_lat:
+                latences.append(time.perf_counter() - debut_lecture)
+            time.sleep(0.05)
+
+    def ecrire(n):
+        ctx.pilote.requete('POST', '/api/ajuster-stock',
+                           json={'produit_id': ctx.id_au_hasard(n), 'action': 'add', 'quantite': 1},
+                           entetes={'Idempotency-Key': uuid.uuid4().hex})
+
+    lecteurs = [threading.Thread(target=lire) for _ in range(nb_lecteurs)]
+    for thread in lecteurs:
+        thread.start()
+    connectes.wait()
+    verrou = subprocess.Popen([sys.executable, '-c', script, ctx.chemin_base, str(duree_verrou)],
+                              stdout=subprocess.PIPE, text=True)
+    verrou.stdout.readline()
+    debut = time.perf_counter()
+    connectes.wait()
+    # Plusieurs écritures par worker : chacun en a au moins une en attente du verrou
+    ecrivains = [threading.Thread(target=ecrire, args=(n,)) for n in range(4 * (ctx.pilote.workers or 2))]
+    for thread in ecrivains:
+        thread.start()
+    for thread in lecteurs + ecrivains:
+        thread.join()
+    verrou.wait()
+    lentes = sum(latence > LECTURE_LENTE_S for latence in latences)
+    resume = resumer(latences, lentes, time.perf_counter() - debut)
+    resume.update({'coherent': not lentes, 'verrou_s': duree_verrou, 'lectures_lentes': lentes})
+    return resume
+
+
+@scenario('sse-diffusion', pilotes=('http',), dedie=True, mutation=True)
+def sse_diffusion(ctx):
+    """Délai entre un mouvement de stock et sa réception par N flux /api/changes/stream ouverts"""
+    nb_flux = ctx.options['flux']
+    prets = threading.Barrier(nb_flux + 1, timeout=60)
+    declenchement = threading.Event()
+    receptions, echecs = [], [0]
+    verrou = threading.Lock()
+    debut = [0.0]
+
+    def abonne():
+        conn = ctx.pilote.connexion(timeout=30)
+        try:
+            conn.request('GET', '/api/changes/stream')
+            reponse = conn.getresponse()
+            reponse.readline()  # "retry: ..." : flux ouvert
+            prets.wait()
+            declenchement.wait()
+            while True:
+                ligne = reponse.readline()
+                if not ligne:
+                    raise ConnectionError('flux fermé')
+                if ligne.startswith(b'event: stock'):
+                    with verrou:
+                        receptions.append(time.perf_counter() - debut[0])
+                    return
+        except Exception:
+            with verrou:
+                echecs[0] += 1
+            try:
+                prets.abort()
+            except threading.BrokenBarrierError:
+                pass
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=abonne, daemon=True) for _ in range(nb_flux)]
+    for thread in threads:
+        thread.start()
+    try:
+        prets.wait()
+    except threading.BrokenBarrierError:
+        pass
+    debut[0] = time.perf_counter()
+    declenchement.set()
+    ctx.pilote.requete('POST', '/api/ajuster-stock',
+                       json={'produit_id': ctx.ids[0], 'action': 'add', 'quantite': 1})
+    for thread in threads:
+        thread.join(30)
+    resume = resumer(receptions, nb_flux - len(receptions), max(receptions, default=0))
+    resume['flux'] = nb_flux
+    return resume
+
+
+def ecarts_stats_categories(chemin_base):
+    """Catégories dont les statistiques tenues par triggers diffèrent d'un recalcul sur produits"""
+    conn = sqlite3.connect(chemin_base, timeout=30)
+    try:
+        attendues = {ligne[0]: ligne[1:] for ligne in conn.execute(
+            """SELECT IFNULL(categorie, ''), COUNT(*), SUM(stock = 0), SUM(stock > 0 AND stock <= seuil_reappro),
+                      SUM(stock), SUM(stock * prix) FROM produits GROUP BY 1""")}
+        stockees = {ligne[0]: ligne[1:] for ligne in conn.execute(
+            'SELECT categorie, nb, ruptures, stock_faible, stock_total, valeur FROM stats_categories WHERE nb != 0')}
+    finally:
+        conn.close()
+    return sorted(categorie for categorie in set(attendues) | set(stockees)
+                  if categorie not in attendues or categorie not in stockees
+                  or attendues[categorie][:4] != stockees[categorie][:4]
+                  or abs(attendues[categorie][4] - stockees[categorie][4]) > 0.01)
+
+
+@scenario('import', dedie=True, mutation=True)
+def import_ndjson(ctx):
+    """Réimport NDJSON (POST /import) des premières lignes du catalogue : débit en lignes/s
+
+    Des mouvements de stock sont envoyés en parallèle : les statistiques par catégorie
+    (triggers) doivent rester égales à un recalcul une fois tout écrit.
+    """
+    catalogue = ctx.catalogue or {'categories': 20, 'formats': ['ean13', 'code128', 'interne'],
+                                  'distribution': 'longue-traine', 'graine': 42}
+    # Lignes déjà au catalogue généré (les produits d'exemple de la base n'en font pas partie) :
+    # un réimport ne crée aucun produit
+    nb_lignes = min(ctx.options['lignes_import'], catalogue.get('produits', ctx.nb_produits))
+    alea = random.Random(catalogue['graine'])
+    lignes = lignes_catalogue(nb_lignes, noms_categories(catalogue['categories']),
+                              catalogue['formats'], catalogue['distribution'], alea)
+    corps = '\n'.join(json.dumps(donnees) for _, donnees in lignes).encode('utf-8')
+
+    fin = threading.Event()
+    mouvements = []
+
+    def ajuster():
+        while not fin.is_set():
+            reponse = ctx.pilote.requete('POST', '/api/ajuster-stock', json={
+                'produit_id': ctx.id_au_hasard(len(mouvements)), 'action': 'add', 'quantite': 1})
+            mouvements.append(reponse.statut == 200)
+
+    ecrivain = threading.Thread(target=ajuster)
+    ecrivain.start()
+    latences, erreurs = [], 0
+    try:
+        for _ in range(3):
+            debut = time.perf_counter()
+            reponse = ctx.pilote.requete('POST', '/import?format=ndjson', donnees=corps,
+                                         entetes={'Content-Type': 'application/x-ndjson'})
+            latences.append(time.perf_counter() - debut)
+            rapport = json.loads(reponse.corps)
+            erreurs += not rapport.get('success') or rapport.get('importees') != nb_lignes
+    finally:
+        fin.set()
+        ecrivain.join()
+    ecarts = ecarts_stats_categories(ctx.chemin_base)
+    resume = resumer(latences, erreurs, sum(latences), unites=3 * nb_lignes)
+    resume.update({'lignes': nb_lignes, 'coherent': not ecarts and all(mouvements),
+                   'mouvements_paralleles': len(mouvements), 'categories_en_ecart': ecarts})
+    return resume
+
+
+@scenario('amplification-ecriture', dedie=True, mutation=True)
+def amplification_ecriture(ctx):
+    """Pages écrites dans le WAL par mouvement de stock : entrée seule, lot, vente (sortie seule)
+
+    WAL vidé (checkpoint TRUNCATE) avant chaque envoi : sa taille après l'envoi compte les
+    pages de la transaction (produit, index, statistiques, journal, registre, idempotence).
+    """
+    nb_envois = max(min(ctx.options['requetes'], 200) // 2, 5)
+    conn = sqlite3.connect(ctx.chemin_base, timeout=30)
+    taille_page = conn.execute('PRAGMA page_size').fetchone()[0]
+    chemin_wal = ctx.chemin_base + '-wal'
+
+    def pages_ecrites(envoyer):
+        occupe, _, _ = conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+        if occupe:
+            return None  # un lecteur retient le WAL : mesure ignorée
+        envoyer()
+        taille = os.path.getsize(chemin_wal) if os.path.exists(chemin_wal) else 0
+        return max(taille - 32, 0) // (taille_page + 24)  # en-tête du WAL, puis une trame par page
+
+    def succes(reponse):
+        return reponse.statut == 200 and json.loads(reponse.corps).get('success', False)
+
+    def seul(i):
+        debut_envoi = time.perf_counter()
+        reponse = ctx.pilote.requete('POST', '/api/ajuster-stock',
+                                     json={'produit_id': ctx.id_au_hasard(i), 'action': 'add', 'quantite': 1})
+        latences.append(time.perf_counter() - debut_envoi)
+        return succes(reponse)
+
+    def lot(i):
+        return succes(ctx.pilote.requete('POST', '/api/scan-batch', json={'mouvements': [
+            {'code': ctx.code_au_hasard(i * TAILLE_LOT_SCAN + j), 'action': 'add', 'quantite': 1}
+            for j in range(TAILLE_LOT_SCAN)]}))
+
+    def vente(i):
+        # Retire l'unité ajoutée par seul(i) : une sortie, cumulée dans les ventes
+        return succes(ctx.pilote.requete('POST', '/api/ajuster-stock',
+                                         json={'produit_id': ctx.id_au_hasard(i), 'action': 'remove', 'quantite': 1}))
+
+    latences, pages_seul, pages_lot, pages_vente, erreurs = [], [], [], [], 0
+    debut = time.perf_counter()
+    try:
+        for i in range(nb_envois):
+            for envoyer, pages in ((seul, pages_seul), (lot, pages_lot), (vente, pages_vente)):
+                ok = []
+                nombre = pages_ecrites(lambda: ok.append(envoyer(i)))
+                if nombre is None or not all(ok):
+                    erreurs += 1
+                else:
+                    pages.append(nombre)
+    finally:
+        conn.close()
+    duree = time.perf_counter() - debut
+
+    resume = resumer(latences, erreurs, duree)
+    resume['taille_page'] = taille_page
+    if pages_seul:
+        resume['pages_par_mouvement'] = round(sum(pages_seul) / len(pages_seul), 2)
+        resume['octets_wal_par_mouvement'] = round(resume['pages_par_mouvement'] * (taille_page + 24))
+    if pages_lot:
+        resume['pages_par_mouvement_lot'] = round(sum(pages_lot) / len(pages_lot) / TAILLE_LOT_SCAN, 2)
+        resume['octets_wal_par_mouvement_lot'] = round(resume['pages_par_mouvement_lot'] * (taille_page + 24))
+    if pages_vente:
+        resume['pages_par_vente'] = round(sum(pages_vente) / len(pages_vente), 2)
+    return resume
+
+
+@scenario('recalcul-seuils', dedie=True, mutation=True)
+def recalcul_seuils(ctx):
+    """Recalcul des seuils de réapprovisionnement de tout le catalogue, calcul NumPy puis Python pur
+
+    Chaque passe tourne dans un nouveau processus et réécrit tous les produits ayant assez
+    d'historique (demande_jour invalidée avant la passe) : lecture des ventes, calcul, écriture
+    et verrou d'écriture sont chronométrés.
+    """
+    script = (
+        'import json, sys, app\n'
+        'if sys.argv[1] == "python":\n'
+        '    app.numpy = None\n'
+        'elif app.numpy is None:\n'
+        '    print("null"); sys.exit()\n'
+        'conn = app.db_pool.acquire()\n'
+        'with conn:\n'
+        '    conn.execute("UPDATE produits SET demande_jour = -1")\n'
+        'print(json.dumps(app.recalculer_seuils(conn)))\n'
+    )
+    env = dict(os.environ, BOUTIQUE_DB_PATH=ctx.chemin_base)
+    latences, erreurs, passes = [], 0, {}
+    for moteur in ('numpy', 'python'):
+        resultat = subprocess.run([sys.executable, '-c', script, moteur], cwd=RACINE, env=env,
+                                  capture_output=True, text=True)
+        if resultat.returncode != 0:
+            erreurs += 1
+            continue
+        rapport = json.loads(resultat.stdout.strip().splitlines()[-1])
+        if rapport is None or rapport['calcul'] is None:
+            continue  # NumPy absent, ou base sans historique de ventes
+        duree = rapport['lecture'] + rapport['duree_calcul'] + rapport['ecriture']
+        latences.append(duree)
+        erreurs += rapport['modifies'] != rapport['calcules']
+        passes[moteur] = {'vendus': rapport['vendus'], 'calcules': rapport['calcules'], 'lecture_s': rapport['lecture'],
+                          'calcul_s': rapport['duree_calcul'], 'ecriture_s': rapport['ecriture'],
+                          'verrou_s': rapport['verrou'], 'total_s': round(duree, 3)}
+    resume = resumer(latences, erreurs, sum(latences), unites=ctx.nb_produits * len(latences))
+    resume['produits'] = ctx.nb_produits
+    resume['passes'] = passes
+    return resume
+
+
+@scenario('taches-concurrentes', dedie=True, mutation=True)
+def taches_concurrentes(ctx):
+    """Soumissions concurrentes à la file des tâches de fond, servie par deux pools
+
+    Instantanés du stock et exports soumis depuis plusieurs threads (certains annulés aussitôt,
+    quelques exports invalides) ; un second pool tourne dans un processus flask taches.
+    Vérifie que chaque tâche s'exécute une seule fois : autant d'instantanés que de tâches
+    instantane-stock terminées, une tentative par tâche, exports téléchargeables.
+    Latence : de la soumission à l'état final observé.
+    """
+    nb_taches = max(ctx.options['requetes'] // 4, 20)
+    conn = sqlite3.connect(ctx.chemin_base)
+    try:
+        instantanes_avant = conn.execute('SELECT IFNULL(MAX(id), 0) FROM instantanes_stock').fetchone()[0]
+    finally:
+        conn.close()
+
+    if ctx.pilote.nom == 'client':
+        ctx.pilote.app.pool_taches.demarrer()
+    # Second pool (le pilote http a déjà celui lancé par gunicorn.conf.py avec BOUTIQUE_TACHES=1)
+    pool = subprocess.Popen([sys.executable, '-m', 'flask', '--app', 'app', 'taches', '--threads', '2'],
+                            cwd=RACINE, env=dict(os.environ, BOUTIQUE_DB_PATH=ctx.chemin_base),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def demande(i):
+        if i % 10 == 9:
+            return {'type': 'export', 'parametres': {'colonnes': 'nom,inconnue'}}
+        if i % 3 == 2:
+            return {'type': 'export', 'parametres': {'colonnes': 'nom,code_barres,stock'}}
+        return {'type': 'instantane-stock'}
+
+    soumises, erreurs = {}, 0
+    verrou = threading.Lock()
+
+    def soumettre(debut_plage):
+        nonlocal erreurs
+        for i in range(debut_plage, nb_taches, 8):
+            reponse = ctx.pilote.requete('POST', '/api/jobs', json=demande(i))
+            if reponse.statut != 202:
+                with verrou:
+                    erreurs += 1
+                continue
+            tache = json.loads(reponse.corps)['tache']
+            annulee = i % 7 == 6
+            if annulee:
+                ctx.pilote.requete('POST', f"/api/jobs/{tache['id']}/annuler")
+            with verrou:
+                soumises[tache['id']] = {'demande': demande(i), 'debut': time.perf_counter(), 'annulee': annulee}
+
+    threads = [threading.Thread(target=soumettre, args=(n,)) for n in range(8)]
+    try:
+        # Soumissions refusées (503) tant qu'aucun pool n'a donné signe de vie : attendre les deux
+        fin_attente = time.monotonic() + 30
+        while json.loads(ctx.pilote.requete('GET', '/api/jobs?limit=1').corps).get('pools_actifs', 0) < 2:
+            if time.monotonic() > fin_attente:
+                raise RuntimeError('pools de tâches non démarrés après 30 s')
+            time.sleep(0.1)
+
+        debut = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Suivi de chaque tâche jusqu'à son état final
+        finales, latences = {}, []
+        echeance = time.monotonic() + 300
+        while len(finales) < len(soumises) and time.monotonic() < echeance:
+            for tache_id, suivi in soumises.items():
+                if tache_id in finales:
+                    continue
+                tache = json.loads(ctx.pilote.requete('GET', f'/api/jobs/{tache_id}').corps)['tache']
+                if tache['statut'] in ('terminee', 'echouee', 'annulee'):
+                    finales[tache_id] = tache
+                    latences.append(time.perf_counter() - suivi['debut'])
+            time.sleep(0.05)
+        duree = time.perf_counter() - debut
+    finally:
+        pool.terminate()
+        pool.wait(30)
+        if ctx.pilote.nom == 'client':
+            ctx.pilote.app.pool_taches.arreter()
+
+    erreurs += len(soumises) - len(finales)
+    statuts, incoherences = {}, 0
+    for tache_id, tache in finales.items():
+        statuts[tache['statut']] = statuts.get(tache['statut'], 0) + 1
+        suivi = soumises[tache_id]
+        invalide = suivi['demande'].get('parametres', {}).get('colonnes') == 'nom,inconnue'
+        if tache['tentatives'] > 1:
+            incoherences += 1  # aucune de ces tâches n'échoue de façon transitoire
+        if invalide and tache['statut'] not in ('echouee', 'annulee'):
+            incoherences += 1
+        if not invalide and not suivi['annulee'] and tache['statut'] != 'terminee':
+            incoherences += 1
+        if tache['statut'] == 'terminee' and tache['type'] == 'export':
+            reponse = ctx.pilote.requete('GET', tache['resultat_url'])
+            lignes = reponse.corps.decode('utf-8-sig').count('\n') - 1
+            incoherences += reponse.statut != 200 or lignes != ctx.nb_produits
+
+    conn = sqlite3.connect(ctx.chemin_base)
+    try:
+        instantanes = conn.execute('SELECT COUNT(*) FROM instantanes_stock WHERE id > ?',
+                                   (instantanes_avant,)).fetchone()[0]
+    finally:
+        conn.close()
+    attendus = sum(1 for tache in finales.values()
+                   if tache['type'] == 'instantane-stock' and tache['statut'] == 'terminee')
+    incoherences += instantanes != attendus
+
+    resume = resumer(latences, erreurs + incoherences, duree)
+    resume.update({'coherent': not incoherences, 'taches': len(soumises), 'statuts': statuts,
+                   'instantanes': instantanes, 'instantanes_attendus': attendus})
+    return resume
+
+
+@scenario('demarrage', dedie=True)
+def demarrage(ctx):
+    """Import à froid de app.py (migrations vérifiées, caches vides) dans un nouveau processus"""
+    env = dict(os.environ, BOUTIQUE_DB_PATH=ctx.chemin_base)
+    latences, erreurs = [], 0
+    for _ in range(3):
+        debut = time.perf_counter()
+        resultat = subprocess.run([sys.executable, '-c', 'import app'], cwd=RACINE, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        latences.append(time.perf_counter() - debut)
+        erreurs += resultat.returncode != 0
+    return resumer(latences, erreurs, sum(latences))
+
+
+def selectionner(pilote, noms=None, exclure=()):
+    """Scénarios applicables au pilote, lectures d'abord et écritures ensuite"""
+    if noms:
+        inconnus = [nom for nom in noms if nom not in SCENARIOS]
+        if inconnus:
+            raise ValueError(f"Scénario(s) inconnu(s) : {', '.join(inconnus)}")
+    choisis = [nom for nom, definition in SCENARIOS.items()
+               if pilote in definition['pilotes'] and (not noms or nom in noms) and nom not in exclure]
+    return sorted(choisis, key=lambda nom: SCENARIOS[nom]['mutation'])
+
+
+def lancer_scenario(ctx, nom):
+    definition = SCENARIOS[nom]
+    if definition['dedie']:
+        return definition['fonction'](ctx)
+    requete = definition['fonction'](ctx)
+    nombre = max(int(ctx.options['requetes'] * definition['part']), 3)
+    resume = executer(requete, nombre, ctx.options['concurrence'],
+                      echauffement=min(ctx.options['echauffement'], nombre))
+    if nom == 'scan-batch':
+        resume['mouvements_par_seconde'] = round(resume['debit'] * TAILLE_LOT_SCAN, 1)
+    return resume
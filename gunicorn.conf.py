@@ -0,0 +1,46 @@
+# Configuration gunicorn (chargée automatiquement depuis le dossier courant)
+# BOUTIQUE_MODE_SERVEUR=wsgi (défaut) : app Flask, workers gthread (BOUTIQUE_WSGI_THREADS threads)
+# BOUTIQUE_MODE_SERVEUR=asgi : point d'entrée asgi_app, workers uvicorn
+# BOUTIQUE_MODE_SERVEUR=gevent : app Flask, workers gevent (sur demande, voir ci-dessous)
+import os
+
+mode = os.environ.get('BOUTIQUE_MODE_SERVEUR', 'wsgi').lower()
+
+if mode == 'asgi':
+    wsgi_app = 'app:asgi_app'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+elif mode == 'wsgi':
+    # Chaque flux SSE ou attente longue ouverte occupe un thread : mode asgi pour en tenir beaucoup
+    wsgi_app = 'app:app'
+    worker_class = 'gthread'
+    threads = int(os.environ.get('BOUTIQUE_WSGI_THREADS', '32'))
+elif mode == 'gevent':
+    # sqlite3 bloque sans rendre la main à gevent : une attente du verrou d'écriture (import,
+    # recalcul des seuils dans le processus des tâches) fige tout le worker, flux SSE compris
+    wsgi_app = 'app:app'
+    worker_class = 'gevent'
+    worker_connections = 1000
+else:
+    raise RuntimeError(f"BOUTIQUE_MODE_SERVEUR invalide : {mode} (wsgi, asgi ou gevent)")
+
+
+# Tâches de fond (exports, imports, planches, recalculs) : pool dans un processus à part,
+# hors des workers HTTP, lancé seulement avec BOUTIQUE_TACHES=1 (sinon : flask --app app taches, ou rien
+# si les routes ne sont jamais appelées avec ?tache=1)
+taches_activees = os.environ.get('BOUTIQUE_TACHES') == '1'
+threads_taches = int(os.environ.get('BOUTIQUE_TACHES_THREADS', '2'))
+
+
+def when_ready(server):
+    if taches_activees and threads_taches > 0:
+        import subprocess
+        import sys
+        server.processus_taches = subprocess.Popen(
+            [sys.executable, '-m', 'flask', '--app', 'app', 'taches', '--threads', str(threads_taches)])
+
+
+def on_exit(server):
+    processus = getattr(server, 'processus_taches', None)
+    if processus is not None:
+        processus.terminate()
+        processus.wait(30)
@@ -0,0 +1,62 @@
+"""Base de test commune : app.py choisit sa base une fois pour toutes, à l'import"""
+
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DOSSIER = tempfile.mkdtemp(prefix='boutique-tests-')
+
+# Avant l'import d'app.py (et hérité des processus lancés par les tests)
+os.environ['BOUTIQUE_DB_PATH'] = os.path.join(DOSSIER, 'boutique.db')
+os.environ.pop('BOUTIQUE_TACHES', None)
+os.environ.pop('BOUTIQUE_TACHES_PERIODIQUES', None)
+if RACINE not in sys.path:
+    sys.path.insert(0, RACINE)
+
+import app as app_module  # noqa: E402
+from benchmark.catalogue import generer_catalogue  # noqa: E402
+
+NB_PRODUITS = 5000
+_numeros = itertools.count(1)
+
+
+@pytest.fixture(scope='session', autouse=True)
+def catalogue():
+    """Catalogue synthétique reproductible, généré une fois pour toute la session"""
+    generer_catalogue(app_module, NB_PRODUITS)
+    yield
+    shutil.rmtree(DOSSIER, ignore_errors=True)
+
+
+@pytest.fixture
+def app():
+    return app_module
+
+
+@pytest.fixture
+def client():
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def conn():
+    connexion = app_module.db_pool.acquire()
+    yield connexion
+    app_module.db_pool.release(connexion)
+
+
+@pytest.fixture
+def nouveau_produit(client, conn):
+    """Crée un produit propre au test par /ajouter (stock initial inscrit au registre) ; renvoie son id"""
+    def creer(stock=0, prix=10.0, categorie='Tests'):
+        code = f'TEST{next(_numeros):08d}'
+        reponse = client.post('/ajouter', data={'nom': f'Produit de test {code}', 'prix': prix,
+                                                'stock': stock, 'categorie': categorie, 'code_barres': code})
+        assert reponse.status_code == 302
+        return conn.execute('SELECT id FROM produits WHERE code_barres = ?', (code,)).fetchone()['id']
+    return creer
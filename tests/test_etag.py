@@ -0,0 +1,32 @@
+"""Réponses conditionnelles des API JSON (ETag = génération du catalogue)"""
+
+import pytest
+
+ROUTES = ('/api/produits?limit=5', '/api/stats')
+
+
+@pytest.mark.parametrize('route', ROUTES)
+def test_etag_et_304(client, nouveau_produit, route):
+    produit_id = nouveau_produit(stock=10)
+    premiere = client.get(route)
+    assert premiere.status_code == 200
+    etag = premiere.headers['ETag']
+
+    # Même génération : 304 sans corps
+    inchange = client.get(route, headers={'If-None-Match': etag})
+    assert inchange.status_code == 304
+    assert inchange.data == b''
+    assert inchange.headers['ETag'] == etag
+
+    # ETag d'une autre génération : réponse complète
+    perime = client.get(route, headers={'If-None-Match': '"autre-generation"'})
+    assert perime.status_code == 200
+    assert perime.data == premiere.data
+
+    # Une écriture incrémente la génération : l'ancien ETag ne vaut plus
+    mouvement = client.post('/api/ajuster-stock', json={'produit_id': produit_id, 'action': 'add', 'quantite': 1})
+    assert mouvement.get_json()['success']
+    apres = client.get(route, headers={'If-None-Match': etag})
+    assert apres.status_code == 200
+    assert apres.headers['ETag'] != etag
+    assert client.get(route, headers={'If-None-Match': apres.headers['ETag']}).status_code == 304
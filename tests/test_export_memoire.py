@@ -0,0 +1,36 @@
+"""Mémoire d'un export CSV complet (streaming), mesurée dans un processus neuf"""
+
+import json
+import os
+import subprocess
+import sys
+
+from benchmark.scenarios import MESURE_EXPORT
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PRODUITS = 50000
+# Mémoire anonyme (RssAnon) du processus d'export complet : ~33 Mo mesurés (interpréteur, Flask,
+# app) ; les mêmes lignes lues d'un bloc puis écrites en CSV : ~68 Mo
+PLAFOND_MEMOIRE_MO = 48
+# Écart avec le même export arrêté au premier morceau : ~1 Mo mesuré (+36 Mo sans streaming)
+PLAFOND_CROISSANCE_MO = 8
+
+
+def test_export_complet_en_memoire_bornee(tmp_path):
+    base = str(tmp_path / 'export.db')
+    # Processus à part : app.py ne change pas de base une fois importé
+    subprocess.run([sys.executable, '-m', 'benchmark', 'generer', '--base', base, '--produits', str(PRODUITS)],
+                   cwd=RACINE, check=True, capture_output=True)
+    env = dict(os.environ, BOUTIQUE_DB_PATH=base)
+
+    def mesurer(mode):
+        resultat = subprocess.run([sys.executable, '-c', MESURE_EXPORT, mode], cwd=RACINE, env=env,
+                                  check=True, capture_output=True, text=True)
+        return json.loads(resultat.stdout.strip().splitlines()[-1])
+
+    entete, complet = mesurer('entete'), mesurer('complet')
+
+    assert complet['octets'] > PRODUITS * 50
+    assert complet['memoire_ko'] / 1024 < PLAFOND_MEMOIRE_MO
+    assert (complet['memoire_ko'] - entete['memoire_ko']) / 1024 < PLAFOND_CROISSANCE_MO
@@ -0,0 +1,48 @@
+"""Rejeu d'un mouvement par son Idempotency-Key (réponse perdue par le scanner hors ligne)"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import app as app_module
+
+
+def mouvements(conn, produit_id):
+    return conn.execute("SELECT COUNT(*) FROM registre_stock WHERE produit_id = ? AND source = 'api/ajuster-stock'",
+                        (produit_id,)).fetchone()[0]
+
+
+def stock(conn, produit_id):
+    return conn.execute('SELECT stock FROM produits WHERE id = ?', (produit_id,)).fetchone()['stock']
+
+
+def test_rejeu_apres_reponse_perdue(client, conn, nouveau_produit):
+    produit_id = nouveau_produit(stock=10)
+    corps = {'produit_id': produit_id, 'action': 'remove', 'quantite': 3}
+    entetes = {'Idempotency-Key': f'rejeu-{produit_id}'}
+
+    # Mouvement appliqué côté serveur, réponse jamais reçue par le client
+    perdue = client.post('/api/ajuster-stock', json=corps, headers=entetes)
+    assert perdue.get_json() == {'success': True, 'nouveau_stock': 7, 'action': 'remove', 'quantite': 3}
+    assert 'Idempotent-Replayed' not in perdue.headers
+
+    rejeu = client.post('/api/ajuster-stock', json=corps, headers=entetes)
+    assert rejeu.status_code == 200
+    assert rejeu.data == perdue.data
+    assert rejeu.headers['Idempotent-Replayed'] == 'true'
+    assert mouvements(conn, produit_id) == 1
+    assert stock(conn, produit_id) == 7
+
+
+def test_rejeux_simultanes(conn, nouveau_produit):
+    produit_id = nouveau_produit(stock=10)
+    corps = {'produit_id': produit_id, 'action': 'add', 'quantite': 2}
+    entetes = {'Idempotency-Key': f'simultane-{produit_id}'}
+
+    def envoyer(_):
+        return app_module.app.test_client().post('/api/ajuster-stock', json=corps, headers=entetes).data
+
+    with ThreadPoolExecutor(8) as threads:
+        reponses = list(threads.map(envoyer, range(8)))
+
+    assert len(set(reponses)) == 1
+    assert mouvements(conn, produit_id) == 1
+    assert stock(conn, produit_id) == 12
@@ -0,0 +1,21 @@
+"""Plans d'exécution des requêtes servies par les routes (même liste que flask verifier-plans)"""
+
+import pytest
+
+import app as app_module
+
+
+def parcours_produits(plan):
+    """Étapes qui lisent produits en entier dans l'ordre des lignes (SCAN sans index)
+
+    Un parcours dans l'ordre d'un index (page bornée par LIMIT, export complet trié) est permis.
+    """
+    return [etape for etape in plan
+            if etape.split()[:2] in (['SCAN', 'produits'], ['SCAN', 'p']) and 'INDEX' not in etape]
+
+
+@pytest.mark.parametrize('nom, query, params', app_module.requetes_des_routes(),
+                         ids=[nom for nom, _, _ in app_module.requetes_des_routes()])
+def test_aucun_parcours_complet_de_produits(conn, nom, query, params):
+    plan = [ligne[3] for ligne in conn.execute('EXPLAIN QUERY PLAN ' + query, params)]
+    assert not parcours_produits(plan), ' | '.join(plan)
@@ -0,0 +1,71 @@
+"""Mouvements concurrents sur un même produit, depuis plusieurs threads et plusieurs processus"""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import app as app_module
+
+THREADS = 6
+PROCESSUS = 3
+MOUVEMENTS = 60  # par thread ou processus
+
+
+def marteler(produit_id, mouvements, depart):
+    """Applique [(action, quantite)] un à un par mouvement_stock ; renvoie le nombre de refus"""
+    conn = app_module.db_pool.acquire()
+    refus = 0
+    try:
+        # Tous les threads et processus prêts (app importée) avant le premier mouvement
+        depart.wait(timeout=60)
+        for action, quantite in mouvements:
+            try:
+                app_module.mouvement_stock(conn, produit_id, action, quantite, 'tests')
+            except app_module.ErreurStock:
+                refus += 1
+    finally:
+        app_module.db_pool.release(conn)
+    return refus
+
+
+def lancer(produit_id, mouvements):
+    """Mêmes mouvements dans THREADS threads de ce processus et PROCESSUS processus neufs, en même temps"""
+    contexte = multiprocessing.get_context('spawn')
+    with contexte.Manager() as gestionnaire, \
+            ProcessPoolExecutor(PROCESSUS, mp_context=contexte) as processus, \
+            ThreadPoolExecutor(THREADS) as threads:
+        depart = gestionnaire.Barrier(PROCESSUS + THREADS + 1)
+        futures = [processus.submit(marteler, produit_id, mouvements, depart) for _ in range(PROCESSUS)]
+        futures += [threads.submit(marteler, produit_id, mouvements, depart) for _ in range(THREADS)]
+        depart.wait(timeout=60)
+        return sum(future.result() for future in futures)
+
+
+def etat(conn, produit_id):
+    stock = conn.execute('SELECT stock FROM produits WHERE id = ?', (produit_id,)).fetchone()['stock']
+    registre = conn.execute('SELECT IFNULL(SUM(delta), 0) FROM registre_stock WHERE produit_id = ?',
+                            (produit_id,)).fetchone()[0]
+    return stock, registre
+
+
+def test_ajouts_et_retraits_concurrents(conn, nouveau_produit):
+    produit_id = nouveau_produit(stock=1000)
+    # +2 puis -1 : chaque thread ou processus ajoute MOUVEMENTS // 2 unités au total
+    mouvements = [('ajouter', 2) if i % 2 == 0 else ('retirer', 1) for i in range(MOUVEMENTS)]
+
+    refus = lancer(produit_id, mouvements)
+
+    assert refus == 0
+    assert etat(conn, produit_id) == (1000 + (THREADS + PROCESSUS) * MOUVEMENTS // 2,) * 2
+    assert app_module.verifier_stats_stock(conn) == []
+
+
+def test_retraits_concurrents_sans_survente(conn, nouveau_produit):
+    stock_initial = 100
+    produit_id = nouveau_produit(stock=stock_initial)
+    mouvements = [('retirer', 1)] * MOUVEMENTS
+
+    refus = lancer(produit_id, mouvements)
+
+    # Exactement stock_initial retraits acceptés, les autres refusés : jamais de stock négatif
+    assert refus == (THREADS + PROCESSUS) * MOUVEMENTS - stock_initial
+    assert etat(conn, produit_id) == (0, 0)
@@ -0,0 +1,100 @@
+"""File des tâches de fond : soumissions concurrentes, deux pools sur la même base"""
+
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import app as app_module
+
+SOUMETTEURS = 4
+TACHES_PAR_SOUMETTEUR = 25
+
+executions = Counter()
+_executions_lock = threading.Lock()
+
+
+@app_module.type_tache('test-execution', parametres=('numero',), api=False)
+def tache_test_execution(conn, tache, numero):
+    with _executions_lock:
+        executions[tache.id] += 1
+    time.sleep(0.005)
+    return {'numero': numero}
+
+
+def soumettre(numero_soumetteur):
+    conn = app_module.db_pool.acquire()
+    try:
+        return [app_module.soumettre_tache(conn, 'test-execution', {'numero': numero_soumetteur * 1000 + i})
+                for i in range(TACHES_PAR_SOUMETTEUR)]
+    finally:
+        app_module.db_pool.release(conn)
+
+
+def attendre_fin(conn, ids, delai=60):
+    marqueurs = ','.join('?' * len(ids))
+    fin = time.monotonic() + delai
+    while time.monotonic() < fin:
+        restantes = conn.execute(f"SELECT COUNT(*) FROM taches WHERE id IN ({marqueurs}) "
+                                 "AND statut IN ('en_attente', 'en_cours')", ids).fetchone()[0]
+        if not restantes:
+            return
+        time.sleep(0.05)
+    raise AssertionError(f'{restantes} tâche(s) non terminée(s) après {delai} s')
+
+
+def test_deux_pools_chaque_tache_reclamee_une_fois(conn):
+    pools = [app_module.PoolTaches(threads=3, intervalle=0.05) for _ in range(2)]
+    for pool in pools:
+        pool.demarrer()
+    try:
+        with ThreadPoolExecutor(SOUMETTEURS) as soumetteurs:
+            ids = [tache_id for lot in soumetteurs.map(soumettre, range(SOUMETTEURS)) for tache_id in lot]
+        attendre_fin(conn, ids)
+    finally:
+        for pool in pools:
+            pool.arreter()
+
+    assert len(set(ids)) == SOUMETTEURS * TACHES_PAR_SOUMETTEUR
+    assert {tache_id: executions[tache_id] for tache_id in ids} == {tache_id: 1 for tache_id in ids}
+    marqueurs = ','.join('?' * len(ids))
+    lignes = conn.execute(f'SELECT statut, tentatives, COUNT(*) FROM taches WHERE id IN ({marqueurs}) '
+                          'GROUP BY statut, tentatives', ids).fetchall()
+    assert [tuple(ligne) for ligne in lignes] == [('terminee', 1, len(ids))]
+    # Les deux pools ont travaillé
+    assert all(pool.executees > 0 for pool in pools)
+
+
+SOUMISSIONS = (
+    ('GET', '/export?tache=1', {}),
+    ('GET', '/codes-barres/planche?tache=1', {}),
+    ('GET', '/init-codes-barres?tache=1', {}),
+    ('POST', '/import?tache=1', {'data': 'nom,code_barres,prix\nTest,TACHE0001,1.5\n', 'content_type': 'text/csv'}),
+    ('POST', '/api/jobs', {'json': {'type': 'instantane-stock'}}),
+)
+
+
+def test_soumissions_refusees_sans_pool(client, conn):
+    conn.execute('DELETE FROM pools_taches')
+    conn.commit()
+    avant = conn.execute('SELECT COUNT(*) FROM taches').fetchone()[0]
+
+    for methode, route, options in SOUMISSIONS:
+        reponse = client.open(route, method=methode, **options)
+        assert reponse.status_code == 503, route
+        assert 'aucun pool actif' in reponse.get_json()['error']
+
+    assert conn.execute('SELECT COUNT(*) FROM taches').fetchone()[0] == avant
+    assert client.get('/api/jobs').get_json()['pools_actifs'] == 0
+
+
+def test_signe_de_vie_du_pool(client):
+    pool = app_module.PoolTaches(threads=1, intervalle=0.05)
+    pool.demarrer()
+    try:
+        assert client.get('/api/jobs').get_json()['pools_actifs'] == 1
+        reponse = client.post('/api/jobs', json={'type': 'instantane-stock'})
+        assert reponse.status_code == 202
+    finally:
+        pool.arreter()
+    assert client.get('/api/jobs').get_json()['pools_actifs'] == 0